@@ -7,11 +7,32 @@ from config.settings import Config
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def preload():
+    """Load everything the app otherwise loads on first use.
+
+    Document backends, prompt templates and the n-gram model are lazy so a
+    worker that only humanizes never pays for them. A forking server can call
+    this once in the master (see gunicorn.conf.py) so every worker starts
+    with them already in shared memory.
+    """
+    from app.services.file_handler import load_backends
+    from app.services.providers import humanizer_prompt, revision_prompt, writer_prompt
+    from app.services.ngram import get_detector
+
+    load_backends()
+    humanizer_prompt()
+    writer_prompt()
+    revision_prompt()
+    get_detector()
+
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
     logger.info("Starting AtomHumanizer application...")
+
+    if app.config['PRELOAD']:
+        preload()
     
     # Initialize extensions
     CORS(app)
@@ -23,6 +44,11 @@ def create_app(config_class=Config):
     app.register_blueprint(main_bp)
     app.register_blueprint(api_bp, url_prefix='/api')
     
+    # Resume batch jobs still queued from a previous run
+    if app.config['BATCH_WORKERS']:
+        from app.services.batch import get_batch_processor
+        get_batch_processor().start()
+    
     @app.route('/health')
     def health():
         return {"status": "healthy", "version": "2.0.0"}
@@ -0,0 +1,35 @@
+import contextlib
+import logging
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from app import create_app
+from app.routes.async_api import (budget_exceeded, document_not_found, invalid_version, version_conflict,
+                                  routes as async_api_routes)
+from app.services.async_providers import AsyncLLMFactory
+from app.services.doc_sessions import DocumentNotFound, InvalidVersion, VersionConflict
+from app.services.tokens import BudgetError
+from config.settings import Config
+
+logger = logging.getLogger(__name__)
+
+def create_asgi_app(config_class=Config):
+    """ASGI entry point: async streaming routes, with the Flask app mounted for everything else."""
+    flask_app = create_app(config_class)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        yield
+        await AsyncLLMFactory.reset()
+
+    logger.info("Serving streaming routes over ASGI")
+
+    return Starlette(
+        debug=config_class.DEBUG,
+        routes=[*async_api_routes, Mount('/', app=WSGIMiddleware(flask_app))],
+        lifespan=lifespan,
+        exception_handlers={BudgetError: budget_exceeded, DocumentNotFound: document_not_found,
+                            InvalidVersion: invalid_version, VersionConflict: version_conflict}
+    )
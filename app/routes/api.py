@@ -1,15 +1,54 @@
 from flask import Blueprint, request, jsonify, Response, stream_with_context, send_file
 from app.utils.rate_limit import rate_limit
-from app.services.providers import LLMFactory, HUMANIZER_PROMPT, WRITER_PROMPT, REVISION_PROMPT
-from app.services.analyzer import Analyzer
-from app.services.file_handler import FileHandler
+from app.services.providers import LLMFactory, router
+from app.services.prompts import build_humanize_prompts, build_write_prompt, build_edit_prompt, build_chat_prompt, is_question
+from app.services.analyzer import Analyzer, analysis_cache, analysis_prompt
+from app.services.revision import make_reviser
+from app.services.chunking import stream_chunks
+from app.services.batch import BatchError, get_batch_processor, parse_jobs
+from app.utils.sse import stream_events
+from config.settings import Config
+from app.services.file_handler import FileHandler, check_upload_size
+from app.services.file_pool import FileJobError
+from app.services.documents import MIMETYPES, humanize_document
+from app.services.tokens import BudgetError
+from app.services.scrubber import scrub_stream
+from app.services.patching import patch_edit, patch_events
+from app.services.doc_sessions import DocumentNotFound, InvalidVersion, VersionConflict, document_store, resolve_text, resolve_version
+from app.services.scheduler import BACKGROUND, scheduler
 import logging
 import json
+import os
 
 logger = logging.getLogger(__name__)
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+@api_bp.errorhandler(BudgetError)
+def budget_exceeded(e):
+    # Refused before any upstream call instead of returning a truncated answer
+    logger.warning(f"Prompt over budget: {e}")
+    return jsonify({"error": str(e)}), 413
+
+@api_bp.errorhandler(FileJobError)
+def file_job_failed(e):
+    # Oversized, timed out or out of memory in a file worker; the web worker itself is fine
+    logger.warning(f"File job failed ({e.status}): {e}")
+    return jsonify({"error": str(e)}), e.status
+
+@api_bp.errorhandler(DocumentNotFound)
+def document_not_found(e):
+    return jsonify({"error": str(e)}), 404
+
+@api_bp.errorhandler(InvalidVersion)
+def invalid_version(e):
+    return jsonify({"error": str(e)}), 400
+
+@api_bp.errorhandler(VersionConflict)
+def version_conflict(e):
+    # The client's copy is stale: it should fetch the latest version and reapply its change
+    return jsonify({"error": str(e)}), 409
+
 @api_bp.route('/humanize', methods=['POST'])
 @rate_limit(max_requests=10, window=60)
 def humanize():
@@ -25,34 +64,28 @@ def humanize():
         logger.warning("Missing text or API key in humanize request")
         return jsonify({"error": "Missing text or API key"}), 400
     
-    # Append text to the instructions
-    prompt = f"{HUMANIZER_PROMPT}\n\nINPUT TEXT TO REWRITE:\n{text}"
+    prompts = build_humanize_prompts(text, provider_name, model)
     
-    def generate():
-        try:
-            provider = LLMFactory.get_provider(provider_name)
-            
-            # Pass extra data for specific providers (like Ollama)
-            stream = provider.generate_stream(
-                prompt=prompt, 
-                api_key=api_key, 
-                model=model, 
-                base_url=data.get('ollamaUrl'), 
-                ollamaModel=data.get('ollamaModel')
-            )
-            
-            for chunk in stream:
-                if chunk:
-                    # Format as valid SSE
-                    yield f"data: {json.dumps({'chunk': chunk})}\n\n"
-            
-            yield "data: [DONE]\n\n"
-            
-        except Exception as e:
-            logger.error(f"Humanize error: {str(e)}", exc_info=True)
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    def open_stream(cancel):
+        provider = LLMFactory.get_provider(provider_name)
+        
+        # Pass extra data for specific providers (like Ollama)
+        request_kwargs = dict(
+            api_key=api_key, 
+            model=model, 
+            base_url=data.get('ollamaUrl'), 
+            ollamaModel=data.get('ollamaModel'),
+            cancel=cancel
+        )
+        if len(prompts) > 1:
+            # Long document: chunks run in parallel, streamed back in order
+            logger.info(f"Humanize: chunked into {len(prompts)} parts")
+            stream = stream_chunks(provider, prompts, **request_kwargs)
+        else:
+            stream = provider.generate_stream(prompt=prompts[0], **request_kwargs)
+        return scrub_stream(stream, data.get('scrub'))
 
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    return Response(stream_with_context(stream_events(open_stream, 'Humanize')), mimetype='text/event-stream')
 
 @api_bp.route('/write', methods=['POST'])
 @rate_limit(max_requests=10, window=60)
@@ -68,31 +101,21 @@ def write():
     if not topic or not api_key:
         return jsonify({"error": "Missing topic or API key"}), 400
     
-    # Append topic to the instructions
-    prompt = f"{WRITER_PROMPT}\n\nTOPIC TO WRITE ABOUT:\n{topic}"
+    prompt = build_write_prompt(topic, provider_name, model)
     
-    def generate():
-        try:
-            provider = LLMFactory.get_provider(provider_name)
-            stream = provider.generate_stream(
-                prompt=prompt, 
-                api_key=api_key, 
-                model=model,
-                base_url=data.get('ollamaUrl'), 
-                ollamaModel=data.get('ollamaModel')
-            )
-            
-            for chunk in stream:
-                if chunk:
-                    yield f"data: {json.dumps({'chunk': chunk})}\n\n"
-            
-            yield "data: [DONE]\n\n"
-            
-        except Exception as e:
-            logger.error(f"Write error: {str(e)}", exc_info=True)
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    def open_stream(cancel):
+        provider = LLMFactory.get_provider(provider_name)
+        stream = provider.generate_stream(
+            prompt=prompt, 
+            api_key=api_key, 
+            model=model,
+            base_url=data.get('ollamaUrl'), 
+            ollamaModel=data.get('ollamaModel'),
+            cancel=cancel
+        )
+        return scrub_stream(stream, data.get('scrub'))
 
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    return Response(stream_with_context(stream_events(open_stream, 'Write')), mimetype='text/event-stream')
 
 @api_bp.route('/edit', methods=['POST'])
 @rate_limit(max_requests=20, window=60)
@@ -101,7 +124,7 @@ def edit_text():
     data = request.json
     instruction = data.get('instruction', '')
     text = data.get('text', '')
-    full_text = data.get('fullText', '')  # Optional: full document for context
+    full_text = resolve_text(data, 'fullText')  # Optional: full document for context (or docId + version)
     provider_name = data.get('provider', 'gemini')
     api_key = data.get('apiKey', '')
     model = data.get('model', 'gemini-3-flash-preview')
@@ -111,62 +134,27 @@ def edit_text():
     if not text or not api_key:
         return jsonify({"error": "Missing text or API key"}), 400
     
-    # Build a focused edit prompt
-    if full_text:
-        # Chat-based editing: modify specific part of full document
-        prompt = f"""GÖREV: Aşağıdaki TAM METİN içinde sadece belirtilen kısmı TALİMAT'a göre değiştir.
-
-TALİMAT: {instruction}
-
-TAM METİN:
-{full_text}
-
-ÇOK ÖNEMLİ KURALLAR:
-1. Sadece talimatla ilgili paragraf/cümleleri değiştir
-2. Diğer tüm paragrafları ve cümleleri KESİNLİKLE değiştirme, AYNEN koru
-3. Metnin TAMAMINI döndür (değişen + değişmeyenler birlikte)
-4. Hiçbir açıklama, giriş veya sonuç ekleme
-5. "İşte düzenlenmiş metin:" gibi ifadeler YAZMA
-
-Düzenlenmiş tam metin:"""
-    else:
-        # Selection-based editing: only modify selected text
-        prompt = f"""GÖREV: Aşağıdaki metni verilen talimata göre değiştir ve SADECE değiştirilmiş metni döndür.
-
-TALİMAT: {instruction if instruction else "Daha doğal ve akıcı yeniden yaz"}
-
-METİN: {text}
-
-KURALLAR:
-- SADECE düzenlenmiş metni döndür
-- Açıklama ekleme
-- Giriş cümlesi yazma
-- "İşte" gibi ifadeler kullanma
-
-ÇIKTI:"""
+    # With the full document, only the paragraphs around the selection are sent and patched back
+    patch = patch_edit(data, instruction, full_text, selection=text) if full_text else None
+    prompt = patch[0] if patch else build_edit_prompt(instruction, text, full_text, provider_name, model)
     
-    def generate():
-        try:
-            provider = LLMFactory.get_provider(provider_name)
-            stream = provider.generate_stream(
-                prompt=prompt, 
-                api_key=api_key, 
-                model=model,
-                base_url=data.get('ollamaUrl'), 
-                ollamaModel=data.get('ollamaModel')
-            )
-            
-            for chunk in stream:
-                if chunk:
-                    yield f"data: {json.dumps({'chunk': chunk})}\n\n"
-            
-            yield "data: [DONE]\n\n"
-            
-        except Exception as e:
-            logger.error(f"Edit error: {str(e)}", exc_info=True)
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    def open_stream(cancel):
+        provider = LLMFactory.get_provider(provider_name)
+        stream = provider.generate_stream(
+            prompt=prompt, 
+            api_key=api_key, 
+            model=model,
+            base_url=data.get('ollamaUrl'), 
+            ollamaModel=data.get('ollamaModel'),
+            cancel=cancel
+        )
+        return patch_events(stream, patch[1]) if patch else stream
 
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    if patch:
+        events = stream_events(open_stream, 'Edit', first_event={'type': 'patch'}, to_event=dict)
+    else:
+        events = stream_events(open_stream, 'Edit')
+    return Response(stream_with_context(events), mimetype='text/event-stream')
 
 @api_bp.route('/chat', methods=['POST'])
 @rate_limit(max_requests=30, window=60)
@@ -174,7 +162,7 @@ def chat_about_text():
     """Chat endpoint - can answer questions about the text or modify it."""
     data = request.json
     message = data.get('message', '')
-    text = data.get('text', '')
+    text = resolve_text(data)
     provider_name = data.get('provider', 'gemini')
     api_key = data.get('apiKey', '')
     model = data.get('model', 'gemini-3-flash-preview')
@@ -184,68 +172,36 @@ def chat_about_text():
     if not message or not api_key:
         return jsonify({"error": "Missing message or API key"}), 400
     
-    # Detect if this is a question or an edit command
-    question_keywords = ['ne', 'nedir', 'nasıl', 'neden', 'kim', 'hangi', 'kaç', 'anlatıyor', 'açıkla', 'özetle', 'anlat', '?']
-    is_question = any(kw in message.lower() for kw in question_keywords)
-    
-    if is_question:
-        # This is a question - answer it
-        prompt = f"""METİN:
-{text}
-
-KULLANICI SORUSU: {message}
-
-Bu metin hakkındaki soruyu kısa ve öz bir şekilde cevapla. Türkçe yaz."""
-        return_type = 'answer'
+    # Edit commands get back only the paragraphs that change ('patch'), unless editMode is 'full'
+    patch = None if is_question(message) else patch_edit(data, message, text)
+    if patch:
+        prompt, return_type = patch[0], 'patch'
     else:
-        # This is an edit command - modify the text
-        prompt = f"""GÖREV: Aşağıdaki metni verilen talimata göre düzenle.
-
-TALİMAT: {message}
-
-METİN:
-{text}
-
-ÇOK ÖNEMLİ KURALLAR:
-1. Sadece talimatla ilgili paragraf/cümleleri değiştir
-2. Diğer tüm paragrafları ve cümleleri KESİNLİKLE değiştirme, AYNEN koru
-3. Metnin TAMAMINI döndür (değişen + değişmeyenler birlikte)
-4. Hiçbir açıklama, giriş veya sonuç ekleme
-
-Düzenlenmiş tam metin:"""
-        return_type = 'edit'
+        prompt, return_type = build_chat_prompt(message, text, provider_name, model)
     
-    def generate():
-        try:
-            provider = LLMFactory.get_provider(provider_name)
-            stream = provider.generate_stream(
-                prompt=prompt, 
-                api_key=api_key, 
-                model=model,
-                base_url=data.get('ollamaUrl'), 
-                ollamaModel=data.get('ollamaModel')
-            )
-            
-            # Send the type first
-            yield f"data: {json.dumps({'type': return_type})}\n\n"
-            
-            for chunk in stream:
-                if chunk:
-                    yield f"data: {json.dumps({'chunk': chunk})}\n\n"
-            
-            yield "data: [DONE]\n\n"
-            
-        except Exception as e:
-            logger.error(f"Chat error: {str(e)}", exc_info=True)
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+    def open_stream(cancel):
+        provider = LLMFactory.get_provider(provider_name)
+        stream = provider.generate_stream(
+            prompt=prompt, 
+            api_key=api_key, 
+            model=model,
+            base_url=data.get('ollamaUrl'), 
+            ollamaModel=data.get('ollamaModel'),
+            cancel=cancel
+        )
+        return patch_events(stream, patch[1]) if patch else stream
 
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    if patch:
+        events = stream_events(open_stream, 'Chat', first_event={'type': return_type}, to_event=dict)
+    else:
+        events = stream_events(open_stream, 'Chat', first_event={'type': return_type})
+    return Response(stream_with_context(events), mimetype='text/event-stream')
 
 @api_bp.route('/check', methods=['POST'])
 @rate_limit(max_requests=20, window=60)
 def check_ai():
     data = request.json
-    text = data.get('text', '')
+    text = resolve_text(data)
     provider_name = data.get('provider', 'gemini')
     api_key = data.get('apiKey', '')
     model = data.get('model', 'gemini-3-flash-preview')
@@ -253,27 +209,115 @@ def check_ai():
     if not text:
         return jsonify({"error": "Missing text"}), 400
     
+    # Offline statistical detector: no upstream call at all (NumPy loads on first use)
+    if data.get('mode') == 'ngram':
+        from app.services.ngram import get_detector
+        detector = get_detector()
+        if detector is None:
+            return jsonify({"error": "N-gram model not available"}), 503
+        return jsonify(detector.score(text))
+    
     analyzer = Analyzer()
     result = analyzer.analyze(
         text, 
         provider_name=provider_name, 
         api_key=api_key, 
         model=model,
+        prescore=data.get('prescore'),
         base_url=data.get('ollamaUrl'),
         ollamaModel=data.get('ollamaModel')
     )
     
     return jsonify(result)
 
+@api_bp.route('/check/stream', methods=['POST'])
+@rate_limit(max_requests=20, window=60)
+def check_ai_stream():
+    """Like /check, but streams each sentence verdict as the model produces it.
+
+    Events are {"sentence": {...}} per sentence, then {"result": {...}} with the full verdict.
+    """
+    data = request.json
+    text = resolve_text(data)
+    provider_name = data.get('provider', 'gemini')
+    api_key = data.get('apiKey', '')
+    model = data.get('model', 'gemini-3-flash-preview')
+
+    if not text:
+        return jsonify({"error": "Missing text"}), 400
+    
+    if data.get('mode') == 'ngram':
+        from app.services.ngram import get_detector
+        detector = get_detector()
+        if detector is None:
+            return jsonify({"error": "N-gram model not available"}), 503
+        open_stream = lambda cancel: [('result', detector.score(text))]
+    else:
+        # An oversize text gets its 413 here, before the event stream has started
+        analysis_prompt(text, provider_name, model)
+
+        def open_stream(cancel):
+            return Analyzer().analyze_stream(
+                text,
+                provider_name=provider_name,
+                api_key=api_key,
+                model=model,
+                prescore=data.get('prescore'),
+                cancel=cancel,
+                base_url=data.get('ollamaUrl'),
+                ollamaModel=data.get('ollamaModel')
+            )
+    
+    return Response(
+        stream_with_context(stream_events(open_stream, 'Check', to_event=lambda event: {event[0]: event[1]})),
+        mimetype='text/event-stream'
+    )
+
+@api_bp.route('/check/cache', methods=['GET'])
+def check_cache_stats():
+    """Hit/miss counters for the analyzer result cache."""
+    return jsonify(analysis_cache.stats())
+
+def build_reviser(data):
+    """The auto-revise engine a request body asks for; ValueError for an unknown mode."""
+    provider_name = data.get('provider', 'gemini')
+    mode = data.get('mode', Config.AUTO_REVISE_MODE)
+    # Sentence-level mode ('incremental') only resends and re-scores flagged sentences;
+    # 'search' writes several drafts per round in parallel and keeps the best
+    extra = {'candidates': data.get('candidates')} if mode == 'search' else {}
+    return make_reviser(
+        mode,
+        Analyzer(),
+        provider_name,
+        LLMFactory.get_provider(provider_name),
+        prescore=data.get('prescore'),
+        scrub=data.get('scrub'),
+        api_key=data.get('apiKey', ''),
+        model=data.get('model', 'gemini-3-flash-preview'),
+        base_url=data.get('ollamaUrl'),
+        ollamaModel=data.get('ollamaModel'),
+        # Upstream slots go to interactive streams first (see scheduler)
+        priority=BACKGROUND,
+        **extra
+    )
+
+def save_revision(data, base_version, result):
+    """Save the revision as the session document's next version, unless it was edited meanwhile."""
+    doc_id = data.get('docId')
+    if not doc_id:
+        return
+    try:
+        result["version"] = document_store.update(doc_id, base_version, text=result["final_text"])
+    except VersionConflict as e:
+        logger.info(f"Auto-revise result not saved: {e}")
+
 @api_bp.route('/auto-revise', methods=['POST'])
 @rate_limit(max_requests=20, window=60)
 def auto_revise():
     """Auto-revise endpoint: Check AI score, revise if needed, repeat until target score."""
     data = request.json
-    text = data.get('text', '')
-    provider_name = data.get('provider', 'gemini')
+    text = resolve_text(data)
     api_key = data.get('apiKey', '')
-    model = data.get('model', 'gemini-3-flash-preview')
     target_score = data.get('targetScore', 15)
     max_iterations = data.get('maxIterations', 3)
     
@@ -282,71 +326,164 @@ def auto_revise():
     if not text or not api_key:
         return jsonify({"error": "Missing text or API key"}), 400
     
-    analyzer = Analyzer()
-    provider = LLMFactory.get_provider(provider_name)
+    try:
+        reviser = build_reviser(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    iterations = []
-    current_text = text
+    base_version = resolve_version(data)
+    result = reviser.run(text, target_score=target_score, max_iterations=max_iterations)
+    save_revision(data, base_version, result)
+    return jsonify(result)
+
+@api_bp.route('/auto-revise/stream', methods=['POST'])
+@rate_limit(max_requests=20, window=60)
+def auto_revise_stream():
+    """Like /auto-revise, but streams progress as it happens.
+
+    Events are {"iteration": {...}} as each round is scored, {"candidate": {...}}
+    as each search-mode draft is scored, then {"result": {...}}.
+    """
+    data = request.json
+    text = resolve_text(data)
+    api_key = data.get('apiKey', '')
+    target_score = data.get('targetScore', 15)
+    max_iterations = data.get('maxIterations', 3)
+
+    if not text or not api_key:
+        return jsonify({"error": "Missing text or API key"}), 400
+
+    try:
+        reviser = build_reviser(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    base_version = resolve_version(data)
+
+    def open_stream(cancel):
+        for kind, value in reviser.events(text, target_score, max_iterations, cancel=cancel):
+            if kind == 'result':
+                save_revision(data, base_version, value)
+            yield kind, value
+
+    return Response(
+        stream_with_context(stream_events(open_stream, 'Auto-revise', to_event=lambda event: {event[0]: event[1]})),
+        mimetype='text/event-stream'
+    )
+
+@api_bp.route('/documents', methods=['POST'])
+@rate_limit(max_requests=30, window=60)
+def create_document():
+    """Store a document server-side; later requests send {"docId", "version"} instead of its text."""
+    data = request.json
+    text = data.get('text', '')
+    if not text:
+        return jsonify({"error": "Missing text"}), 400
+    doc_id, version = document_store.create(text)
+    return jsonify({"docId": doc_id, "version": version}), 201
+
+@api_bp.route('/documents/<doc_id>', methods=['GET'])
+def get_document(doc_id):
+    """Text of a version (?version=N, default latest)."""
+    version = request.args.get('version', type=int)
+    text = document_store.text(doc_id, version)
+    head = document_store.head(doc_id)
+    return jsonify({"docId": doc_id, "version": head if version is None else version, "head": head, "text": text})
+
+@api_bp.route('/documents/<doc_id>', methods=['POST'])
+@rate_limit(max_requests=120, window=60)
+def update_document(doc_id):
+    """Commit a new version from {"baseVersion", "ops": [[start, end, text], ...]} or {"baseVersion", "text"}.
+
+    Ops are splices against baseVersion in UTF-16 code units (JavaScript string
+    indices). A stale baseVersion, or a "length" (of the new text, in the same
+    units) that the result doesn't have, gets 409.
+    """
+    data = request.json
+    base_version = data.get('baseVersion')
+    ops = data.get('ops')
+    if ops is None and 'text' not in data:
+        return jsonify({"error": "Missing ops or text"}), 400
+    try:
+        version = document_store.update(doc_id, int(base_version) if base_version is not None else None,
+                                        text=data.get('text'), splices=ops, length=data.get('length'))
+    except VersionConflict:
+        raise
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid ops: {e}"}), 400
+    return jsonify({"docId": doc_id, "version": version})
+
+@api_bp.route('/documents/<doc_id>', methods=['DELETE'])
+def delete_document(doc_id):
+    document_store.delete(doc_id)
+    return '', 204
+
+@api_bp.route('/providers/health', methods=['GET'])
+def providers_health():
+    """Rolling time-to-first-token and error rates per provider/model, as seen by the router."""
+    return jsonify(router.tracker.snapshot())
+
+@api_bp.route('/providers/scheduler', methods=['GET'])
+def providers_scheduler():
+    """Concurrency limit, calls in flight and queue depth per upstream lane (provider, key fingerprint, model)."""
+    return jsonify(scheduler.snapshot())
+
+@api_bp.route('/batch', methods=['POST'])
+@rate_limit(max_requests=5, window=60)
+def create_batch():
+    """Queue a JSONL file of jobs (humanize/write/check/auto-revise) for background processing."""
+    if 'file' in request.files:
+        lines = request.files['file'].stream.read().decode('utf-8', errors='ignore').splitlines()
+        defaults = request.form
+    else:
+        lines = request.get_data(as_text=True).splitlines()
+        defaults = request.args
     
-    for i in range(max_iterations):
-        # Step 1: Analyze current text
-        analysis = analyzer.analyze(
-            current_text,
-            provider_name=provider_name,
-            api_key=api_key,
-            model=model,
-            base_url=data.get('ollamaUrl'),
-            ollamaModel=data.get('ollamaModel')
-        )
-        
-        current_score = analysis.get('ai_score', 0)
-        iterations.append({
-            "iteration": i + 1,
-            "score": current_score,
-            "feedback": analysis.get('overall_feedback', '')
+    try:
+        jobs = parse_jobs(lines, defaults={
+            'provider': defaults.get('provider'),
+            'apiKey': defaults.get('apiKey'),
+            'model': defaults.get('model')
         })
-        
-        logger.info(f"Auto-revise iteration {i+1}: score={current_score}")
-        
-        # Step 2: If score is acceptable, stop
-        if current_score <= target_score:
-            break
-        
-        # Step 3: Create feedback string from sentence analysis
-        feedback_lines = []
-        for item in analysis.get('sentence_analysis', []):
-            if item.get('score', 0) > 30:  # Only include problematic sentences
-                feedback_lines.append(f"- Sentence: \"{item['sentence']}\" | Reason: {item['reason']}")
-        
-        feedback_str = "\n".join(feedback_lines) if feedback_lines else analysis.get('overall_feedback', 'General improvement needed.')
-        
-        # Step 4: Create revision prompt and call LLM
-        revision_prompt = REVISION_PROMPT.replace('{original_text}', current_text).replace('{feedback}', feedback_str)
-        
-        revised_text = ""
-        stream = provider.generate_stream(
-            prompt=revision_prompt,
-            api_key=api_key,
-            model=model,
-            base_url=data.get('ollamaUrl'),
-            ollamaModel=data.get('ollamaModel')
-        )
-        
-        for chunk in stream:
-            if chunk and not chunk.startswith("Error:"):
-                revised_text += chunk
-        
-        current_text = revised_text.strip()
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
     
-    return jsonify({
-        "final_text": current_text,
-        "final_score": iterations[-1]['score'] if iterations else 0,
-        "iterations": iterations
-    })
+    processor = get_batch_processor()
+    processor.start()
+    batch_id = processor.store.create_batch(jobs)
+    processor.notify()
+    
+    logger.info(f"Batch request: batch_id={batch_id}, jobs={len(jobs)}")
+    return jsonify({"batch_id": batch_id, "total": len(jobs)}), 202
+
+@api_bp.route('/batch/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    progress = get_batch_processor().store.progress(batch_id)
+    if progress is None:
+        return jsonify({"error": "Unknown batch"}), 404
+    return jsonify(progress)
+
+@api_bp.route('/batch/<batch_id>/results', methods=['GET'])
+def batch_results(batch_id):
+    """Stream finished job results as JSONL, in submission order."""
+    store = get_batch_processor().store
+    if store.progress(batch_id) is None:
+        return jsonify({"error": "Unknown batch"}), 404
+    
+    def generate():
+        for line in store.iter_results(batch_id):
+            yield json.dumps(line) + "\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={"Content-Disposition": f"attachment; filename=batch_{batch_id}.jsonl"}
+    )
 
 @api_bp.route('/upload', methods=['POST'])
 @rate_limit(max_requests=20, window=60)
 def upload_file():
+    check_upload_size(request.content_length)
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
     
@@ -358,12 +495,61 @@ def upload_file():
         try:
             content = FileHandler.parse_file(file)
             return jsonify({"text": content})
+        except FileJobError:
+            raise
         except Exception as e:
             logger.error(f"File upload error: {str(e)}", exc_info=True)
             return jsonify({"error": str(e)}), 500
             
     return jsonify({"error": "Invalid file type"}), 400
 
+@api_bp.route('/humanize/file', methods=['POST'])
+@rate_limit(max_requests=5, window=60)
+def humanize_file():
+    """Humanize an uploaded .docx/.pptx paragraph by paragraph and return the same file, formatting intact."""
+    check_upload_size(request.content_length)
+    file = request.files.get('file')
+    if not file or not file.filename:
+        return jsonify({"error": "No file part"}), 400
+    ext = file.filename.rsplit('.', 1)[-1].lower()
+    if ext not in MIMETYPES:
+        return jsonify({"error": "Only .docx and .pptx files can be humanized in place"}), 400
+
+    form = request.form
+    provider_name = form.get('provider', 'gemini')
+    api_key = form.get('apiKey', '')
+    model = form.get('model', 'gemini-3-flash-preview')
+    if not api_key:
+        return jsonify({"error": "Missing API key"}), 400
+    scrub = form.get('scrub')
+
+    logger.info(f"Humanize file request: provider={provider_name}, model={model}, file={file.filename}")
+    path = FileHandler.spool(file)
+    try:
+        output, stats = humanize_document(
+            path, ext,
+            LLMFactory.get_provider(provider_name),
+            provider_name,
+            model=model,
+            scrub=None if scrub is None else scrub == 'true',
+            api_key=api_key,
+            base_url=form.get('ollamaUrl'),
+            ollamaModel=form.get('ollamaModel'),
+            priority=BACKGROUND
+        )
+    except (BudgetError, FileJobError):
+        raise
+    except Exception as e:
+        logger.error(f"Humanize file error: {str(e)}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+    finally:
+        os.remove(path)
+
+    response = send_file(output, mimetype=MIMETYPES[ext], as_attachment=True, download_name=f'humanized_{file.filename}')
+    response.headers['X-Paragraphs-Rewritten'] = str(stats['rewritten'])
+    response.headers['X-Paragraphs-Failed'] = str(stats['failed'])
+    return response
+
 @api_bp.route('/download', methods=['POST'])
 @rate_limit(max_requests=20, window=60)
 def download_file():
@@ -390,6 +576,8 @@ def download_file():
             as_attachment=True,
             download_name=filename
         )
+    except FileJobError:
+        raise
     except Exception as e:
         logger.error(f"Download error: {str(e)}", exc_info=True)
         return jsonify({"error": str(e)}), 500
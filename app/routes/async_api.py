@@ -0,0 +1,197 @@
+"""ASGI (Starlette) versions of the streaming API routes.
+
+Same request/response contract as the Flask routes in api.py, but each
+stream is a coroutine instead of a blocked worker thread, so one process can
+hold hundreds of concurrent upstream generations.
+"""
+from functools import wraps
+import json
+import logging
+
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from app.utils.rate_limit import client_key, is_rate_limited
+from app.utils.metrics import RATE_LIMITED
+from app.utils.sse import record_cancellation
+from app.services.async_providers import AsyncLLMFactory
+from app.services.chunking import stream_chunks_async
+from app.services.scrubber import scrub_stream_async
+from app.services.doc_sessions import resolve_text
+from app.services.patching import patch_edit, patch_events_async
+from config.settings import Config
+from app.services.prompts import build_humanize_prompts, build_write_prompt, build_edit_prompt, build_chat_prompt, is_question
+
+logger = logging.getLogger(__name__)
+
+def rate_limit(max_requests=10, window=60):
+    def decorator(f):
+        scope = f.__name__
+        @wraps(f)
+        async def wrapped(request):
+            api_key = None
+            if Config.RATE_LIMIT_KEY == 'api_key':
+                # Starlette caches the parsed body, so the route can read it again
+                try:
+                    body = await request.json()
+                except ValueError:
+                    body = None
+                api_key = (body.get('apiKey') if isinstance(body, dict) else None) or request.headers.get('X-API-Key')
+            key = f"{scope}:{client_key(request.client.host, api_key)}"
+            # The shared limiter is a blocking SQLite write: keep it off the event loop
+            if await run_in_threadpool(is_rate_limited, key, max_requests, window):
+                RATE_LIMITED.inc(route=scope)
+                return JSONResponse({"error": "Rate limit exceeded"}, status_code=429)
+            return await f(request)
+        return wrapped
+    return decorator
+
+def target(data):
+    """(provider, model) a request is for, as the prompt builders take them."""
+    return data.get('provider', 'gemini'), data.get('model', 'gemini-3-flash-preview')
+
+def budget_exceeded(request, exc):
+    logger.warning(f"Prompt over budget: {exc}")
+    return JSONResponse({"error": str(exc)}, status_code=413)
+
+def document_not_found(request, exc):
+    return JSONResponse({"error": str(exc)}, status_code=404)
+
+def invalid_version(request, exc):
+    return JSONResponse({"error": str(exc)}, status_code=400)
+
+def version_conflict(request, exc):
+    # The client's copy is stale: it should fetch the latest version and reapply its change
+    return JSONResponse({"error": str(exc)}, status_code=409)
+
+def stream_response(data, prompt, label, first_event=None, scrub=False, patcher=None):
+    """Build the SSE response for an upstream generation, matching the Flask routes.
+
+    prompt may be a list of chunk prompts, which are generated concurrently
+    and streamed back in order. With scrub, banned words are rewritten on
+    the way out (see app.services.scrubber). With a patcher (a PatchStream),
+    the answer goes out as patch events instead of chunks.
+    """
+    provider_name = data.get('provider', 'gemini')
+    prompts = prompt if isinstance(prompt, list) else [prompt]
+
+    async def generate():
+        # Starlette cancels this generator when the client disconnects; leaving
+        # the provider's `async with client.stream(...)` closes the upstream
+        # connection on the way out.
+        finished = False
+        chunks = 0
+        try:
+            provider = AsyncLLMFactory.get_provider(provider_name)
+            request_kwargs = dict(
+                api_key=data.get('apiKey', ''),
+                model=data.get('model', 'gemini-3-flash-preview'),
+                base_url=data.get('ollamaUrl'),
+                ollamaModel=data.get('ollamaModel')
+            )
+            if len(prompts) > 1:
+                logger.info(f"{label}: chunked into {len(prompts)} parts")
+                stream = stream_chunks_async(provider, prompts, **request_kwargs)
+            else:
+                stream = provider.generate_stream(prompt=prompts[0], **request_kwargs)
+            if scrub:
+                stream = scrub_stream_async(stream, data.get('scrub'))
+
+            if first_event:
+                yield f"data: {json.dumps(first_event)}\n\n"
+
+            if patcher is not None:
+                async for event in patch_events_async(stream, patcher):
+                    chunks += 1
+                    yield f"data: {json.dumps(event)}\n\n"
+            else:
+                async for chunk in stream:
+                    if chunk:
+                        chunks += 1
+                        yield f"data: {json.dumps({'chunk': chunk})}\n\n"
+
+            finished = True
+            yield "data: [DONE]\n\n"
+
+        except Exception as e:
+            finished = True
+            logger.error(f"{label} error: {str(e)}", exc_info=True)
+            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            if not finished:
+                record_cancellation(label, chunks)
+
+    return StreamingResponse(generate(), media_type='text/event-stream')
+
+@rate_limit(max_requests=10, window=60)
+async def humanize(request):
+    data = await request.json()
+    text = data.get('text', '')
+    api_key = data.get('apiKey', '')
+
+    logger.info(f"Humanize request: provider={data.get('provider', 'gemini')}, model={data.get('model', 'gemini-3-flash-preview')}, text_len={len(text)}")
+
+    if not text or not api_key:
+        logger.warning("Missing text or API key in humanize request")
+        return JSONResponse({"error": "Missing text or API key"}, status_code=400)
+
+    return stream_response(data, build_humanize_prompts(text, *target(data)), 'Humanize', scrub=True)
+
+@rate_limit(max_requests=10, window=60)
+async def write(request):
+    data = await request.json()
+    topic = data.get('topic', '')
+    api_key = data.get('apiKey', '')
+
+    logger.info(f"Write request: provider={data.get('provider', 'gemini')}, model={data.get('model', 'gemini-3-flash-preview')}, topic_len={len(topic)}")
+
+    if not topic or not api_key:
+        return JSONResponse({"error": "Missing topic or API key"}, status_code=400)
+
+    return stream_response(data, build_write_prompt(topic, *target(data)), 'Write', scrub=True)
+
+@rate_limit(max_requests=20, window=60)
+async def edit_text(request):
+    data = await request.json()
+    instruction = data.get('instruction', '')
+    text = data.get('text', '')
+    api_key = data.get('apiKey', '')
+
+    logger.info(f"Edit request: instruction={instruction[:50]}..., text_len={len(text)}")
+
+    if not text or not api_key:
+        return JSONResponse({"error": "Missing text or API key"}, status_code=400)
+
+    # Session lookups can hit SQLite and rebuild versions from diffs: keep them off the event loop
+    full_text = await run_in_threadpool(resolve_text, data, 'fullText')
+    patch = await run_in_threadpool(patch_edit, data, instruction, full_text, selection=text) if full_text else None
+    if patch:
+        return stream_response(data, patch[0], 'Edit', first_event={'type': 'patch'}, patcher=patch[1])
+    prompt = build_edit_prompt(instruction, text, full_text, *target(data))
+    return stream_response(data, prompt, 'Edit')
+
+@rate_limit(max_requests=30, window=60)
+async def chat_about_text(request):
+    data = await request.json()
+    message = data.get('message', '')
+    api_key = data.get('apiKey', '')
+
+    logger.info(f"Chat request: message={message[:50]}...")
+
+    if not message or not api_key:
+        return JSONResponse({"error": "Missing message or API key"}, status_code=400)
+
+    text = await run_in_threadpool(resolve_text, data)
+    patch = None if is_question(message) else await run_in_threadpool(patch_edit, data, message, text)
+    if patch:
+        return stream_response(data, patch[0], 'Chat', first_event={'type': 'patch'}, patcher=patch[1])
+    prompt, return_type = build_chat_prompt(message, text, *target(data))
+    return stream_response(data, prompt, 'Chat', first_event={'type': return_type})
+
+routes = [
+    Route('/api/humanize', humanize, methods=['POST']),
+    Route('/api/write', write, methods=['POST']),
+    Route('/api/edit', edit_text, methods=['POST']),
+    Route('/api/chat', chat_about_text, methods=['POST']),
+]
@@ -1,4 +1,5 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, Response, abort, current_app, render_template
+from app.utils.metrics import CONTENT_TYPE, registry
 
 main_bp = Blueprint('main', __name__)
 
@@ -9,3 +10,10 @@ def index():
 @main_bp.route('/health')
 def health():
     return {"status": "healthy", "version": "2.0.0"}
+
+@main_bp.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint (per worker process)."""
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    return Response(registry.render(), content_type=CONTENT_TYPE)
@@ -1,57 +1,294 @@
-import json
+import hashlib
 import logging
+import re
+import statistics
+import time
 from app.services.providers import LLMFactory, ANALYZER_PROMPT
+from app.utils.cache import ResultCache, make_key, normalize_text
+from app.utils.metrics import ANALYZER_JSON_PARSE, ANALYZER_RESULTS
+from app.services.coalescing import analysis_flights, request_key
+from app.services.json_stream import JSONStreamParser
+from app.services.tokens import Prompt, estimate_tokens, max_output_tokens, rewrite_tokens
+from config.settings import Config
 
 logger = logging.getLogger(__name__)
 
+# Bumps automatically whenever the detection prompt changes, invalidating old results
+ANALYZER_PROMPT_VERSION = hashlib.sha256(ANALYZER_PROMPT.encode('utf-8')).hexdigest()[:12]
+
+# Tier 1 vocabulary from ANALYZER_PROMPT. "landscape" is left out: the prompt only
+# bans its metaphorical use, which a string match can't tell apart.
+BANNED_WORDS = [
+    "delve", "tapestry", "nuance", "multifaceted", "myriad", "plethora", "testament",
+    "underscore", "spearhead", "leverage", "utilize", "facilitate", "comprehensive",
+    "elucidate", "exemplify", "foster", "robust", "seamless", "synergy", "transformative",
+    "crucial", "vital", "pivotal"
+]
+BANNED_PHRASES = [
+    "it is important to note", "in conclusion", "furthermore", "moreover", "additionally",
+    "in today's world", "on the other hand", "it goes without saying"
+]
+# Human positive signals from the same prompt
+HUMAN_MARKERS = [
+    "basically", "honestly", "kind of", "you know", "picture this", "think about it",
+    "simple as that", "not really", "maybe", "i guess", "sort of"
+]
+
+ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "prof", "st", "vs", "etc", "e.g", "i.e", "fig", "no"}
+
+def _word_pattern(word):
+    # Match simple inflections: delve/delves/delved/delving, utilize/utilized, ...
+    if word.endswith('e'):
+        return re.escape(word[:-1]) + r"(?:e|es|ed|ing)"
+    return re.escape(word) + r"(?:s|es|ed|ing|ly)?"
+
+def _phrase_pattern(phrase):
+    return r"\s+".join(re.escape(part).replace("'", "['’]") for part in phrase.split())
+
+def _compile_vocabulary(words, phrases=()):
+    """One alternation regex for the whole vocabulary, longest entries first."""
+    patterns = [_word_pattern(w) for w in words] + [_phrase_pattern(p) for p in phrases]
+    patterns.sort(key=len, reverse=True)
+    return re.compile(r"\b(?:" + "|".join(patterns) + r")\b", re.IGNORECASE)
+
+BANNED_RE = _compile_vocabulary(BANNED_WORDS, BANNED_PHRASES)
+HUMAN_RE = _compile_vocabulary([], HUMAN_MARKERS)
+SENTENCE_END_RE = re.compile(r"(?<=[.!?…])[\"'”’)\]]*\s+|\n+")
+WORD_RE = re.compile(r"\w+(?:['’]\w+)*")
+
+def sentence_spans(text):
+    """(start, end) offsets of each sentence, split on terminal punctuation and line breaks."""
+    spans = []
+    start = 0
+    for match in SENTENCE_END_RE.finditer(text):
+        candidate = text[start:match.start()].strip()
+        last_word = candidate.rsplit(None, 1)[-1].rstrip('.').lower() if candidate else ''
+        if match.group().strip(' \t') == '' and last_word in ABBREVIATIONS:
+            continue
+        if candidate:
+            spans.append(_strip_span(text, start, match.end()))
+        start = match.end()
+    if text[start:].strip():
+        spans.append(_strip_span(text, start, len(text)))
+    return spans
+
+def _strip_span(text, start, end):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+def split_sentences(text):
+    """Split text into sentences on terminal punctuation and line breaks."""
+    return [text[start:end] for start, end in sentence_spans(text)]
+
+class LocalScorer:
+    """Lexical AI-detection pre-scorer mirroring the rules in ANALYZER_PROMPT.
+
+    Finds Tier 1 vocabulary with one compiled regex and measures sentence-length
+    burstiness, returning the same JSON shape as the LLM detector. The verdict is
+    "decisive" when it is clear enough that an LLM call would not change it.
+    """
+
+    def __init__(self, decisive_high=None, decisive_low=None):
+        self.decisive_high = Config.LOCAL_DECISIVE_HIGH if decisive_high is None else decisive_high
+        self.decisive_low = Config.LOCAL_DECISIVE_LOW if decisive_low is None else decisive_low
+
+    def score(self, text):
+        sentences = split_sentences(text)
+        lengths = [len(WORD_RE.findall(s)) for s in sentences]
+
+        mean = statistics.fmean(lengths) if lengths else 0.0
+        stdev = statistics.pstdev(lengths) if len(lengths) > 1 else 0.0
+        burstiness = stdev / mean if mean else 0.0
+
+        sentence_analysis = []
+        banned_found = []
+        human_hits = 0
+        fragments = 0
+        for sentence, length in zip(sentences, lengths):
+            banned = [m.group().lower() for m in BANNED_RE.finditer(sentence)]
+            human = HUMAN_RE.findall(sentence)
+            human_hits += len(human)
+
+            if banned:
+                banned_found.extend(banned)
+                score = min(100, 85 + 5 * (len(banned) - 1))
+                reason = f"Found banned word: {', '.join(dict.fromkeys(banned))}"
+            elif length <= 3:
+                fragments += 1
+                score = 5
+                reason = "Good human fragment"
+            elif human:
+                score = 15
+                reason = f"Conversational filler: {human[0].lower()}"
+            elif len(lengths) > 2 and burstiness < 0.35 and abs(length - mean) <= 0.25 * mean:
+                score = 55
+                reason = "Uniform sentence length"
+            else:
+                score = 30
+                reason = "No lexical AI markers"
+            sentence_analysis.append({"sentence": sentence, "score": score, "reason": reason})
+
+        if banned_found:
+            # Tier 1 rule: any giveaway puts the text above 80
+            ai_score = min(100, 80 + 4 * len(banned_found))
+        else:
+            # Structural signals: low burstiness reads as AI, fragments and fillers as human
+            ai_score = 75 - 90 * burstiness - 6 * fragments - 4 * human_hits
+            ai_score = max(0, min(79, ai_score))
+
+        ai_score = round(ai_score, 1)
+        feedback = [f"Burstiness {burstiness:.2f} over {len(sentences)} sentences (mean {mean:.1f} words)."]
+        if banned_found:
+            feedback.insert(0, f"Banned words found: {', '.join(dict.fromkeys(banned_found))}.")
+        if fragments or human_hits:
+            feedback.append(f"{fragments} fragments and {human_hits} conversational fillers.")
+
+        return {
+            "ai_score": ai_score,
+            "sentence_analysis": sentence_analysis,
+            "overall_feedback": " ".join(feedback),
+            "engine": "local",
+            "decisive": ai_score >= self.decisive_high or ai_score <= self.decisive_low
+        }
+
+local_scorer = LocalScorer()
+
+analysis_cache = ResultCache(
+    max_entries=Config.ANALYSIS_CACHE_SIZE,
+    ttl=Config.ANALYSIS_CACHE_TTL,
+    disk_path=Config.ANALYSIS_CACHE_DB or None
+)
+
+def analysis_prompt(text, provider_name, model):
+    """The verdict prompt for text; raises BudgetError now if the verdict wouldn't fit the model's window."""
+    # The verdict echoes every sentence, plus a score and short reason for each
+    expected = rewrite_tokens(estimate_tokens(text)) + 24 * len(split_sentences(text))
+    prompt = Prompt(ANALYZER_PROMPT.replace('{text}', text), expected)
+    max_output_tokens(provider_name, model, prompt)
+    return prompt
+
 class Analyzer:
-    def analyze(self, text, provider_name='gemini', api_key=None, model='gemini-3-flash-preview', **kwargs):
+    def __init__(self, cache=analysis_cache, scorer=local_scorer):
+        self.cache = cache
+        self.scorer = scorer
+
+    def analyze(self, text, provider_name='gemini', api_key=None, model='gemini-3-flash-preview', prescore=None, **kwargs):
         if not text:
             return {"error": "No text provided"}
 
-        prompt = ANALYZER_PROMPT.replace('{text}', text)
-        
+        verdict, cache_key = self._prescreen(text, provider_name, model, prescore)
+        if verdict is not None:
+            return verdict
+        # Outside the fallback: an oversize text is the caller's error, not a failed analysis
+        prompt = analysis_prompt(text, provider_name, model)
+
         # Use simple provider for analysis (default to Gemini/configured one)
         # Verify if api_key is passed, otherwise might fail if not in env var (though FE passes it)
         try:
-            # We need a non-streaming response for easier parsing, or we accumulate the stream
-            provider = LLMFactory.get_provider(provider_name)
-            
-            # Reusing generate_stream but consuming it all
-            full_response = ""
-            stream = provider.generate_stream(prompt=prompt, api_key=api_key, model=model, **kwargs)
-            
-            for chunk in stream:
-                if chunk:
-                    if chunk.startswith("Error:"):
-                        logger.error(f"Provider Stream Error: {chunk}")
-                        full_response += chunk # Append so we can see it in raw response log
-                    else:
-                        full_response += chunk
-            
-            # Clean response (remove markdown code blocks if any)
-            full_response = full_response.strip()
-            logger.info(f"Analyzer Raw Response: {full_response[:200]}...") # Log first 200 chars
-
-            if not full_response:
-                raise ValueError("Empty response from LLM provider")
-
-            if full_response.startswith('```json'):
-                full_response = full_response[7:-3]
-            elif full_response.startswith('```'):
-                full_response = full_response[3:-3]
-            
-            # Additional cleanup for safety
-            full_response = full_response.strip()
-                
-            data = json.loads(full_response)
-            return data
+            if Config.COALESCE_REQUESTS:
+                # Identical concurrent checks share one LLM call; a failure is never shared
+                key = request_key(provider_name, normalize_text(text), dict(model=model, **kwargs))
+                return analysis_flights.do(
+                    key, lambda: self._query_llm(prompt, provider_name, api_key, model, cache_key, **kwargs)
+                )
+            return self._query_llm(prompt, provider_name, api_key, model, cache_key, **kwargs)
 
         except Exception as e:
-            logger.error(f"LLM Analysis failed: {e}")
-            # Fallback to simple mock or error
-            return {
-                "ai_score": 0,
-                "reasons": [f"Analysis failed: {str(e)}"],
-                "sentence_analysis": []
-            }
+            return self._fallback(e)
+
+    def analyze_stream(self, text, provider_name='gemini', api_key=None, model='gemini-3-flash-preview', prescore=None, cancel=None, **kwargs):
+        """Yield ('sentence', item) as each sentence verdict arrives, then ('result', verdict).
+
+        Local and cached verdicts are replayed in the same shape.
+        """
+        verdict, cache_key = self._prescreen(text, provider_name, model, prescore)
+        if verdict is None:
+            prompt = analysis_prompt(text, provider_name, model)
+            try:
+                yield from self._stream_llm(prompt, provider_name, api_key, model, cache_key, cancel=cancel, **kwargs)
+                return
+            except Exception as e:
+                verdict = self._fallback(e)
+
+        for item in verdict.get('sentence_analysis', []):
+            yield 'sentence', item
+        yield 'result', verdict
+
+    def _prescreen(self, text, provider_name, model, prescore):
+        """Return (verdict, cache_key); verdict is set when no LLM call is needed."""
+        # Skip the LLM round trip entirely when the lexical verdict is clear-cut
+        if prescore is None:
+            prescore = Config.LOCAL_PRESCORE
+        if prescore and self.scorer is not None:
+            local = self.scorer.score(text)
+            if local["decisive"]:
+                logger.info(f"Analyzer local verdict: score={local['ai_score']}")
+                ANALYZER_RESULTS.inc(source='local')
+                return local, None
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = make_key(normalize_text(text), provider_name, model, ANALYZER_PROMPT_VERSION)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Analyzer cache hit: provider={provider_name}, model={model}")
+                ANALYZER_RESULTS.inc(source='cache')
+                return cached, cache_key
+        return None, cache_key
+
+    @staticmethod
+    def _fallback(error):
+        logger.error(f"LLM Analysis failed: {error}")
+        ANALYZER_RESULTS.inc(source='fallback')
+        # Fallback to simple mock or error
+        return {
+            "ai_score": 0,
+            "reasons": [f"Analysis failed: {str(error)}"],
+            "sentence_analysis": [],
+            "failed": True
+        }
+
+    def _query_llm(self, prompt, provider_name, api_key, model, cache_key, **kwargs):
+        """Ask the LLM for a verdict; raises on any failure."""
+        for kind, value in self._stream_llm(prompt, provider_name, api_key, model, cache_key, **kwargs):
+            if kind == 'result':
+                return value
+
+    def _stream_llm(self, prompt, provider_name, api_key, model, cache_key, cancel=None, **kwargs):
+        """Stream the LLM verdict for an analysis_prompt, yielding each sentence as soon as its JSON object closes."""
+        provider = LLMFactory.get_provider(provider_name)
+
+        # Parsed incrementally, so fences or prose around the JSON need no cleanup pass
+        parser = JSONStreamParser()
+        parse_seconds = 0.0
+        stream = provider.generate_stream(prompt=prompt, api_key=api_key, model=model, cancel=cancel, **kwargs)
+        
+        for chunk in stream:
+            if not chunk:
+                continue
+            if chunk.startswith("Error:"):
+                logger.error(f"Provider Stream Error: {chunk}")
+                raise ValueError(chunk)
+            start = time.perf_counter()
+            events = parser.feed(chunk)
+            parse_seconds += time.perf_counter() - start
+            for event in events:
+                if event[0] == 'item' and event[1] == 'sentence_analysis':
+                    yield 'sentence', event[2]
+
+        raw = parser.text.strip()
+        logger.info(f"Analyzer Raw Response: {raw[:200]}...") # Log first 200 chars
+        if not raw:
+            raise ValueError("Empty response from LLM provider")
+
+        ANALYZER_JSON_PARSE.observe(parse_seconds)
+        data = parser.close()
+
+        # Only well-formed verdicts are cached; fallbacks never are
+        if cache_key and 'ai_score' in data:
+            self.cache.set(cache_key, data)
+        ANALYZER_RESULTS.inc(source='llm')
+        yield 'result', data
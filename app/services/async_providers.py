@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+
+import httpx
+
+from config.settings import Config
+from app.utils.metrics import StreamMetrics
+from app.services.providers import GeminiProtocol, OpenRouterProtocol, OllamaProtocol, retry_delay
+from app.services.scheduler import lane_key, scheduler
+from app.services.stream_decoding import add_usage, aiter_payloads
+
+logger = logging.getLogger(__name__)
+
+class AsyncLLMProvider(ABC):
+    """Asyncio counterpart of LLMProvider built on a pooled httpx.AsyncClient.
+
+    Shares request building and stream decoding with the sync providers through
+    the same protocol mixins, so both layers talk to upstream identically.
+    """
+
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None, max_retries=None):
+        pool_size = pool_size or Config.ASYNC_HTTP_POOL_SIZE
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(
+                read_timeout or Config.HTTP_READ_TIMEOUT,
+                connect=connect_timeout or Config.HTTP_CONNECT_TIMEOUT
+            ),
+            # httpx only retries connection failures, never a sent request
+            transport=httpx.AsyncHTTPTransport(
+                retries=Config.HTTP_MAX_RETRIES if max_retries is None else max_retries
+            )
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    @abstractmethod
+    def build_request(self, prompt, **kwargs):
+        pass
+
+    @abstractmethod
+    def parse_event(self, payload):
+        pass
+
+    async def generate_stream(self, prompt, priority=None, usage=None, **kwargs):
+        """Yield text chunks, waiting for a slot in the lane first (see scheduler).
+
+        A 429 before the first token is retried up to SCHEDULER_RETRIES times.
+        The provider's {'input', 'output'} token counts are added to a usage dict passed in.
+        """
+        url, request_kwargs = self.build_request(prompt, **kwargs)
+        lane = lane_key(self.name, kwargs)
+        retries = Config.SCHEDULER_RETRIES if scheduler.enabled else 0
+        for attempt in range(retries + 1):
+            retry = attempt < retries
+            slot = await scheduler.acquire_async(lane, priority)
+            metrics = StreamMetrics(self.name)
+            outcome = 'cancelled'
+            throttled = False
+            delay = None
+            ttft = None
+            start = time.perf_counter()
+            try:
+                async with self.client.stream('POST', url, **request_kwargs) as response:
+                    metrics.connected()
+                    try:
+                        response.raise_for_status()
+                        # Bytes as they arrive: with a chunk_size httpx holds them back until it fills
+                        payloads = aiter_payloads(self.decoder(), response.aiter_bytes())
+                        try:
+                            async for payload in payloads:
+                                content, done, counts = self.parse_event(payload)
+                                if counts:
+                                    metrics.usage = counts
+                                if content:
+                                    if ttft is None:
+                                        ttft = time.perf_counter() - start
+                                    metrics.chunk(content)
+                                    yield content
+                                if done:
+                                    break
+                        finally:
+                            await payloads.aclose()
+                        outcome = 'ok'
+                    except Exception as e:
+                        outcome = 'error'
+                        throttled = ttft is None and response.status_code == 429
+                        delay = retry_delay(response, attempt) if throttled and retry else None
+                        if delay is None:
+                            yield f"Error: {str(e)}"
+            except Exception:
+                outcome = 'error'
+                raise
+            finally:
+                metrics.finish(outcome)
+                if usage is not None and metrics.usage:
+                    add_usage(usage, metrics.usage)
+                if slot is not None:
+                    slot.release('throttled' if throttled else outcome, ttft)
+            if delay is None:
+                return
+            logger.info(f"{self.name} returned 429, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+class AsyncGeminiProvider(GeminiProtocol, AsyncLLMProvider):
+    pass
+
+class AsyncOpenRouterProvider(OpenRouterProtocol, AsyncLLMProvider):
+    pass
+
+class AsyncOllamaProvider(OllamaProtocol, AsyncLLMProvider):
+    pass
+
+class AsyncLLMFactory:
+    PROVIDERS = {
+        'gemini': AsyncGeminiProvider,
+        'openrouter': AsyncOpenRouterProvider,
+        'ollama': AsyncOllamaProvider,
+    }
+
+    # Only touched from the event loop thread, so no lock is needed
+    _instances = {}
+
+    @classmethod
+    def get_provider(cls, provider_name):
+        """Return the shared async provider (and its connection pool) for provider_name."""
+        provider = cls._instances.get(provider_name)
+        if provider is None:
+            if provider_name not in cls.PROVIDERS:
+                raise ValueError(f"Unknown provider: {provider_name}")
+            provider = cls.PROVIDERS[provider_name]()
+            cls._instances[provider_name] = provider
+        return provider
+
+    @classmethod
+    async def reset(cls):
+        """Close all pooled clients, e.g. on ASGI lifespan shutdown."""
+        instances = list(cls._instances.values())
+        cls._instances.clear()
+        for provider in instances:
+            await provider.aclose()
@@ -0,0 +1,344 @@
+"""Bulk job processing: a persistent SQLite job queue drained by a worker pool.
+
+Jobs are submitted as JSONL (one API request body per line plus a "type"),
+survive restarts because they live on disk, and are claimed with a lease so
+several worker processes can share one queue. The lease is renewed while the
+job runs; a job whose worker died is picked up again once its lease expires,
+up to BATCH_MAX_ATTEMPTS claims before it is marked failed.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from app.services.analyzer import Analyzer
+from app.services.chunking import stream_chunks
+from app.services.prompts import build_humanize_prompts, build_write_prompt
+from app.services.providers import LLMFactory
+from app.services.revision import make_reviser
+from app.services.scheduler import BACKGROUND
+from app.services.scrubber import scrub_stream
+from config.settings import Config
+
+logger = logging.getLogger(__name__)
+
+JOB_TYPES = ('humanize', 'write', 'check', 'auto-revise')
+FINISHED = ('done', 'failed')
+
+class BatchError(ValueError):
+    """Raised for invalid batch submissions."""
+
+def parse_jobs(lines, defaults=None, max_jobs=None):
+    """Validate JSONL job lines; returns a list of (type, payload) tuples."""
+    defaults = {k: v for k, v in (defaults or {}).items() if v}
+    max_jobs = max_jobs or Config.BATCH_MAX_JOBS
+    jobs = []
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            payload = json.loads(line)
+        except ValueError as e:
+            raise BatchError(f"Line {line_no}: invalid JSON ({e})")
+        if not isinstance(payload, dict):
+            raise BatchError(f"Line {line_no}: expected a JSON object")
+
+        job_type = payload.get('type')
+        if job_type not in JOB_TYPES:
+            raise BatchError(f"Line {line_no}: type must be one of {', '.join(JOB_TYPES)}")
+        field = 'topic' if job_type == 'write' else 'text'
+        if not payload.get(field):
+            raise BatchError(f"Line {line_no}: missing {field}")
+
+        payload = {**defaults, **payload}
+        if job_type != 'check' and not payload.get('apiKey'):
+            raise BatchError(f"Line {line_no}: missing apiKey")
+
+        jobs.append((job_type, payload))
+        if len(jobs) > max_jobs:
+            raise BatchError(f"Too many jobs (max {max_jobs})")
+    if not jobs:
+        raise BatchError("No jobs found")
+    return jobs
+
+def _without_key(payload):
+    # Drop the API key once the job no longer needs it
+    return {k: v for k, v in payload.items() if k != 'apiKey'}
+
+class BatchStore:
+    """SQLite-backed job queue (WAL mode, safe to share between processes)."""
+
+    def __init__(self, path, lease=None, max_attempts=None):
+        self.path = path
+        self.lease = lease or Config.BATCH_JOB_LEASE
+        self.max_attempts = max_attempts or Config.BATCH_MAX_ATTEMPTS
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS batches ("
+                "id TEXT PRIMARY KEY, total INTEGER NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, batch_id TEXT NOT NULL, seq INTEGER NOT NULL, "
+                "type TEXT NOT NULL, payload TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'queued', "
+                "result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, lease_until REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id, seq)")
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create_batch(self, jobs):
+        batch_id = uuid.uuid4().hex
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT INTO batches (id, total, created_at) VALUES (?, ?, ?)",
+                         (batch_id, len(jobs), time.time()))
+            conn.executemany(
+                "INSERT INTO jobs (batch_id, seq, type, payload) VALUES (?, ?, ?, ?)",
+                [(batch_id, seq, job_type, json.dumps(payload)) for seq, (job_type, payload) in enumerate(jobs)]
+            )
+        return batch_id
+
+    def claim(self):
+        """Atomically take the oldest runnable job (queued, or running with an expired lease).
+
+        A job already claimed max_attempts times is marked failed instead: it
+        keeps killing or outliving its workers.
+        """
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            while True:
+                row = conn.execute(
+                    "SELECT id, type, payload, attempts FROM jobs "
+                    "WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                    "ORDER BY id LIMIT 1", (now,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row[3] < self.max_attempts:
+                    break
+                logger.warning(f"Batch job {row[0]} failed: lease expired on all {row[3]} attempts")
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, payload = ?, lease_until = NULL WHERE id = ?",
+                    (f"Gave up after {row[3]} attempts (worker died or job ran past its lease)",
+                     json.dumps(_without_key(json.loads(row[2]))), row[0])
+                )
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ? WHERE id = ?",
+                (now + self.lease, row[0])
+            )
+        return {"id": row[0], "type": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1}
+
+    def renew(self, job):
+        """Extend the lease on a running job; False if another worker has taken it over."""
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND attempts = ? AND status = 'running'",
+                (time.time() + self.lease, job["id"], job["attempts"])
+            )
+        return cursor.rowcount == 1
+
+    def finish(self, job, result=None, error=None):
+        """Record the outcome; False (nothing written) if the lease was lost to another worker."""
+        conn = self._connection()
+        with conn:
+            # attempts identifies the claim: a re-claim by another worker bumps it
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, payload = ?, lease_until = NULL "
+                "WHERE id = ? AND attempts = ? AND status = 'running'",
+                ('failed' if error else 'done', json.dumps(result) if result is not None else None,
+                 error, json.dumps(_without_key(job["payload"])), job["id"], job["attempts"])
+            )
+        if cursor.rowcount != 1:
+            logger.warning(f"Batch job {job['id']} result dropped: its lease was taken over")
+            return False
+        return True
+
+    def progress(self, batch_id):
+        conn = self._connection()
+        batch = conn.execute("SELECT total, created_at FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        if batch is None:
+            return None
+        counts = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE batch_id = ? GROUP BY status", (batch_id,)
+        ).fetchall())
+        progress = {status: counts.get(status, 0) for status in ('queued', 'running', 'done', 'failed')}
+        finished = progress['done'] + progress['failed']
+        return {
+            "batch_id": batch_id,
+            "total": batch[0],
+            **progress,
+            "status": "complete" if finished == batch[0] else "processing",
+            "created_at": batch[1]
+        }
+
+    def iter_results(self, batch_id, page_size=200):
+        """Finished jobs in submission order, fetched a page at a time."""
+        conn = self._connection()
+        last_seq = -1
+        while True:
+            rows = conn.execute(
+                "SELECT seq, type, payload, status, result, error FROM jobs "
+                "WHERE batch_id = ? AND seq > ? AND status IN ('done', 'failed') ORDER BY seq LIMIT ?",
+                (batch_id, last_seq, page_size)
+            ).fetchall()
+            if not rows:
+                return
+            for seq, job_type, payload, status, result, error in rows:
+                line = {"seq": seq, "id": json.loads(payload).get('id'), "type": job_type, "status": status}
+                if status == 'done':
+                    line["result"] = json.loads(result)
+                else:
+                    line["error"] = error
+                yield line
+            last_seq = rows[-1][0]
+
+def _collect(stream):
+    output = ""
+    for chunk in stream:
+        if chunk:
+            if chunk.startswith("Error:"):
+                raise RuntimeError(chunk)
+            output += chunk
+    return output.strip()
+
+def execute_job(job_type, payload):
+    """Run one job synchronously and return its JSON result."""
+    provider_name = payload.get('provider', 'gemini')
+    request_kwargs = dict(
+        api_key=payload.get('apiKey', ''),
+        model=payload.get('model', 'gemini-3-flash-preview'),
+        base_url=payload.get('ollamaUrl'),
+        ollamaModel=payload.get('ollamaModel'),
+        priority=BACKGROUND
+    )
+
+    if job_type == 'check':
+        result = Analyzer().analyze(payload['text'], provider_name=provider_name,
+                                    prescore=payload.get('prescore'), **request_kwargs)
+        if result.get('reasons') and 'overall_feedback' not in result:
+            raise RuntimeError(result['reasons'][0])
+        return result
+
+    provider = LLMFactory.get_provider(provider_name)
+
+    if job_type == 'auto-revise':
+        reviser = make_reviser(payload.get('mode', Config.AUTO_REVISE_MODE), Analyzer(), provider_name, provider,
+                               prescore=payload.get('prescore'), scrub=payload.get('scrub'), **request_kwargs)
+        return reviser.run(payload['text'], target_score=payload.get('targetScore', 15),
+                           max_iterations=payload.get('maxIterations', 3))
+
+    # Token counts reported by the provider, summed over every upstream call of the job
+    usage = {}
+    if job_type == 'write':
+        prompt = build_write_prompt(payload['topic'], provider_name, request_kwargs.get('model'))
+        stream = provider.generate_stream(prompt=prompt, usage=usage, **request_kwargs)
+        return {"text": _collect(scrub_stream(stream, payload.get('scrub'))), "usage": usage}
+
+    prompts = build_humanize_prompts(payload['text'], provider_name, request_kwargs.get('model'))
+    if len(prompts) > 1:
+        stream = stream_chunks(provider, prompts, usage=usage, **request_kwargs)
+    else:
+        stream = provider.generate_stream(prompt=prompts[0], usage=usage, **request_kwargs)
+    return {"text": _collect(scrub_stream(stream, payload.get('scrub'))), "usage": usage}
+
+class BatchProcessor:
+    """Pool of worker threads draining the BatchStore."""
+
+    def __init__(self, store, workers=None, poll_interval=1.0):
+        self.store = store
+        self.workers = workers or Config.BATCH_WORKERS
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Threads don't survive fork(), so a forked worker process starts its own
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._run, name=f'batch-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+        logger.info(f"Batch processor started with {self.workers} workers")
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                job = self.store.claim()
+            except sqlite3.Error as e:
+                logger.error(f"Batch claim failed: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            start = time.perf_counter()
+            done = threading.Event()
+            threading.Thread(target=self._heartbeat, args=(job, done), name=f"batch-lease-{job['id']}",
+                             daemon=True).start()
+            try:
+                result = execute_job(job["type"], job["payload"])
+                if self.store.finish(job, result=result):
+                    logger.info(f"Batch job {job['id']} ({job['type']}) done in {time.perf_counter() - start:.1f}s")
+            except Exception as e:
+                logger.error(f"Batch job {job['id']} ({job['type']}) failed: {e}")
+                try:
+                    self.store.finish(job, error=str(e))
+                except sqlite3.Error as db_error:
+                    logger.error(f"Batch job {job['id']} could not be marked failed: {db_error}")
+            finally:
+                done.set()
+
+    def _heartbeat(self, job, done):
+        """Renew the job's lease every third of it until done, so long jobs aren't claimed twice."""
+        while not done.wait(self.store.lease / 3):
+            try:
+                if not self.store.renew(job):
+                    logger.warning(f"Batch job {job['id']} lost its lease")
+                    return
+            except sqlite3.Error as e:
+                logger.warning(f"Batch job {job['id']} lease renewal failed: {e}")
+
+_processor = None
+_processor_lock = threading.Lock()
+
+def get_batch_processor():
+    global _processor
+    if _processor is None:
+        with _processor_lock:
+            if _processor is None:
+                _processor = BatchProcessor(BatchStore(Config.BATCH_DB))
+    return _processor
@@ -0,0 +1,257 @@
+"""Split long documents into chunks and humanize them concurrently.
+
+Chunks are generated in parallel but streamed back strictly in document
+order: the head chunk streams live, later chunks are buffered until every
+chunk before them has finished. Total latency is roughly the slowest chunk
+rather than the sum of all of them.
+"""
+import asyncio
+import logging
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services.analyzer import split_sentences
+from app.services.tokens import estimate_tokens
+from config.settings import Config
+
+logger = logging.getLogger(__name__)
+
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+CHUNK_SEPARATOR = "\n\n"
+
+# Shared across requests so concurrent long documents can't spawn unbounded threads
+_executor = ThreadPoolExecutor(max_workers=Config.CHUNK_POOL_SIZE, thread_name_prefix='chunk')
+
+def submit(fn, *args):
+    """Run fn(*args) on the shared chunk pool (bounded by CHUNK_POOL_SIZE); returns its Future."""
+    return _executor.submit(fn, *args)
+
+def split_chunks(text, max_tokens=None):
+    """Pack paragraphs into chunks of at most max_tokens; oversized paragraphs split on sentences."""
+    max_tokens = max_tokens or Config.CHUNK_MAX_TOKENS
+    units = []
+    for paragraph in PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            units.append((paragraph, CHUNK_SEPARATOR))
+        else:
+            sentences = split_sentences(paragraph)
+            units.extend((s, ' ') for s in sentences[:-1])
+            units.append((sentences[-1], CHUNK_SEPARATOR))
+
+    chunks = []
+    current = ""
+    for unit, separator in units:
+        if current and estimate_tokens(current + unit) > max_tokens:
+            chunks.append(current.strip())
+            current = ""
+        current += unit + separator
+    if current.strip():
+        chunks.append(current.strip())
+    return chunks
+
+class OrderedReleaser:
+    """Reorders pieces from concurrently generated chunks into document order."""
+
+    def __init__(self, count):
+        self.count = count
+        self.head = 0
+        self.buffers = [[] for _ in range(count)]
+        self.done = [False] * count
+
+    def feed(self, index, piece):
+        """Return the pieces that may be emitted now."""
+        if index == self.head:
+            return [piece]
+        self.buffers[index].append(piece)
+        return []
+
+    def finish(self, index):
+        """Mark a chunk complete; return everything released by the head moving forward."""
+        self.done[index] = True
+        released = []
+        while self.head < self.count and self.done[self.head]:
+            self.head += 1
+            if self.head < self.count:
+                released.append(CHUNK_SEPARATOR)
+                released.extend(self.buffers[self.head])
+                self.buffers[self.head] = []
+        return released
+
+    @property
+    def complete(self):
+        return self.head >= self.count
+
+def stream_chunks(provider, prompts, workers=None, **kwargs):
+    """Generate prompts concurrently on the shared pool, yielding output in prompt order.
+
+    A chunk that fails before its first token (e.g. a 503 while queued for a
+    slot) is retried up to CHUNK_RETRIES times. If it still fails, or fails
+    mid-chunk, the stream ends with a single "Error: ..." piece rather than
+    carrying on with the rest of the document around the gap.
+    """
+    workers = min(workers or Config.CHUNK_WORKERS, len(prompts))
+    events = queue.Queue()
+    pending = queue.Queue()
+    for index in range(len(prompts)):
+        pending.put(index)
+    cancelled = threading.Event()
+
+    def run(index):
+        # Returns the error message if the chunk failed for good, else None
+        for attempt in range(Config.CHUNK_RETRIES + 1):
+            started, error = False, None
+            stream = provider.generate_stream(prompt=prompts[index], **kwargs)
+            try:
+                for piece in stream:
+                    if cancelled.is_set():
+                        return None
+                    if piece and piece.startswith("Error:"):
+                        error = piece[len("Error:"):].strip()
+                        break
+                    if piece:
+                        started = True
+                        events.put((index, piece))
+            except Exception as e:
+                error = str(e)
+            finally:
+                stream.close()
+            if error is None or started:
+                return error
+            if attempt < Config.CHUNK_RETRIES:
+                logger.info(f"Chunk {index} failed before its first token ({error}), retrying")
+        return error
+
+    def worker():
+        # Each worker pulls chunk indices so one request never uses more than `workers` threads
+        while not cancelled.is_set():
+            try:
+                index = pending.get_nowait()
+            except queue.Empty:
+                return
+            error = run(index)
+            events.put((index, None) if error is None else (None, f"Error: {error}"))
+
+    for _ in range(workers):
+        _executor.submit(worker)
+
+    releaser = OrderedReleaser(len(prompts))
+    try:
+        while not releaser.complete:
+            index, piece = events.get()
+            if index is None:
+                yield piece
+                return
+            released = releaser.finish(index) if piece is None else releaser.feed(index, piece)
+            yield from released
+    finally:
+        # Client went away, a chunk failed or we finished: stop workers from starting or continuing chunks
+        cancelled.set()
+
+def generate_each(provider, items, workers=None, **kwargs):
+    """Run (key, prompt) items to completion on the shared pool, yielding (key, text, error) as each finishes.
+
+    items is consumed lazily, so a long document's prompts are only built
+    as workers free up. error is None on success; text is None on failure.
+    """
+    workers = workers or Config.CHUNK_WORKERS
+    items = iter(items)
+    lock = threading.Lock()
+    results = queue.Queue()
+    cancelled = threading.Event()
+    failures = []
+
+    def worker():
+        try:
+            while not cancelled.is_set():
+                with lock:
+                    item = next(items, None)
+                if item is None:
+                    break
+                run(*item)
+        except Exception as e:
+            # items itself failed (e.g. a corrupt document): stop everyone
+            failures.append(e)
+            cancelled.set()
+        finally:
+            results.put(None)
+
+    def run(key, prompt):
+        text, error = "", None
+        try:
+            for piece in provider.generate_stream(prompt=prompt, **kwargs):
+                if cancelled.is_set():
+                    break
+                if piece and piece.startswith("Error:"):
+                    error = piece[len("Error:"):].strip()
+                elif piece:
+                    text += piece
+        except Exception as e:
+            error = str(e)
+        results.put((key, None if error else text, error))
+
+    for _ in range(workers):
+        _executor.submit(worker)
+
+    running = workers
+    try:
+        while running:
+            result = results.get()
+            if result is None:
+                running -= 1
+            else:
+                yield result
+    finally:
+        cancelled.set()
+    if failures:
+        raise failures[0]
+
+async def stream_chunks_async(provider, prompts, workers=None, **kwargs):
+    """asyncio counterpart of stream_chunks for AsyncLLMProvider instances."""
+    semaphore = asyncio.Semaphore(workers or Config.CHUNK_WORKERS)
+    events = asyncio.Queue()
+
+    async def attempt(index):
+        # Returns (error, started) for one generation of the chunk
+        started = False
+        stream = provider.generate_stream(prompt=prompts[index], **kwargs)
+        try:
+            async for piece in stream:
+                if piece and piece.startswith("Error:"):
+                    return piece[len("Error:"):].strip(), started
+                if piece:
+                    started = True
+                    await events.put((index, piece))
+        except Exception as e:
+            return str(e), started
+        finally:
+            await stream.aclose()
+        return None, started
+
+    async def run(index):
+        async with semaphore:
+            for retry in range(Config.CHUNK_RETRIES + 1):
+                error, started = await attempt(index)
+                if error is None or started:
+                    break
+                if retry < Config.CHUNK_RETRIES:
+                    logger.info(f"Chunk {index} failed before its first token ({error}), retrying")
+            await events.put((index, None) if error is None else (None, f"Error: {error}"))
+
+    tasks = [asyncio.create_task(run(index)) for index in range(len(prompts))]
+    releaser = OrderedReleaser(len(prompts))
+    try:
+        while not releaser.complete:
+            index, piece = await events.get()
+            if index is None:
+                yield piece
+                return
+            for released in (releaser.finish(index) if piece is None else releaser.feed(index, piece)):
+                yield released
+    finally:
+        for task in tasks:
+            task.cancel()
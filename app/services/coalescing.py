@@ -0,0 +1,222 @@
+"""Single-flight coalescing of identical concurrent upstream requests.
+
+When the same prompt arrives several times at once (a class pasting one
+assignment, a double-fired request), only the first caller talks to the
+provider. Everyone else shares that call:
+
+- SingleFlight: callers of a function with the same key get the leader's
+  result instead of running the function again.
+- StreamFlights: callers of a streaming generation each get their own
+  iterator over one shared upstream stream. Chunks are buffered for the
+  life of the call, so a request that joins late first replays what was
+  already generated, then follows live. Whichever subscriber needs the next
+  chunk drives the upstream iterator, so no extra thread is involved, and
+  the upstream is cancelled only when the last subscriber leaves.
+
+Nothing is kept after the upstream call finishes; that is the cache's job.
+"""
+import json
+import logging
+import threading
+
+from app.utils.cache import make_key
+from app.utils.metrics import COALESCED_REQUESTS
+from app.utils.sse import CancelToken
+
+logger = logging.getLogger(__name__)
+
+# Per-caller arguments that don't change what the upstream generates
+UNSHARED_PARAMS = ('api_key', 'priority', 'usage')
+
+def request_key(provider_name, prompt, params):
+    """Key for an upstream call; UNSHARED_PARAMS are left out so different users and jobs can share."""
+    params = {k: v for k, v in params.items() if k not in UNSHARED_PARAMS and v is not None}
+    return make_key(provider_name, prompt, json.dumps(params, sort_keys=True, default=str))
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.ok = False
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one."""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, shareable=lambda result: True):
+        """Run fn() once per key at a time; concurrent callers get the same result.
+
+        Followers only reuse a result that passes shareable(); an exception or
+        an unshareable result (e.g. a fallback from the leader's bad API key)
+        makes each follower call fn() itself.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.ok:
+                COALESCED_REQUESTS.inc(kind=self.name)
+                return call.result
+            return fn()
+
+        try:
+            call.result = fn()
+            call.ok = shareable(call.result)
+            return call.result
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+class _Drive:
+    pass
+
+_DRIVE = _Drive()
+
+class StreamFlight:
+    """One upstream generation shared by any number of subscriber iterators."""
+
+    def __init__(self, key, start, registry):
+        self.key = key
+        self.cancel = CancelToken()
+        self.chunks = []
+        self.done = False
+        self.abandoned = False
+        self.error = None
+        self.subscribers = 0
+        self._start = start
+        self._registry = registry
+        self._iterator = None
+        self._driving = False
+        self._cond = threading.Condition()
+
+    def iterate(self, cancel=None):
+        """Replay buffered chunks, then follow the live stream. Must be closed (or exhausted)."""
+        left = []
+
+        def leave():
+            with self._cond:
+                if left:
+                    return
+                left.append(True)
+            self._leave()
+
+        def on_cancel():
+            # Leave at once: if this was the last subscriber the upstream is
+            # closed now rather than after its next chunk arrives
+            leave()
+            self._wake()
+
+        unregister = cancel.on_cancel(on_cancel) if cancel is not None else None
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    while (index >= len(self.chunks) and not self.done and self._driving
+                           and not (cancel is not None and cancel.cancelled)):
+                        self._cond.wait()
+                    if cancel is not None and cancel.cancelled:
+                        return
+                    if index < len(self.chunks):
+                        chunk = self.chunks[index]
+                        index += 1
+                    elif self.done:
+                        if self.error is not None:
+                            raise self.error
+                        return
+                    else:
+                        self._driving = True
+                        chunk = _DRIVE
+                if chunk is _DRIVE:
+                    self._advance()
+                else:
+                    yield chunk
+        finally:
+            if unregister is not None:
+                unregister()
+            leave()
+
+    def _wake(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _advance(self):
+        """Pull one chunk from upstream on the calling thread."""
+        chunk, finished, error = None, False, None
+        try:
+            if self._iterator is None:
+                self._iterator = iter(self._start(self.cancel))
+            chunk = next(self._iterator)
+        except StopIteration:
+            finished = True
+        except Exception as e:
+            finished, error = True, e
+        with self._cond:
+            if finished:
+                self.done = True
+                self.error = error
+            else:
+                self.chunks.append(chunk)
+            self._driving = False
+            self._cond.notify_all()
+            orphaned = self.abandoned and not finished
+        if finished:
+            self._registry.discard(self)
+        elif orphaned:
+            # Everyone left while this chunk was in flight
+            self._iterator.close()
+
+    def _leave(self):
+        with self._cond:
+            self.subscribers -= 1
+            abandoned = self.subscribers == 0 and not self.done
+            if abandoned:
+                self.done = self.abandoned = True
+            idle = not self._driving
+        if abandoned:
+            self._registry.discard(self)
+            # Closes the upstream response, which also unblocks a driver mid-read
+            self.cancel.cancel()
+            if idle and self._iterator is not None:
+                self._iterator.close()
+
+class StreamFlights:
+    """Registry of in-flight shared generations."""
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key, start):
+        """Return (flight, leader) for key, starting a new flight with start(cancel) if none is running."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                # Checked under the flight's lock: the last subscriber may be leaving right now
+                with flight._cond:
+                    if not flight.abandoned:
+                        flight.subscribers += 1
+                        COALESCED_REQUESTS.inc(kind='stream')
+                        return flight, False
+            flight = self._flights[key] = StreamFlight(key, start, self)
+            flight.subscribers = 1
+        return flight, True
+
+    def discard(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def __len__(self):
+        return len(self._flights)
+
+stream_flights = StreamFlights()
+analysis_flights = SingleFlight('analyze')
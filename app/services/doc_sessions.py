@@ -0,0 +1,387 @@
+"""Server-side document sessions: upload a document once, then refer to it by id and version.
+
+Edits, chats, checks and auto-revise otherwise POST the whole document on
+every interaction. A session keeps the text here instead: the client
+creates it once, sends small splice lists to update it, and passes
+{"docId", "version"} wherever an endpoint takes text.
+
+Versions are stored as line diffs against the previous version, with a
+full snapshot every DOC_SESSION_SNAPSHOT_EVERY versions to bound
+reconstruction, and only the latest DOC_SESSION_MAX_VERSIONS kept. The store
+is an in-process LRU bounded by DOC_SESSION_MAX_MB. With DOC_SESSION_DB set,
+every commit is also written to SQLite, so evicted documents come back
+from disk and every worker process sees the same sessions: a commit only
+lands if the stored head is still the version it was made against, and a
+read checks the stored head before serving the in-memory copy.
+"""
+import difflib
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from app.utils.cache import DiskCache
+from app.utils.metrics import DOC_SESSION_LOOKUPS
+from config.settings import Config
+
+logger = logging.getLogger(__name__)
+
+# Tries at an update without a base version before giving up on a document other workers keep changing
+COMMIT_ATTEMPTS = 3
+
+class DocumentNotFound(LookupError):
+    """Unknown or expired docId, or a version no longer kept."""
+
+class VersionConflict(ValueError):
+    """An update based on a version other than the latest."""
+
+class InvalidVersion(ValueError):
+    """A version in a request that isn't a positive integer."""
+
+def diff_lines(old, new):
+    """Ops turning old's lines into new's: [[start, end, [replacement lines]]]."""
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    return [[i1, i2, new_lines[j1:j2]] for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal']
+
+def apply_lines(text, ops):
+    lines = text.splitlines(keepends=True)
+    for start, end, replacement in reversed(ops):
+        lines[start:end] = replacement
+    return ''.join(lines)
+
+def utf16_len(text):
+    """Length of text in UTF-16 code units, the unit JavaScript string indices count."""
+    return len(text.encode('utf-16-le')) // 2
+
+def apply_splices(text, splices):
+    """Apply client [[start, end, text]] splices (against the same base text).
+
+    Offsets count UTF-16 code units, as the browser's string indices do, so
+    they only match Python's character indices when text has no characters
+    outside the BMP (emoji and the like).
+    """
+    encoded = text.encode('utf-16-le')
+    units = len(encoded) // 2
+    pieces = []
+    cursor = 0
+    for start, end, replacement in sorted(splices, key=lambda s: s[0]):
+        if not 0 <= cursor <= start <= end <= units:
+            raise ValueError(f"Invalid splice [{start}, {end}] for a {units}-unit document")
+        pieces.append(encoded[2 * cursor:2 * start])
+        pieces.append(replacement.encode('utf-16-le', 'surrogatepass'))
+        cursor = end
+    pieces.append(encoded[2 * cursor:])
+    try:
+        return b''.join(pieces).decode('utf-16-le')
+    except UnicodeDecodeError:
+        raise ValueError("Splices split a surrogate pair")
+
+class Document:
+    """Version history of one document: versions[i] is version first + i."""
+
+    __slots__ = ('id', 'first', 'versions', 'head_text', 'size', 'touched')
+
+    def __init__(self, doc_id, first, versions, head_text=None):
+        self.id = doc_id
+        self.first = first
+        # ('s', text) snapshot or ('d', ops) diff against the previous version
+        self.versions = versions
+        self.head_text = head_text if head_text is not None else self._rebuild(self.head)
+        self.touched = time.time()
+        self.size = self._measure()
+
+    @property
+    def head(self):
+        return self.first + len(self.versions) - 1
+
+    def text(self, version=None):
+        if version is None or version == self.head:
+            return self.head_text
+        if not self.first <= version <= self.head:
+            raise DocumentNotFound(f"Version {version} of document {self.id} is not available")
+        return self._rebuild(version)
+
+    def _rebuild(self, version):
+        index = version - self.first
+        start = max(i for i in range(index + 1) if self.versions[i][0] == 's')
+        text = self.versions[start][1]
+        for kind, ops in self.versions[start + 1:index + 1]:
+            text = apply_lines(text, ops)
+        return text
+
+    def commit(self, text):
+        if text == self.head_text:
+            return self.head
+        if len(self.versions) % Config.DOC_SESSION_SNAPSHOT_EVERY == 0:
+            self.versions.append(('s', text))
+        else:
+            self.versions.append(('d', diff_lines(self.head_text, text)))
+        self.head_text = text
+        overflow = len(self.versions) - Config.DOC_SESSION_MAX_VERSIONS
+        if overflow > 0:
+            # Oldest kept version becomes a snapshot so the history still starts on one
+            first_text = self._rebuild(self.first + overflow)
+            self.versions = [('s', first_text)] + self.versions[overflow + 1:]
+            self.first += overflow
+        self.size = self._measure()
+        return self.head
+
+    def _measure(self):
+        size = len(self.head_text)
+        for kind, value in self.versions:
+            if value is self.head_text:
+                continue  # latest version is a snapshot: the same string, counted once
+            size += len(value) if kind == 's' else sum(len(line) for _, _, lines in value for line in lines) + 16 * len(value)
+        return size
+
+    def to_json(self):
+        return {"first": self.first, "versions": [[kind, value] for kind, value in self.versions]}
+
+    @classmethod
+    def from_json(cls, doc_id, data):
+        return cls(doc_id, data["first"], [(kind, value) for kind, value in data["versions"]])
+
+class DocumentDisk(DiskCache):
+    """SQLite tier for sessions: each row carries its head version, so a commit is checked and written at once."""
+
+    def _create_tables(self, conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "id TEXT PRIMARY KEY, head INTEGER NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS documents_expires ON documents (expires_at)")
+
+    def get(self, doc_id):
+        row = self._connection().execute(
+            "SELECT value FROM documents WHERE id = ? AND expires_at > ?", (doc_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def head(self, doc_id):
+        row = self._connection().execute(
+            "SELECT head FROM documents WHERE id = ? AND expires_at > ?", (doc_id, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, doc_id, head, value, base=None):
+        """Store version head; with base, only if the stored head is still base. Returns whether it was written."""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            if base is None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO documents (id, head, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (doc_id, head, json.dumps(value), now + self.ttl)
+                )
+                written = True
+            else:
+                written = conn.execute(
+                    "UPDATE documents SET head = ?, value = ?, expires_at = ? WHERE id = ? AND head = ? AND expires_at > ?",
+                    (head, json.dumps(value), now + self.ttl, doc_id, base, now)
+                ).rowcount == 1
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+        return written
+
+    def delete(self, doc_id):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+
+    def prune(self):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM documents WHERE expires_at <= ?", (time.time(),))
+            conn.execute(
+                "DELETE FROM documents WHERE id IN ("
+                "SELECT id FROM documents ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+class DocumentStore:
+    def __init__(self, max_bytes=None, ttl=None, disk_path=None):
+        self.max_bytes = max_bytes or Config.DOC_SESSION_MAX_MB * 1024 * 1024
+        self.ttl = ttl or Config.DOC_SESSION_TTL
+        self._docs = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        disk_path = Config.DOC_SESSION_DB if disk_path is None else disk_path
+        self.disk = DocumentDisk(disk_path, self.ttl, Config.DOC_SESSION_MAX_DOCS) if disk_path else None
+
+    def create(self, text):
+        doc = Document(uuid.uuid4().hex, 1, [('s', text)], text)
+        with self._lock:
+            self._put(doc)
+        self._save(doc)
+        return doc.id, doc.head
+
+    def text(self, doc_id, version=None):
+        """Text of doc_id at version (default: latest)."""
+        doc = self._get(doc_id, version)
+        with self._lock:
+            return doc.text(version)
+
+    def head(self, doc_id):
+        return self._get(doc_id).head
+
+    def update(self, doc_id, base_version, text=None, splices=None, length=None):
+        """Commit a new version from full text or splices against base_version; return its number.
+
+        length, when given, is the UTF-16 length the client expects the new
+        text to have; a mismatch means its copy drifted and raises VersionConflict.
+        """
+        # Without base_version the change applies to whatever is latest, so a lost race is retried
+        for _ in range(COMMIT_ATTEMPTS):
+            # With a shared disk tier another worker may hold the latest version: check against disk
+            doc = self._get(doc_id, base_version, fresh=self.disk is not None)
+            with self._lock:
+                head = doc.head
+                if base_version is not None and base_version != head:
+                    raise VersionConflict(f"Document {doc_id} is at version {head}, not {base_version}")
+                new_text = apply_splices(doc.head_text, splices) if splices is not None else text
+                if length is not None and utf16_len(new_text) != length:
+                    raise VersionConflict(f"Document {doc_id} would be {utf16_len(new_text)} units long, not {length}: "
+                                          f"the client's copy of version {head} differs")
+                old_size = doc.size
+                version = doc.commit(new_text)
+                doc.touched = time.time()
+                self._bytes += doc.size - old_size
+                self._evict()
+            if version == head or self._save(doc, base=head):
+                return version
+            # Another worker committed first: our copy is now ahead of the stored history
+            with self._lock:
+                if self._docs.get(doc_id) is doc:
+                    self._remove(doc)
+            if base_version is not None:
+                raise VersionConflict(f"Document {doc_id} was updated past version {base_version} by another worker")
+        raise VersionConflict(f"Document {doc_id} kept changing while updating it; try again")
+
+    def delete(self, doc_id):
+        with self._lock:
+            doc = self._docs.pop(doc_id, None)
+            if doc is not None:
+                self._bytes -= doc.size
+        if self.disk is not None:
+            try:
+                self.disk.delete(doc_id)
+            except sqlite3.Error as e:
+                logger.warning(f"Document session delete failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {"documents": len(self._docs), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+    def _get(self, doc_id, version=None, fresh=False):
+        now = time.time()
+        with self._lock:
+            doc = None if fresh else self._docs.get(doc_id)
+            if doc is not None and doc.touched + self.ttl <= now:
+                self._remove(doc)
+                doc = None
+            if doc is not None and (self.disk is None or version is not None and version <= doc.head):
+                return self._hit(doc, now)
+
+        # Another worker may have committed past the version we hold
+        if doc is not None and self._disk_head(doc_id) in (None, doc.head):
+            with self._lock:
+                if self._docs.get(doc_id) is doc:
+                    return self._hit(doc, now)
+
+        data = self._load(doc_id)
+        if data is None:
+            DOC_SESSION_LOOKUPS.inc(source='miss')
+            raise DocumentNotFound(f"Document {doc_id} not found or expired")
+        doc = Document.from_json(doc_id, data)
+        with self._lock:
+            current = self._docs.get(doc_id)
+            if current is not None:
+                self._remove(current)
+            self._put(doc)
+        DOC_SESSION_LOOKUPS.inc(source='disk')
+        return doc
+
+    def _hit(self, doc, now):
+        self._docs.move_to_end(doc.id)
+        doc.touched = now
+        DOC_SESSION_LOOKUPS.inc(source='memory')
+        return doc
+
+    def _put(self, doc):
+        self._docs[doc.id] = doc
+        self._bytes += doc.size
+        self._evict()
+
+    def _remove(self, doc):
+        del self._docs[doc.id]
+        self._bytes -= doc.size
+
+    def _evict(self):
+        # Keep the most recently used document even if it alone is over budget
+        while self._bytes > self.max_bytes and len(self._docs) > 1:
+            _, doc = self._docs.popitem(last=False)
+            self._bytes -= doc.size
+            if self.disk is None:
+                logger.info(f"Evicted document session {doc.id} ({doc.size} bytes)")
+
+    def _load(self, doc_id):
+        if self.disk is None:
+            return None
+        try:
+            return self.disk.get(doc_id)
+        except sqlite3.Error as e:
+            logger.warning(f"Document session read failed: {e}")
+            return None
+
+    def _disk_head(self, doc_id):
+        """Latest version on disk, or None when it's missing or unreadable."""
+        try:
+            return self.disk.head(doc_id)
+        except sqlite3.Error as e:
+            logger.warning(f"Document session read failed: {e}")
+            return None
+
+    def _save(self, doc, base=None):
+        """Write doc through to disk (with base, only over that version); False if another commit got there first."""
+        if self.disk is None:
+            return True
+        try:
+            with self._lock:
+                head, data = doc.head, doc.to_json()
+            return self.disk.put(doc.id, head, data, base)
+        except sqlite3.Error as e:
+            logger.warning(f"Document session write failed: {e}")
+            return True
+
+def request_version(data):
+    """data['version'] as an int (None when absent); InvalidVersion for anything but a positive integer."""
+    version = data.get('version')
+    if version is None:
+        return None
+    if isinstance(version, str) and version.strip().isdigit():
+        version = int(version)
+    if not isinstance(version, int) or isinstance(version, bool) or version < 1:
+        raise InvalidVersion(f"Invalid document version: {version!r}")
+    return version
+
+def resolve_text(data, field='text'):
+    """data[field], or the text of data['docId'] at data['version'] when the request names a session."""
+    doc_id = data.get('docId')
+    if not doc_id:
+        return data.get(field, '')
+    return document_store.text(doc_id, request_version(data))
+
+def resolve_version(data):
+    """The version resolve_text reads for a session request (None without docId), to commit results against."""
+    doc_id = data.get('docId')
+    if not doc_id:
+        return None
+    return request_version(data) or document_store.head(doc_id)
+
+document_store = DocumentStore()
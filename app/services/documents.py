@@ -0,0 +1,229 @@
+"""Humanize .docx/.pptx files in place, keeping their formatting.
+
+The document is walked as a stream of paragraphs (body text, table cells,
+slide shapes and speaker notes), each with a stable key and its runs. Every
+paragraph is humanized as an independent unit on the shared chunk pool, and
+the rewrite is written back into the paragraph's own runs, so styles, tables,
+layouts and everything the walk doesn't touch come out exactly as they went in.
+
+Opening and saving the document are file-pool jobs (unit_texts,
+apply_rewrites): the web process only ever holds the paragraph texts, which
+stream back in batches so the first rewrites start while the worker is still
+walking the file, and the write-back re-walks the file, finding paragraphs
+by key.
+"""
+import io
+import logging
+import re
+
+from app.services.chunking import generate_each
+from app.services.file_pool import file_pool
+from app.services.prompts import build_paragraph_prompt
+from app.services.scrubber import scrub_text
+from app.utils.metrics import FILE_CREATE, FILE_PARSE
+from config.settings import Config
+
+logger = logging.getLogger(__name__)
+
+MIMETYPES = {
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+}
+
+WHITESPACE_RE = re.compile(r'\s+')
+# Shorter runs are too common ("a", "of") to pin a run's formatting to
+MIN_ANCHOR_CHARS = 3
+
+class Unit:
+    """One paragraph of a document: key like 'p3', 't0.r1.c2.p0' or 's2.notes.p0', plus its runs."""
+
+    __slots__ = ('key', 'runs', 'editable')
+
+    def __init__(self, key, runs, editable=True):
+        self.key = key
+        self.runs = runs
+        self.editable = editable
+
+    @property
+    def text(self):
+        return ''.join(run.text for run in self.runs)
+
+def _docx_paragraph(key, paragraph):
+    # Hyperlink and field text lives outside paragraph.runs; rewriting around it would garble the sentence
+    editable = not paragraph.hyperlinks and not paragraph._p.xpath('./w:fldSimple')
+    return Unit(key, paragraph.runs, editable)
+
+def _docx_blocks(prefix, container, seen):
+    from docx.table import Table
+    paragraphs = tables = 0
+    for block in container.iter_inner_content():
+        if isinstance(block, Table):
+            yield from _docx_table(f"{prefix}t{tables}", block, seen)
+            tables += 1
+        else:
+            yield _docx_paragraph(f"{prefix}p{paragraphs}", block)
+            paragraphs += 1
+
+def _docx_table(prefix, table, seen):
+    for r, row in enumerate(table.rows):
+        for c, cell in enumerate(row.cells):
+            # A merged cell shows up once per grid position it spans
+            if id(cell._tc) in seen:
+                continue
+            seen.add(id(cell._tc))
+            yield from _docx_blocks(f"{prefix}.r{r}.c{c}.", cell, seen)
+
+def docx_units(doc):
+    """Paragraphs of a python-docx Document in reading order, tables (and nested tables) included."""
+    yield from _docx_blocks('', doc, set())
+
+def _pptx_frame(prefix, frame):
+    for i, paragraph in enumerate(frame.paragraphs):
+        yield Unit(f"{prefix}.p{i}", paragraph.runs)
+
+def _pptx_shapes(prefix, shapes):
+    for i, shape in enumerate(shapes):
+        key = f"{prefix}.sh{i}"
+        if hasattr(shape, 'shapes'):
+            # Group shape
+            yield from _pptx_shapes(key, shape.shapes)
+        elif getattr(shape, 'has_table', False):
+            for r, row in enumerate(shape.table.rows):
+                for c, cell in enumerate(row.cells):
+                    if not cell.is_spanned:
+                        yield from _pptx_frame(f"{key}.r{r}.c{c}", cell.text_frame)
+        elif getattr(shape, 'has_text_frame', False):
+            yield from _pptx_frame(key, shape.text_frame)
+
+def pptx_units(prs):
+    """Paragraphs of a python-pptx Presentation slide by slide, tables, groups and speaker notes included."""
+    for s, slide in enumerate(prs.slides):
+        yield from _pptx_shapes(f"s{s}", slide.shapes)
+        if slide.has_notes_slide and slide.notes_slide.notes_text_frame is not None:
+            yield from _pptx_frame(f"s{s}.notes", slide.notes_slide.notes_text_frame)
+
+def open_document(source, ext):
+    """(document object, lazy iterator of its Units)."""
+    if ext == 'docx':
+        from docx import Document
+        doc = Document(source)
+        return doc, docx_units(doc)
+    if ext == 'pptx':
+        from pptx import Presentation
+        prs = Presentation(source)
+        return prs, pptx_units(prs)
+    raise ValueError(f"Unsupported document type: {ext}")
+
+def extract_text(source, ext):
+    """Plain text of a document, one paragraph per line."""
+    _, units = open_document(source, ext)
+    return '\n'.join(unit.text for unit in units)
+
+def unit_texts(path, ext):
+    """(key, text, editable) for every paragraph, as the walk reaches it; runs in a file worker."""
+    _, units = open_document(path, ext)
+    for unit in units:
+        yield unit.key, unit.text, unit.editable
+
+def apply_rewrites(path, ext, rewrites):
+    """Bytes of the document with {key: text} written into its paragraphs; runs in a file worker."""
+    doc, units = open_document(path, ext)
+    for unit in units:
+        if unit.key in rewrites:
+            rewrite_runs(unit.runs, rewrites[unit.key])
+    output = io.BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+def rewrite_runs(runs, text):
+    """Put text into runs, keeping each run's formatting where its words survived.
+
+    A run whose text still appears in the rewrite (in order) keeps exactly that
+    text, so a bold term or a linked name stays formatted. Everything between
+    such anchors goes to the next free run after the previous anchor, or is
+    appended to the previous anchor. With no anchors the whole rewrite takes
+    the first run's formatting.
+    """
+    if not runs:
+        return
+    anchors = {}
+    pos = 0
+    if len(runs) > 1:
+        for i, run in enumerate(runs):
+            key = run.text.strip()
+            if len(key) < MIN_ANCHOR_CHARS:
+                continue
+            found = text.find(key, pos)
+            if found >= 0:
+                anchors[i] = (found, found + len(key))
+                pos = found + len(key)
+
+    pieces = [''] * len(runs)
+    cursor = 0
+    last_anchor = None
+    free = None  # first unanchored run since the last anchor
+    for i in range(len(runs)):
+        if i not in anchors:
+            if free is None:
+                free = i
+            continue
+        start, end = anchors[i]
+        gap = text[cursor:start]
+        if free is not None:
+            pieces[free] += gap
+        elif last_anchor is not None:
+            pieces[last_anchor] += gap
+        else:
+            pieces[i] += gap
+        pieces[i] += text[start:end]
+        cursor, last_anchor, free = end, i, None
+    tail = text[cursor:]
+    if free is not None:
+        pieces[free] += tail
+    else:
+        pieces[last_anchor] += tail
+
+    for run, piece in zip(runs, pieces):
+        if run.text != piece:
+            run.text = piece
+
+def clean_rewrite(text):
+    """One plain line: models sometimes wrap a paragraph in quotes or break it up."""
+    text = WHITESPACE_RE.sub(' ', text).strip()
+    if len(text) > 1 and text[0] == text[-1] and text[0] in '"“”':
+        text = text[1:-1].strip()
+    return text
+
+def humanize_document(path, ext, provider, provider_name, model=None, scrub=None, workers=None, **kwargs):
+    """Humanize every paragraph of a spooled docx/pptx; return (BytesIO of the rewritten file, stats).
+
+    Paragraphs that fail or come back empty keep their original text.
+    """
+    scrub = Config.SCRUB_OUTPUT if scrub is None else scrub
+    stats = {"paragraphs": 0, "rewritten": 0, "skipped": 0, "failed": 0}
+    rewrites = {}
+
+    def items():
+        # Paragraphs arrive in batches while the worker is still walking the file;
+        # prompts are built only as pool workers free up
+        parsed = lambda seconds: FILE_PARSE.observe(seconds, ext=ext)
+        for key, text, editable in file_pool.stream('units', path, ext, on_done=parsed):
+            stats["paragraphs"] += 1
+            if not editable or len(text.split()) < Config.DOCUMENT_MIN_WORDS:
+                stats["skipped"] += 1
+                continue
+            yield key, build_paragraph_prompt(text, provider_name, model)
+
+    for key, text, error in generate_each(provider, items(), workers=workers, model=model, **kwargs):
+        text = clean_rewrite(text or '')
+        if error or not text:
+            logger.warning(f"Document paragraph {key} kept as is: {error or 'empty rewrite'}")
+            stats["failed"] += 1
+            continue
+        rewrites[key] = scrub_text(text) if scrub else text
+        stats["rewritten"] += 1
+
+    with FILE_CREATE.time(format=ext):
+        output = io.BytesIO(file_pool.run('apply', path, ext, rewrites))
+    logger.info(f"Humanized {ext}: {stats}")
+    return output, stats
@@ -1,7 +1,67 @@
 import os
 import io
-from docx import Document
-from pptx import Presentation
+import tempfile
+import time
+import zipfile
+from app.services.file_pool import FileJobError, file_pool
+from app.utils.metrics import FILE_CREATE, FILE_PARSE
+from config.settings import Config
+
+MB = 1024 * 1024
+SPOOL_CHUNK = 64 * 1024
+
+# python-docx/python-pptx (and lxml under them) are the slowest imports in the
+# app, so they load on the first document request rather than at worker boot
+
+def load_backends():
+    """Import the document libraries now (see app.preload)."""
+    import docx
+    import pptx
+    return docx, pptx
+
+def parse_path(path, ext):
+    """Text of a spooled upload; runs in a file worker (see file_pool)."""
+    try:
+        if ext in ['txt', 'md']:
+            with open(path, 'rb') as f:
+                return f.read().decode('utf-8', errors='ignore')
+        # Tables and speaker notes included, one paragraph per line
+        from app.services.documents import extract_text
+        return extract_text(path, ext)
+    except MemoryError:
+        raise
+    except Exception as e:
+        raise ValueError(f"Error parsing file: {str(e)}")
+
+def build_docx(text):
+    """A plain .docx of text, one paragraph per line; runs in a file worker."""
+    from docx import Document
+    doc = Document()
+    # Add basic formatting
+    for paragraph in text.split('\n'):
+        if paragraph.strip():
+            doc.add_paragraph(paragraph)
+
+    bio = io.BytesIO()
+    doc.save(bio)
+    return bio.getvalue()
+
+def check_upload_size(content_length):
+    """Refuse an upload from its Content-Length before any of the body is read."""
+    if content_length and content_length > Config.MAX_UPLOAD_MB * MB:
+        raise FileJobError(f"File is larger than {Config.MAX_UPLOAD_MB}MB", status=413)
+
+def _check_archive(path, ext):
+    # docx/pptx are zip files: a small upload can still inflate to gigabytes of XML
+    if ext not in ['docx', 'pptx']:
+        return
+    try:
+        with zipfile.ZipFile(path) as archive:
+            unzipped = sum(info.file_size for info in archive.infolist())
+    except zipfile.BadZipFile:
+        raise FileJobError(f"Not a valid .{ext} file", status=400)
+    if unzipped > Config.MAX_UNZIPPED_MB * MB:
+        raise FileJobError(f"File expands to more than {Config.MAX_UNZIPPED_MB}MB", status=413)
 
 class FileHandler:
     @staticmethod
@@ -10,48 +70,42 @@ class FileHandler:
            filename.rsplit('.', 1)[1].lower() in {'txt', 'md', 'docx', 'pptx'}
 
     @staticmethod
-    def parse_file(file_storage):
-        filename = file_storage.filename
-        ext = filename.rsplit('.', 1)[1].lower()
-        content = ""
+    def spool(file_storage):
+        """Copy an upload to a temp file in chunks, enforcing MAX_UPLOAD_MB; the caller deletes it."""
+        ext = file_storage.filename.rsplit('.', 1)[1].lower()
+        fd, path = tempfile.mkstemp(suffix=f'.{ext}', dir=Config.UPLOAD_SPOOL_DIR or None)
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                while True:
+                    chunk = file_storage.stream.read(SPOOL_CHUNK)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    # Chunked uploads have no Content-Length to check up front
+                    check_upload_size(size)
+                    out.write(chunk)
+            _check_archive(path, ext)
+        except BaseException:
+            os.unlink(path)
+            raise
+        return path
 
+    @staticmethod
+    def parse_file(file_storage):
+        ext = file_storage.filename.rsplit('.', 1)[1].lower()
+        path = FileHandler.spool(file_storage)
+        start = time.perf_counter()
         try:
-            if ext in ['txt', 'md']:
-                content = file_storage.read().decode('utf-8', errors='ignore')
-            
-            elif ext == 'docx':
-                doc = Document(file_storage)
-                full_text = []
-                for para in doc.paragraphs:
-                    full_text.append(para.text)
-                content = '\n'.join(full_text)
-            
-            elif ext == 'pptx':
-                prs = Presentation(file_storage)
-                full_text = []
-                for slide in prs.slides:
-                    for shape in slide.shapes:
-                        if hasattr(shape, "text"):
-                            full_text.append(shape.text)
-                content = '\n'.join(full_text)
-                
-        except Exception as e:
-            raise Exception(f"Error parsing file: {str(e)}")
-            
-        return content
+            return file_pool.run('parse', path, ext)
+        finally:
+            FILE_PARSE.observe(time.perf_counter() - start, ext=ext)
+            os.unlink(path)
 
     @staticmethod
     def create_docx(text):
-        doc = Document()
-        # Add basic formatting
-        for paragraph in text.split('\n'):
-            if paragraph.strip():
-                doc.add_paragraph(paragraph)
-        
-        bio = io.BytesIO()
-        doc.save(bio)
-        bio.seek(0)
-        return bio
+        with FILE_CREATE.time(format='docx'):
+            return io.BytesIO(file_pool.run('docx', text))
 
     @staticmethod
     def create_txt(text):
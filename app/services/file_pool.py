@@ -0,0 +1,224 @@
+"""Run document parsing and export in separate worker processes.
+
+python-docx/python-pptx are pure-Python XML work: a large deck holds the GIL
+and hundreds of MB for seconds, stalling every stream the web worker serves.
+Jobs go to a small pool of long-lived processes instead. Each job has a
+timeout, and each process has an address-space cap (RLIMIT_AS). A worker
+that overruns either is killed and replaced, and the request fails with a
+FileJobError rather than taking the web worker down with it.
+
+Jobs are referenced by name (JOBS) and take file paths, not file objects:
+uploads are spooled to disk first, so a worker opens the file itself.
+Workers start on first use, after any server fork, as fresh interpreters
+running this module (not multiprocessing's spawn, which would re-import the
+server's __main__ and build a whole app in every worker).
+
+A job that returns a generator is sent back in batches of STREAM_BATCH
+items as it runs; stream() yields them as they arrive.
+"""
+import importlib
+import inspect
+import logging
+import multiprocessing
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+
+try:
+    import resource
+except ImportError:  # Windows: no memory cap
+    resource = None
+
+from app.utils.metrics import FILE_JOBS
+from config.settings import Config
+
+logger = logging.getLogger(__name__)
+
+# Workers run `python -m app.services.file_pool` wherever the server was started from
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+JOBS = {
+    'parse': 'app.services.file_handler:parse_path',
+    'docx': 'app.services.file_handler:build_docx',
+    'units': 'app.services.documents:unit_texts',
+    'apply': 'app.services.documents:apply_rewrites',
+}
+
+# Items per message from a generator job
+STREAM_BATCH = 64
+
+class FileJobError(Exception):
+    """A file job that was refused or failed; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.status = status
+
+def _resolve(name):
+    module, _, func = JOBS[name].partition(':')
+    return getattr(importlib.import_module(module), func)
+
+def _worker_main(conn, memory_mb):
+    if resource is not None and memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    # Pay the document library imports once per worker, not on the first job
+    from app.services.file_handler import load_backends
+    load_backends()
+    while True:
+        try:
+            name, args = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        try:
+            value = _resolve(name)(*args)
+            if inspect.isgenerator(value):
+                batch = []
+                for item in value:
+                    batch.append(item)
+                    if len(batch) == STREAM_BATCH:
+                        conn.send(('batch', batch))
+                        batch = []
+                value = batch
+            result = ('ok', value)
+        except MemoryError:
+            result = ('memory', None)
+        except Exception as e:
+            result = ('error', str(e))
+        try:
+            conn.send(result)
+        except MemoryError:
+            conn.send(('memory', None))
+
+class _Worker:
+    __slots__ = ('process', 'conn')
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+    def kill(self):
+        self.process.kill()
+        self.process.wait(timeout=5)
+        self.conn.close()
+
+class FilePool:
+    def __init__(self, workers=None, timeout=None, memory_mb=None):
+        self.workers = workers or Config.FILE_WORKERS
+        self.timeout = timeout or Config.FILE_JOB_TIMEOUT
+        self.memory_mb = Config.FILE_JOB_MEMORY_MB if memory_mb is None else memory_mb
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _spawn(self):
+        parent, child = multiprocessing.Pipe()
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'app.services.file_pool', str(child.fileno()), str(self.memory_mb)],
+            pass_fds=(child.fileno(),),
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+        )
+        child.close()
+        return _Worker(process, parent)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # First use in this process (or a forked copy of a started pool)
+            self._idle = queue.Queue()
+            for _ in range(self.workers):
+                self._idle.put(self._spawn())
+            self._pid = os.getpid()
+
+    def run(self, name, *args, timeout=None):
+        """Run job name(*args) in a worker process and return its result."""
+        if not Config.FILE_POOL:
+            return _resolve(name)(*args)
+        return self._call(name, args, timeout)
+
+    def stream(self, name, *args, timeout=None, on_done=None):
+        """Run generator job name(*args) in a worker process, yielding its items as batches arrive.
+
+        A thread reads the batches into a queue, so the worker is free again
+        as soon as the job is done, however slowly the caller consumes them.
+        timeout covers the whole job; on_done(seconds) is called when it has
+        finished, without waiting for the caller.
+        """
+        start = time.perf_counter()
+        if not Config.FILE_POOL:
+            yield from _resolve(name)(*args)
+            if on_done is not None:
+                on_done(time.perf_counter() - start)
+            return
+        batches = queue.Queue()
+
+        def read():
+            try:
+                last = self._call(name, args, timeout, on_batch=batches.put)
+                if on_done is not None:
+                    on_done(time.perf_counter() - start)
+                batches.put(last)
+                batches.put(None)
+            except Exception as e:
+                batches.put(e)
+
+        threading.Thread(target=read, name=f'file-{name}', daemon=True).start()
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            if isinstance(batch, Exception):
+                raise batch
+            yield from batch
+
+    def _call(self, name, args, timeout, on_batch=None):
+        self._ensure_started()
+        try:
+            worker = self._idle.get(timeout=Config.FILE_QUEUE_TIMEOUT)
+        except queue.Empty:
+            FILE_JOBS.inc(job=name, outcome='busy')
+            raise FileJobError("File processing is busy, try again shortly", status=503)
+
+        timeout = timeout or self.timeout
+        deadline = time.monotonic() + timeout
+        healthy = False
+        try:
+            worker.conn.send((name, args))
+            while True:
+                if not worker.conn.poll(max(0.0, deadline - time.monotonic())):
+                    FILE_JOBS.inc(job=name, outcome='timeout')
+                    logger.warning(f"File job {name} exceeded {timeout:g}s; restarting its worker")
+                    raise FileJobError(f"File took longer than {timeout:g}s to process", status=504)
+                status, value = worker.conn.recv()
+                if status != 'batch':
+                    break
+                on_batch(value)
+        except (EOFError, OSError):
+            # Killed from outside, most likely by the kernel OOM killer
+            FILE_JOBS.inc(job=name, outcome='crashed')
+            logger.error(f"File worker died during {name} (exit code {worker.process.poll()})")
+            raise FileJobError("File processing failed unexpectedly", status=500)
+        else:
+            healthy = status != 'memory'
+            FILE_JOBS.inc(job=name, outcome=status)
+            if status == 'memory':
+                raise FileJobError(f"File needs more than {self.memory_mb}MB to process", status=413)
+            if status == 'error':
+                raise FileJobError(value, status=500)
+            return value
+        finally:
+            if healthy:
+                self._idle.put(worker)
+            else:
+                worker.kill()
+                self._idle.put(self._spawn())
+
+file_pool = FilePool()
+
+if __name__ == '__main__':
+    _worker_main(Connection(int(sys.argv[1])), int(sys.argv[2]))
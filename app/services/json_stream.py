@@ -0,0 +1,170 @@
+"""Incremental parser for a JSON object arriving in streamed text chunks.
+
+LLMs wrap their JSON in Markdown fences or a sentence of prose, and the
+analyzer's verdict is one object whose sentence_analysis list grows for the
+whole generation. JSONStreamParser scans each chunk once as it arrives:
+anything before the first '{' and after its matching '}' is ignored, every
+object inside a top-level array is emitted the moment it closes, and each
+top-level field is emitted as soon as its value is complete.
+
+The buffer is UTF-8 bytes and the scanner jumps between structural
+characters with a regex, which is safe because every byte JSON cares about
+is ASCII and never occurs inside a multi-byte sequence.
+"""
+import json
+import re
+
+STRING_SPECIAL_RE = re.compile(rb'["\\]')
+STRUCTURAL_RE = re.compile(rb'[{}\[\]",:]')
+NON_SPACE_RE = re.compile(rb'[^ \t\r\n]')
+
+QUOTE, BACKSLASH = ord('"'), ord('\\')
+OPEN_OBJECT, CLOSE_OBJECT = ord('{'), ord('}')
+OPEN_ARRAY, CLOSE_ARRAY = ord('['), ord(']')
+COLON, COMMA = ord(':'), ord(',')
+
+class JSONStreamParser:
+    """Feed text chunks; get back ('item', key, obj), ('field', key, value) and ('done', obj) events."""
+
+    def __init__(self):
+        self.result = None
+        self._buf = bytearray()
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._string_start = None
+        self._top_start = None
+        self._last_string = None
+        self._key = None
+        self._value_start = None
+        self._item_start = None
+
+    @property
+    def done(self):
+        return self.result is not None
+
+    @property
+    def text(self):
+        """Everything fed so far (for logging)."""
+        return self._buf.decode('utf-8', errors='replace')
+
+    def feed(self, chunk):
+        """Consume chunk and return the events it completed, in order."""
+        if self.done:
+            return []
+        buf = self._buf
+        buf += chunk.encode('utf-8')
+        stack = self._stack
+        events = []
+        end = len(buf)
+        i = self._pos
+
+        while i < end:
+            if self._in_string:
+                m = STRING_SPECIAL_RE.search(buf, i)
+                if m is None:
+                    i = end
+                    break
+                j = m.start()
+                if buf[j] == BACKSLASH:
+                    if j + 1 >= end:
+                        # Escaped character not here yet; resume at the backslash
+                        i = j
+                        break
+                    i = j + 2
+                    continue
+                self._in_string = False
+                if len(stack) == 1:
+                    if self._key is None:
+                        self._last_string = (self._string_start, j + 1)
+                    elif self._value_start is not None:
+                        self._finish_field(j + 1, events)
+                i = j + 1
+                continue
+
+            if self._top_start is None:
+                # Prose or a ```json fence before the object
+                j = buf.find(b'{', i)
+                if j < 0:
+                    i = end
+                    break
+                self._top_start = j
+                stack.append(OPEN_OBJECT)
+                i = j + 1
+                continue
+
+            if len(stack) == 1 and self._key is not None and self._value_start is None:
+                m = NON_SPACE_RE.search(buf, i)
+                if m is None:
+                    i = end
+                    break
+                self._value_start = i = m.start()
+
+            m = STRUCTURAL_RE.search(buf, i)
+            if m is None:
+                i = end
+                break
+            j = m.start()
+            c = buf[j]
+            i = j + 1
+            depth = len(stack)
+
+            if c == QUOTE:
+                self._in_string = True
+                self._string_start = j
+            elif depth == 1:
+                if c == COLON:
+                    if self._last_string is not None:
+                        self._key = json.loads(buf[self._last_string[0]:self._last_string[1]])
+                        self._last_string = None
+                elif c == COMMA or c == CLOSE_OBJECT:
+                    if self._value_start is not None:
+                        # A bare number, true, false or null ends at the delimiter
+                        self._finish_field(j, events)
+                    if c == CLOSE_OBJECT:
+                        stack.pop()
+                        self.result = json.loads(buf[self._top_start:j + 1])
+                        events.append(('done', self.result))
+                        break
+                elif c == OPEN_OBJECT or c == OPEN_ARRAY:
+                    stack.append(c)
+            elif c == OPEN_OBJECT or c == OPEN_ARRAY:
+                if depth == 2 and c == OPEN_OBJECT and stack[1] == OPEN_ARRAY:
+                    self._item_start = j
+                stack.append(c)
+            elif c == CLOSE_OBJECT or c == CLOSE_ARRAY:
+                stack.pop()
+                if len(stack) == 2 and c == CLOSE_OBJECT and self._item_start is not None:
+                    self._emit_item(j + 1, events)
+                elif len(stack) == 1 and self._value_start is not None:
+                    self._finish_field(j + 1, events)
+
+        self._pos = i
+        return events
+
+    def close(self):
+        """Return the parsed object; raises ValueError if the stream ended before it closed."""
+        if self.result is None:
+            if self._top_start is None:
+                raise ValueError("No JSON object in response")
+            raise ValueError("Response ended before the JSON object was complete")
+        return self.result
+
+    def _finish_field(self, end, events):
+        raw = self._buf[self._value_start:end]
+        key = self._key
+        self._key = None
+        self._value_start = None
+        try:
+            events.append(('field', key, json.loads(raw)))
+        except ValueError:
+            # Leave it to the final parse of the whole object to report
+            pass
+
+    def _emit_item(self, end, events):
+        raw = self._buf[self._item_start:end]
+        self._item_start = None
+        try:
+            events.append(('item', self._key, json.loads(raw)))
+        except ValueError:
+            pass
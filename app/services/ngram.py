@@ -0,0 +1,323 @@
+"""Offline trigram language model and perplexity-based AI detector.
+
+The model is built once from a plain-text corpus of human writing:
+
+    python -m app.services.ngram build corpus1.txt corpus2.txt -o models/ngram.bin
+
+and stored as one flat file of aligned NumPy arrays. Loading maps the file
+read-only instead of reading it, so every worker process on a host shares the
+same page-cache pages rather than holding its own copy.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from app.services.analyzer import split_sentences, WORD_RE
+from config.settings import Config
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'HNGM'
+FORMAT_VERSION = 1
+ALIGN = 64
+
+BOS = 0
+ID_BITS = 20
+
+def _align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+class Tokenizer:
+    """Lowercased word tokens hashed into a fixed id space (0 is reserved for BOS)."""
+
+    def __init__(self, vocab_size):
+        self.vocab_size = vocab_size
+        self._ids = {}
+
+    def token_id(self, token):
+        token_id = self._ids.get(token)
+        if token_id is None:
+            token_id = zlib.crc32(token.encode('utf-8')) % (self.vocab_size - 1) + 1
+            # Bounded memo: natural-language vocabularies are Zipfian, so this stays small
+            if len(self._ids) < 500000:
+                self._ids[token] = token_id
+        return token_id
+
+    def encode(self, sentence):
+        return [self.token_id(w) for w in WORD_RE.findall(sentence.lower())]
+
+def _sentence_arrays(encoded_sentences):
+    """Flatten sentences into trigram windows (w1, w2, w3) with BOS padding.
+
+    Also returns the sentence index of every window and the sentence lengths.
+    """
+    lengths = np.fromiter((len(s) for s in encoded_sentences), dtype=np.int64, count=len(encoded_sentences))
+    # Each sentence becomes BOS BOS t1 ... tn in one flat array
+    padded = np.fromiter(
+        (t for s in encoded_sentences for t in ([BOS, BOS] + s)),
+        dtype=np.int64, count=int(lengths.sum()) + 2 * len(encoded_sentences)
+    )
+    starts = np.cumsum(lengths + 2) - (lengths + 2)
+    is_token = np.ones(len(padded), dtype=bool)
+    is_token[starts] = False
+    is_token[starts + 1] = False
+    positions = np.flatnonzero(is_token)
+
+    sentence_index = np.repeat(np.arange(len(encoded_sentences)), lengths)
+    return padded[positions - 2], padded[positions - 1], padded[positions], sentence_index, lengths
+
+def _bigram_keys(w1, w2):
+    return (w1 << ID_BITS) | w2
+
+def _trigram_keys(w1, w2, w3):
+    return (w1 << (2 * ID_BITS)) | (w2 << ID_BITS) | w3
+
+def _lookup(keys, table_keys, table_counts):
+    """Vectorized sparse lookup: counts for keys, 0 where absent."""
+    if len(table_keys) == 0:
+        return np.zeros(len(keys), dtype=np.float64)
+    idx = np.searchsorted(table_keys, keys)
+    idx_clipped = np.minimum(idx, len(table_keys) - 1)
+    found = table_keys[idx_clipped] == keys
+    return np.where(found, table_counts[idx_clipped], 0).astype(np.float64)
+
+class NGramModel:
+    """Interpolated trigram model backed by a read-only memory map."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, header_len = struct.unpack('<4sI', f.read(8))
+            if magic != MAGIC:
+                raise ValueError(f"Not an n-gram model file: {path}")
+            self.header = json.loads(f.read(header_len))
+        if self.header['version'] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported n-gram model version: {self.header['version']}")
+
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+        self.arrays = {}
+        for name, spec in self.header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            end = spec['offset'] + spec['length'] * dtype.itemsize
+            self.arrays[name] = self._map[spec['offset']:end].view(dtype)
+
+        self.vocab_size = self.header['vocab_size']
+        self.total_tokens = self.header['total_tokens']
+        self.lambdas = self.header['lambdas']
+        self.tokenizer = Tokenizer(self.vocab_size)
+
+    def token_logprobs(self, w1, w2, w3):
+        unigrams = self.arrays['unigram_counts']
+        c1 = unigrams[w3].astype(np.float64)
+        p1 = (c1 + 1.0) / (self.total_tokens + self.vocab_size)
+
+        ctx2 = unigrams[w2].astype(np.float64)
+        c2 = _lookup(_bigram_keys(w2, w3), self.arrays['bigram_keys'], self.arrays['bigram_counts'])
+        p2 = np.divide(c2, ctx2, out=np.zeros_like(c2), where=ctx2 > 0)
+
+        ctx3 = _lookup(_bigram_keys(w1, w2), self.arrays['bigram_keys'], self.arrays['bigram_counts'])
+        c3 = _lookup(_trigram_keys(w1, w2, w3), self.arrays['trigram_keys'], self.arrays['trigram_counts'])
+        p3 = np.divide(c3, ctx3, out=np.zeros_like(c3), where=ctx3 > 0)
+
+        l3, l2, l1 = self.lambdas
+        return np.log(l3 * p3 + l2 * p2 + l1 * p1)
+
+    def sentence_log_perplexity(self, sentences):
+        """Per-sentence mean negative log-probability (log perplexity); NaN for empty sentences."""
+        encoded = [self.tokenizer.encode(s) for s in sentences]
+        w1, w2, w3, sentence_index, lengths = _sentence_arrays(encoded)
+        logprobs = self.token_logprobs(w1, w2, w3)
+        totals = np.bincount(sentence_index, weights=logprobs, minlength=len(sentences))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(lengths > 0, -totals / lengths, np.nan), lengths
+
+class NGramDetector:
+    """Scores text with an NGramModel and returns the analyzer JSON shape.
+
+    Low perplexity relative to the human reference corpus reads as AI; so does
+    low burstiness (little variation of perplexity between sentences).
+    """
+
+    def __init__(self, model):
+        self.model = model
+        calibration = model.header['calibration']
+        self.center = calibration['median_log_ppl']
+        self.scale = max(calibration['scale'], 1e-3)
+        self.reference_spread = max(calibration['std_log_ppl'], 1e-3)
+
+    def score(self, text):
+        sentences = split_sentences(text)
+        if not sentences:
+            return {"ai_score": 0, "sentence_analysis": [], "overall_feedback": "No sentences found.", "engine": "ngram"}
+
+        log_ppl, lengths = self.model.sentence_log_perplexity(sentences)
+        valid = lengths > 0
+        scores = np.where(valid, 100.0 / (1.0 + np.exp((log_ppl - self.center) / self.scale)), 0.0)
+
+        spread = float(np.std(log_ppl[valid])) if valid.sum() > 1 else 0.0
+        burstiness = spread / self.reference_spread
+        mean_score = float(np.average(scores[valid], weights=lengths[valid])) if valid.any() else 0.0
+        ai_score = 0.7 * mean_score + 0.3 * 100.0 * float(np.clip(1.0 - burstiness, 0.0, 1.0))
+
+        sentence_analysis = []
+        for sentence, ppl_log, score, length in zip(sentences, log_ppl.tolist(), scores.tolist(), lengths.tolist()):
+            if not length:
+                sentence_analysis.append({"sentence": sentence, "score": 0, "reason": "No words to score"})
+                continue
+            ppl = math.exp(ppl_log)
+            if score >= 65:
+                reason = f"Low perplexity (ppl {ppl:.0f}): predictable wording"
+            elif score <= 35:
+                reason = f"High perplexity (ppl {ppl:.0f}): unusual, human-like wording"
+            else:
+                reason = f"Typical perplexity (ppl {ppl:.0f})"
+            sentence_analysis.append({"sentence": sentence, "score": round(score, 1), "reason": reason})
+
+        feedback = (
+            f"Median sentence perplexity {math.exp(float(np.nanmedian(log_ppl))):.0f} "
+            f"(human reference {math.exp(self.center):.0f}). "
+            f"Burstiness {burstiness:.2f} of the reference corpus."
+        )
+        return {
+            "ai_score": round(ai_score, 1),
+            "sentence_analysis": sentence_analysis,
+            "overall_feedback": feedback,
+            "engine": "ngram"
+        }
+
+_detector = None
+_detector_lock = threading.Lock()
+
+def get_detector():
+    """Lazily map the configured model; returns None when no model file is available."""
+    global _detector
+    if _detector is None:
+        path = Config.NGRAM_MODEL_PATH
+        if not path or not os.path.exists(path):
+            return None
+        with _detector_lock:
+            if _detector is None:
+                _detector = NGramDetector(NGramModel(path))
+                logger.info(f"Mapped n-gram model {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+    return _detector
+
+def _count(keys, min_count):
+    unique, counts = np.unique(keys, return_counts=True)
+    keep = counts >= min_count
+    return unique[keep].astype(np.int64), counts[keep].astype(np.uint32)
+
+def build_model(corpus_paths, out_path, vocab_bits=ID_BITS, min_count=2, heldout=0.05, lambdas=(0.6, 0.3, 0.1)):
+    """Count uni/bi/trigrams over the corpus and write the mmap-able model file."""
+    if vocab_bits != ID_BITS:
+        raise ValueError(f"vocab_bits must be {ID_BITS} for the packed key layout")
+    vocab_size = 1 << vocab_bits
+    tokenizer = Tokenizer(vocab_size)
+
+    sentences = []
+    for path in corpus_paths:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            sentences.extend(split_sentences(f.read()))
+    encoded = [e for e in (tokenizer.encode(s) for s in sentences) if e]
+    if not encoded:
+        raise ValueError("Corpus contains no sentences")
+
+    # Hold out every Nth sentence for calibration so it is scored as unseen text
+    step = max(2, int(round(1 / heldout))) if heldout else 0
+    train = [s for i, s in enumerate(encoded) if not step or i % step]
+    calibration_set = [s for i, s in enumerate(encoded) if step and not i % step] or train
+
+    w1, w2, w3, _, lengths = _sentence_arrays(train)
+    unigram_counts = np.bincount(w3, minlength=vocab_size).astype(np.uint32)
+    unigram_counts[BOS] = len(train)
+    # Bigrams include (BOS, BOS) contexts so sentence-initial trigrams have a denominator
+    bigram_keys, bigram_counts = _count(
+        np.concatenate((_bigram_keys(w2, w3), np.zeros(len(train), dtype=np.int64))), 1
+    )
+    trigram_keys, trigram_counts = _count(_trigram_keys(w1, w2, w3), min_count)
+
+    arrays = {
+        'unigram_counts': unigram_counts,
+        'bigram_keys': bigram_keys,
+        'bigram_counts': bigram_counts,
+        'trigram_keys': trigram_keys,
+        'trigram_counts': trigram_counts,
+    }
+    header = {
+        'version': FORMAT_VERSION,
+        'order': 3,
+        'vocab_size': vocab_size,
+        'total_tokens': int(lengths.sum()),
+        'sentences': len(train),
+        'lambdas': list(lambdas),
+        'calibration': {'median_log_ppl': 0.0, 'scale': 1.0, 'std_log_ppl': 1.0},
+        'arrays': {}
+    }
+    _write_model(out_path, header, arrays)
+
+    # Calibrate against held-out sentences using the model just written
+    model = NGramModel(out_path)
+    w1, w2, w3, sentence_index, lengths = _sentence_arrays(calibration_set)
+    totals = np.bincount(sentence_index, weights=model.token_logprobs(w1, w2, w3), minlength=len(calibration_set))
+    log_ppl = -totals / lengths
+    q1, median, q3 = np.percentile(log_ppl, [25, 50, 75])
+    header['calibration'] = {
+        'median_log_ppl': float(median),
+        'scale': float(max(q3 - q1, 1e-3) / 2),
+        'std_log_ppl': float(np.std(log_ppl))
+    }
+    del model
+    _write_model(out_path, header, arrays)
+    return header
+
+def _write_model(out_path, header, arrays):
+    # Offsets depend on header length, which depends on offsets: reserve generously
+    layout = {}
+    header['arrays'] = {name: {'dtype': a.dtype.str, 'offset': 0, 'length': int(a.size)} for name, a in arrays.items()}
+    reserved = _align(8 + len(json.dumps(header)) + 64 * len(arrays))
+    offset = reserved
+    for name, array in arrays.items():
+        layout[name] = offset
+        header['arrays'][name]['offset'] = offset
+        offset = _align(offset + array.nbytes)
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    if 8 + len(header_bytes) > reserved:
+        raise ValueError("Model header overflowed its reserved space")
+
+    directory = os.path.dirname(out_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = out_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack('<4sI', MAGIC, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(layout[name])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(offset)
+    # Atomic swap: workers that already mapped the old file keep a valid view
+    os.replace(tmp_path, out_path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help='Build a model from plain-text corpus files')
+    build.add_argument('corpus', nargs='+')
+    build.add_argument('-o', '--output', default=Config.NGRAM_MODEL_PATH or 'models/ngram.bin')
+    build.add_argument('--min-count', type=int, default=2, help='Drop trigrams seen fewer times')
+    args = parser.parse_args()
+
+    header = build_model(args.corpus, args.output, min_count=args.min_count)
+    size = os.path.getsize(args.output)
+    print(f"Wrote {args.output}: {header['sentences']} sentences, {header['total_tokens']} tokens, "
+          f"{header['arrays']['trigram_keys']['length']} trigrams, {size / 1e6:.1f} MB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""Patch-based editing: the model returns only the paragraphs it changes.
+
+Chat edits and /api/edit with fullText used to ask for the ENTIRE document
+back, so a one-sentence change to a 3,000-word text cost 3,000 words of
+output. In patch mode the document is split into paragraphs with ids (p1,
+p2, ... by position), only the paragraphs the instruction is about are sent
+(all of them when nothing points anywhere), and the model answers with
+"[[p3]] new text" blocks for the ones it changes. Each block goes to the
+client as a patch event as soon as the next one starts, and the patches are
+applied here too: committed as the next version when the request named a
+document session.
+
+Instructions about the whole text and one-paragraph documents still take
+the full-text path (prompts.build_edit_prompt / build_chat_prompt).
+"""
+import asyncio
+import logging
+import math
+import re
+
+from app.services.doc_sessions import VersionConflict, apply_splices, document_store, resolve_version, utf16_len
+from app.services.prompts import build_patch_prompt
+from app.utils.metrics import EDIT_MODES
+from config.settings import Config
+
+logger = logging.getLogger(__name__)
+
+PARAGRAPH_RE = re.compile(r'[^\n]*\S[^\n]*')
+MARKER_RE = re.compile(r'\[\[(p\d+)\]\]')
+WORD_RE = re.compile(r'\w+')
+QUOTED_RE = re.compile(r'["“”«»]([^"“”«»]{4,})["“”«»]')
+# Instructions that touch every paragraph gain nothing from patches
+GLOBAL_RE = re.compile(r'\b(tüm|bütün|her|whole|entire|every|all)\b.{0,12}\b(metn|metin|paragraf|text|paragraph)|tamamını', re.I)
+FIRST_RE = re.compile(r'\b(ilk|giriş|first|intro)', re.I)
+LAST_RE = re.compile(r'\b(son|sonuç|last|conclusion|ending)\b', re.I)
+# Words in an instruction that say what to do, not where
+INSTRUCTION_STEMS = {'parag', 'cümle', 'daha', 'metin', 'metni', 'yenid', 'değiş', 'kısal', 'uzat', 'düzel', 'yaz',
+                     'sentence', 'rewri', 'chang', 'short', 'make', 'more'}
+MIN_TERM_CHARS = 4
+# Words also match by stem, so Turkish suffixes ("bankaların" vs "banka") don't hide a match
+STEM_CHARS = 5
+
+class Paragraph:
+    """A non-blank line of the document, with its character span."""
+
+    __slots__ = ('id', 'start', 'end', 'text')
+
+    def __init__(self, pid, start, end, text):
+        self.id = pid
+        self.start = start
+        self.end = end
+        self.text = text
+
+def split_paragraphs(text):
+    return [Paragraph(f"p{i}", m.start(), m.end(), m.group()) for i, m in enumerate(PARAGRAPH_RE.finditer(text), 1)]
+
+def _terms(text):
+    words = [w for w in WORD_RE.findall(text.lower()) if len(w) >= MIN_TERM_CHARS]
+    return ({w for w in words} | {w[:STEM_CHARS] for w in words}) - INSTRUCTION_STEMS
+
+def plan_patch(instruction, text, selection=None):
+    """(all paragraphs, the ones to send the model), or None when the edit should regenerate the full text.
+
+    Paragraphs are picked by the selection or quoted text they contain, then
+    by "first"/"last", then by the instruction words they share (weighted by
+    how rare each word is in the document). The
+    neighbours of each pick go along so the rewrite still reads on.
+    """
+    if GLOBAL_RE.search(instruction):
+        return None
+    paragraphs = split_paragraphs(text)
+    if len(paragraphs) < 2:
+        return None
+
+    spans = []
+    for snippet in ([selection] if selection else []) + QUOTED_RE.findall(instruction):
+        snippet = snippet.strip()
+        found = text.find(snippet) if snippet else -1
+        if found >= 0:
+            spans.append((found, found + len(snippet)))
+    hits = {i for i, p in enumerate(paragraphs) if any(p.start < end and start < p.end for start, end in spans)}
+    if not hits:
+        if FIRST_RE.search(instruction):
+            hits.add(0)
+        if LAST_RE.search(instruction):
+            hits.add(len(paragraphs) - 1)
+    if not hits:
+        terms = _terms(instruction)
+        shared = [terms & _terms(p.text) for p in paragraphs]
+        counts = {}
+        for found in shared:
+            for term in found:
+                counts[term] = counts.get(term, 0) + 1
+        # A word every paragraph has points nowhere
+        scores = [sum(math.log(len(paragraphs) / counts[term]) for term in found) for found in shared]
+        best = max(scores)
+        hits = {i for i, score in enumerate(scores) if best > 0 and score >= best * 0.999}
+    if not hits:
+        return paragraphs, paragraphs
+
+    chosen = sorted({j for i in hits for j in (i - 1, i, i + 1) if 0 <= j < len(paragraphs)})
+    return paragraphs, [paragraphs[i] for i in chosen]
+
+def patch_edit(data, instruction, text, selection=None):
+    """(prompt, PatchStream) for an edit of text in patch mode, or None to take the full-text path.
+
+    data is the request body: editMode ('patch' or 'full', default EDIT_MODE),
+    provider/model, and docId/version to commit the result to.
+    """
+    plan = plan_patch(instruction, text, selection) if text and data.get('editMode', Config.EDIT_MODE) == 'patch' else None
+    EDIT_MODES.inc(mode='full' if plan is None else 'patch')
+    if plan is None:
+        return None
+    paragraphs, selected = plan
+    logger.info(f"Patch edit: sending {len(selected)} of {len(paragraphs)} paragraphs")
+    prompt = build_patch_prompt(instruction, selected, data.get('provider', 'gemini'),
+                                data.get('model', 'gemini-3-flash-preview'))
+    return prompt, PatchStream(text, paragraphs, {p.id for p in selected}, data.get('docId'), resolve_version(data))
+
+class PatchStream:
+    """Turns the model's "[[p3]] new text" answer into patch events as it streams.
+
+    Events are {"patch": {"id", "start", "end", "text"}}, a splice of the
+    original text (an empty text deletes the paragraph), then one
+    {"applied": {"patches", "version"}} once the answer is complete. Offsets
+    count UTF-16 code units, like the browser's string indices.
+    """
+
+    def __init__(self, text, paragraphs, editable=None, doc_id=None, version=None):
+        self.text = text
+        # Without characters outside the BMP, UTF-16 offsets are character offsets
+        self.bmp = utf16_len(text) == len(text)
+        self.paragraphs = paragraphs
+        self.index = {p.id: i for i, p in enumerate(paragraphs)}
+        # Ids the prompt showed the model; anything else is a made-up id
+        self.editable = set(self.index) if editable is None else editable
+        self.doc_id = doc_id
+        self.version = version
+        self.patches = {}
+        self.failed = False
+        self.result = None
+        self._buf = ''
+        self._current = None
+
+    def feed(self, chunk):
+        if chunk.startswith('Error:'):
+            self.failed = True
+            return [{'chunk': chunk}]
+        self._buf += chunk
+        events = []
+        # A block is complete once the next marker starts
+        while True:
+            match = MARKER_RE.search(self._buf)
+            if not match:
+                return events
+            events.extend(self._close(self._buf[:match.start()]))
+            self._current = match.group(1)
+            self._buf = self._buf[match.end():]
+
+    def finish(self):
+        events = self._close(self._buf)
+        self._buf = ''
+        self._current = None
+        if self.failed:
+            return events
+        splices = [[p['start'], p['end'], p['text']] for p in self.patches.values()]
+        self.result = apply_splices(self.text, splices)
+        version = self.version
+        if self.doc_id and splices:
+            try:
+                version = document_store.update(self.doc_id, self.version, splices=splices)
+            except VersionConflict as e:
+                version = None
+                logger.info(f"Patched edit not saved: {e}")
+        events.append({'applied': {'patches': len(self.patches), 'version': version}})
+        return events
+
+    def _close(self, body):
+        pid = self._current
+        if pid is None:
+            # Anything before the first marker is preamble the prompt asked the model to leave out
+            return []
+        if pid not in self.editable:
+            logger.warning(f"Patch for unknown paragraph {pid} ignored")
+            return []
+        i = self.index[pid]
+        paragraph = self.paragraphs[i]
+        text = '\n'.join(line.strip() for line in body.strip().splitlines() if line.strip())
+        end = paragraph.end
+        if not text:
+            # Deleting takes the line break after it too
+            end = self.paragraphs[i + 1].start if i + 1 < len(self.paragraphs) else len(self.text)
+        if text == paragraph.text:
+            return []
+        patch = {'id': pid, 'start': self._units(paragraph.start), 'end': self._units(end), 'text': text}
+        self.patches[pid] = patch
+        return [{'patch': patch}]
+
+    def _units(self, index):
+        return index if self.bmp else utf16_len(self.text[:index])
+
+def patch_events(stream, patcher):
+    """Event dicts for stream_events (to_event=dict) from a provider's chunk stream."""
+    try:
+        for chunk in stream:
+            yield from patcher.feed(chunk)
+        yield from patcher.finish()
+    finally:
+        if hasattr(stream, 'close'):
+            stream.close()
+
+async def patch_events_async(stream, patcher):
+    try:
+        async for chunk in stream:
+            for event in patcher.feed(chunk):
+                yield event
+        # Committing to the session store can hit SQLite
+        for event in await asyncio.to_thread(patcher.finish):
+            yield event
+    finally:
+        await stream.aclose()
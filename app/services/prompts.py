@@ -0,0 +1,206 @@
+"""Prompt builders shared by the Flask (WSGI) and ASGI API routes.
+
+Builders take the provider and model the prompt is for, so the style rules
+and expected output size fit that model's context window (see tokens).
+"""
+import functools
+
+from app.services.providers import humanizer_prompt, revision_prompt, style_rules, writer_prompt
+from app.services.chunking import split_chunks
+from app.services.tokens import BudgetError, Prompt, available_tokens, estimate_tokens, fits, max_output_tokens, model_limits, rewrite_tokens
+from config.settings import Config
+
+QUESTION_KEYWORDS = ['ne', 'nedir', 'nasıl', 'neden', 'kim', 'hangi', 'kaç', 'anlatıyor', 'açıkla', 'özetle', 'anlat', '?']
+
+# Headings and the "part N of M" note wrapped around the rules and input
+WRAPPER_TOKENS = 64
+
+@functools.lru_cache(maxsize=None)
+def _rules_tokens(style):
+    return estimate_tokens(style_rules(style)) + WRAPPER_TOKENS
+
+def pick_style(provider_name, model, input_tokens, expected_tokens):
+    """'full' if prompt.txt fits next to the input and answer, else 'compact'; None if neither does."""
+    styles = ('full', 'compact') if Config.PROMPT_STYLE == 'auto' else (Config.PROMPT_STYLE,)
+    for style in styles:
+        if fits(provider_name, model, _rules_tokens(style) + input_tokens, expected_tokens):
+            return style
+    return None
+
+def chunk_tokens(provider_name, model):
+    """Largest chunk (in input tokens) whose humanize prompt and answer fit the model."""
+    context, max_output = model_limits(provider_name, model)
+    room = context - Config.CONTEXT_MARGIN - Config.OUTPUT_SLACK
+    for style in ('full', 'compact'):
+        # input + rules + OUTPUT_RATIO * input + slack must fit the window; the answer must fit max_output
+        size = min((room - _rules_tokens(style)) / (1 + Config.OUTPUT_RATIO),
+                   (max_output - Config.OUTPUT_SLACK) / Config.OUTPUT_RATIO)
+        if size >= Config.OUTPUT_MIN_TOKENS or style == 'compact':
+            return min(Config.CHUNK_MAX_TOKENS, int(size))
+
+def checked(prompt, provider_name, model):
+    """Raise BudgetError now, before any upstream call, if prompt's answer would be cut off."""
+    max_output_tokens(provider_name, model, prompt)
+    return prompt
+
+def build_humanize_prompt(text, part=None, total=None, style='full'):
+    expected = rewrite_tokens(estimate_tokens(text))
+    # Append text to the instructions
+    if part is None:
+        return Prompt(f"{humanizer_prompt(style)}\n\nINPUT TEXT TO REWRITE:\n{text}", expected,
+                      Config.HUMANIZE_OUTPUT_TOKENS)
+
+    # One chunk of a long document: the whole-essay length targets don't apply
+    return Prompt(
+        f"{humanizer_prompt(style)}\n\n"
+        f"NOTE: This is part {part} of {total} of a longer document. Rewrite ONLY this part, "
+        f"keep roughly its original length, and do not add an introduction or conclusion.\n\n"
+        f"INPUT TEXT TO REWRITE:\n{text}",
+        expected
+    )
+
+def build_humanize_prompts(text, provider_name=Config.DEFAULT_PROVIDER, model=None):
+    """One prompt for short texts; one per chunk for long documents or ones too big for the model."""
+    tokens = estimate_tokens(text)
+    if tokens <= Config.CHUNK_THRESHOLD_TOKENS:
+        style = pick_style(provider_name, model, tokens, rewrite_tokens(tokens))
+        if style is not None:
+            return [build_humanize_prompt(text, style=style)]
+
+    max_tokens = chunk_tokens(provider_name, model)
+    if max_tokens < Config.OUTPUT_MIN_TOKENS:
+        raise BudgetError(f"{provider_name}/{model or 'default'} has too small a context window to humanize text")
+    chunks = split_chunks(text, max_tokens=max_tokens)
+    prompts = []
+    for i, chunk in enumerate(chunks):
+        tokens = estimate_tokens(chunk)
+        style = pick_style(provider_name, model, tokens, rewrite_tokens(tokens)) or 'compact'
+        if len(chunks) == 1:
+            prompts.append(build_humanize_prompt(chunk, style=style))
+        else:
+            prompts.append(build_humanize_prompt(chunk, part=i + 1, total=len(chunks), style=style))
+    # A single sentence longer than the window can still overflow its chunk
+    return [checked(prompt, provider_name, model) for prompt in prompts]
+
+def build_paragraph_prompt(text, provider_name=Config.DEFAULT_PROVIDER, model=None):
+    """Humanize one paragraph of a formatted document (body text, a table cell or slide notes)."""
+    tokens = estimate_tokens(text)
+    expected = rewrite_tokens(tokens)
+    style = pick_style(provider_name, model, tokens, expected) or 'compact'
+    return checked(Prompt(
+        f"{humanizer_prompt(style)}\n\n"
+        f"NOTE: This is a single paragraph from a formatted document (a body paragraph, table cell or slide). "
+        f"Rewrite ONLY this paragraph, keep roughly its original length, and return it as plain text on one "
+        f"line: no headings, markdown, quotes or line breaks.\n\n"
+        f"INPUT TEXT TO REWRITE:\n{text}",
+        expected
+    ), provider_name, model)
+
+def build_write_prompt(topic, provider_name=Config.DEFAULT_PROVIDER, model=None):
+    tokens = estimate_tokens(topic)
+    style = pick_style(provider_name, model, tokens, Config.WRITE_OUTPUT_TOKENS) or 'compact'
+    # Append topic to the instructions
+    prompt = f"{writer_prompt(style)}\n\nTOPIC TO WRITE ABOUT:\n{topic}"
+    # The essay length is a target, not a requirement: a small model writes a shorter one
+    expected = min(Config.WRITE_OUTPUT_TOKENS, available_tokens(provider_name, model, estimate_tokens(prompt)))
+    return checked(Prompt(prompt, expected), provider_name, model)
+
+def build_revision_prompt(text, feedback, provider_name=Config.DEFAULT_PROVIDER, model=None, approach=None):
+    """Full-document revision prompt (AUTO_REVISE_MODE=full); approach steers one of several search drafts."""
+    tokens = estimate_tokens(text) + estimate_tokens(feedback)
+    expected = rewrite_tokens(estimate_tokens(text))
+    style = pick_style(provider_name, model, tokens, expected) or 'compact'
+    prompt = revision_prompt(style).replace('{original_text}', text).replace('{feedback}', feedback)
+    if approach:
+        head, output, tail = prompt.rpartition('OUTPUT:')
+        prompt = f"{head}APPROACH FOR THIS DRAFT: {approach}\n\n{output}{tail}"
+    return checked(Prompt(prompt, expected), provider_name, model)
+
+def build_edit_prompt(instruction, text, full_text='', provider_name=Config.DEFAULT_PROVIDER, model=None):
+    expected = rewrite_tokens(estimate_tokens(full_text or text))
+    if full_text:
+        # Chat-based editing: modify specific part of full document
+        return checked(Prompt(f"""GÖREV: Aşağıdaki TAM METİN içinde sadece belirtilen kısmı TALİMAT'a göre değiştir.
+
+TALİMAT: {instruction}
+
+TAM METİN:
+{full_text}
+
+ÇOK ÖNEMLİ KURALLAR:
+1. Sadece talimatla ilgili paragraf/cümleleri değiştir
+2. Diğer tüm paragrafları ve cümleleri KESİNLİKLE değiştirme, AYNEN koru
+3. Metnin TAMAMINI döndür (değişen + değişmeyenler birlikte)
+4. Hiçbir açıklama, giriş veya sonuç ekleme
+5. "İşte düzenlenmiş metin:" gibi ifadeler YAZMA
+
+Düzenlenmiş tam metin:""", expected), provider_name, model)
+
+    # Selection-based editing: only modify selected text
+    return checked(Prompt(f"""GÖREV: Aşağıdaki metni verilen talimata göre değiştir ve SADECE değiştirilmiş metni döndür.
+
+TALİMAT: {instruction if instruction else "Daha doğal ve akıcı yeniden yaz"}
+
+METİN: {text}
+
+KURALLAR:
+- SADECE düzenlenmiş metni döndür
+- Açıklama ekleme
+- Giriş cümlesi yazma
+- "İşte" gibi ifadeler kullanma
+
+ÇIKTI:""", expected), provider_name, model)
+
+def is_question(message):
+    """Whether a chat message asks about the text rather than telling us to edit it."""
+    return any(kw in message.lower() for kw in QUESTION_KEYWORDS)
+
+def build_patch_prompt(instruction, paragraphs, provider_name=Config.DEFAULT_PROVIDER, model=None):
+    """Edit prompt over [[id]]-tagged paragraphs; the answer lists only the paragraphs that change."""
+    tagged = '\n'.join(f"[[{p.id}]] {p.text}" for p in paragraphs)
+    # Worst case every paragraph sent is rewritten, plus its tag
+    expected = rewrite_tokens(estimate_tokens(tagged))
+    return checked(Prompt(f"""GÖREV: Aşağıdaki paragrafları TALİMAT'a göre düzenle.
+
+TALİMAT: {instruction}
+
+PARAGRAFLAR (her biri [[kimlik]] ile başlar):
+{tagged}
+
+ÇOK ÖNEMLİ KURALLAR:
+1. SADECE değiştirdiğin paragrafları döndür; değişmeyen paragrafları YAZMA
+2. Her değişen paragrafı kendi kimliğiyle başlat: [[p3]] yeni metin
+3. Bir paragrafın yerine birden fazla paragraf koymak için onları alt alta yaz
+4. Bir paragrafı silmek için sadece kimliğini yaz: [[p3]]
+5. Hiçbir açıklama, giriş veya sonuç ekleme
+
+Değişen paragraflar:""", expected), provider_name, model)
+
+def build_chat_prompt(message, text, provider_name=Config.DEFAULT_PROVIDER, model=None):
+    """Return (prompt, return_type) where return_type is 'answer' or 'edit'."""
+    if is_question(message):
+        # This is a question - answer it
+        prompt = f"""METİN:
+{text}
+
+KULLANICI SORUSU: {message}
+
+Bu metin hakkındaki soruyu kısa ve öz bir şekilde cevapla. Türkçe yaz."""
+        return checked(Prompt(prompt), provider_name, model), 'answer'
+
+    # This is an edit command - modify the text
+    prompt = f"""GÖREV: Aşağıdaki metni verilen talimata göre düzenle.
+
+TALİMAT: {message}
+
+METİN:
+{text}
+
+ÇOK ÖNEMLİ KURALLAR:
+1. Sadece talimatla ilgili paragraf/cümleleri değiştir
+2. Diğer tüm paragrafları ve cümleleri KESİNLİKLE değiştirme, AYNEN koru
+3. Metnin TAMAMINI döndür (değişen + değişmeyenler birlikte)
+4. Hiçbir açıklama, giriş veya sonuç ekleme
+
+Düzenlenmiş tam metin:"""
+    return checked(Prompt(prompt, rewrite_tokens(estimate_tokens(text))), provider_name, model), 'edit'
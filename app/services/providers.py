@@ -1,7 +1,22 @@
+import functools
+import logging
 import requests
-import json
 import os
+import socket
+import threading
+import time
 from abc import ABC, abstractmethod
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config.settings import Config
+from app.utils.metrics import StreamMetrics
+from app.services.coalescing import request_key, stream_flights
+from app.services.routing import Router, UpstreamError
+from app.services.scheduler import lane_key, scheduler
+from app.services.stream_decoding import NDJSONDecoder, SSEDecoder, add_usage, iter_payloads, load_event
+from app.services.tokens import max_output_tokens, model_limits
+
+logger = logging.getLogger(__name__)
 
 # Path to the prompt file
 PROMPT_FILE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'prompt.txt')
@@ -14,13 +29,22 @@ def load_prompt():
         print(f"Error loading prompt.txt: {e}")
         return ""
 
-# Load the prompt content once
-# Load the prompt content once
-BASE_PROMPT = load_prompt()
+# prompt.txt is read, and the templates built on it compiled, on first use
+# rather than at import, keeping it off the worker boot path
+@functools.lru_cache(maxsize=None)
+def base_prompt():
+    return load_prompt()
+
+def style_rules(style='full'):
+    """prompt.txt, or its condensed form when the context window is tight."""
+    return COMPACT_STYLE_RULES if style == 'compact' else base_prompt()
 
 # Context-aware prompts
-HUMANIZER_PROMPT = BASE_PROMPT
-WRITER_PROMPT = BASE_PROMPT
+def humanizer_prompt(style='full'):
+    return style_rules(style)
+
+def writer_prompt(style='full'):
+    return style_rules(style)
 
 ANALYZER_PROMPT = """
 TASK: You are a ruthless AI Detection Simulator (modeling GPTZero, Turnitin, Originality.ai).
@@ -63,11 +87,13 @@ Return valid raw JSON only.
 }
 """
 
-REVISION_PROMPT = f"""
+@functools.lru_cache(maxsize=None)
+def revision_prompt(style='full'):
+    return f"""
 You are THE HUMANIZER. You must REVISE the text below to pass AI detection.
 
 STYLE RULES (From your training):
-{BASE_PROMPT}
+{style_rules(style)}
 
 CRITICAL: The AI Detector flagged specific sentences. You MUST fix them.
 
@@ -87,16 +113,62 @@ INSTRUCTIONS:
 OUTPUT:
 """
 
-class LLMProvider(ABC):
-    @abstractmethod
-    def generate_stream(self, prompt, **kwargs):
-        pass
+# Old module constants, now computed on first access
+_LAZY_PROMPTS = {
+    'BASE_PROMPT': base_prompt,
+    'HUMANIZER_PROMPT': humanizer_prompt,
+    'WRITER_PROMPT': writer_prompt,
+    'REVISION_PROMPT': revision_prompt,
+}
+
+def __getattr__(name):
+    if name in _LAZY_PROMPTS:
+        return _LAZY_PROMPTS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Condensed version of prompt.txt for prompts that only touch a few sentences
+COMPACT_STYLE_RULES = """
+- NEVER use: delve, tapestry, landscape, nuance, multifaceted, myriad, plethora, testament, underscore, leverage, utilize, facilitate, comprehensive, foster, robust, seamless, holistic, pivotal, vital, crucial, furthermore, moreover, additionally, in conclusion, it is important to note, on the other hand.
+- Never start a sentence with However, Furthermore, Moreover, Additionally, In conclusion, According to.
+- Keep sentences under 15 words. Mix long, short and fragment sentences ("Maybe." "Not always.").
+- Start some sentences with But, So, And. Use contractions (it's, don't, can't). Address the reader as "you".
+- Sprinkle fillers: basically, honestly, though, I guess, kind of.
+- Swap formal words: utilize->use, facilitate->help, demonstrate->show, significant->big, in order to->to.
+"""
+
+SENTENCE_REVISION_PROMPT = f"""
+You are THE HUMANIZER. Rewrite ONLY the flagged sentences below so they pass AI detection.
+
+STYLE RULES:
+{COMPACT_STYLE_RULES}
+Each item shows the sentence with one sentence of context on each side. Use the context only to keep the meaning and flow; do not rewrite it.
+
+FLAGGED SENTENCES:
+{{items}}
+
+OUTPUT FORMAT:
+Return valid raw JSON only, one entry per flagged id. A rewrite may be split into several short sentences.
+{{"revisions": [{{"id": <id>, "text": "<rewritten sentence(s)>"}}]}}
+"""
+
+def stream_error(error):
+    """UpstreamError for an error object sent inside a 200 stream."""
+    if isinstance(error, dict):
+        code = error.get('code')
+        status = code if isinstance(code, int) else None
+        return UpstreamError(f"Upstream error: {error.get('message', error)}", status=status,
+                             retryable=status is not None and (status == 429 or status >= 500))
+    return UpstreamError(f"Upstream error: {error}")
+
+class GeminiProtocol:
+    """Request building and stream event parsing for the Gemini REST API."""
+
+    name = 'gemini'
 
-class GeminiProvider(LLMProvider):
-    def generate_stream(self, prompt, api_key, model="gemini-3-flash-preview", **kwargs):
+    def build_request(self, prompt, api_key, model="gemini-3-flash-preview", max_tokens=None, **kwargs):
         # Using streamGenerateContent (server-sent events style but slightly different in Gemini REST)
         # Gemini REST returns a JSON array stream
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent"
+        url = f"{Config.GEMINI_API_BASE}/v1beta/models/{model}:streamGenerateContent"
         headers = {"Content-Type": "application/json"}
         params = {"key": api_key, "alt": "sse"} # Use SSE mode for easier parsing
         body = {
@@ -105,31 +177,41 @@ class GeminiProvider(LLMProvider):
                 "temperature": 0.9,
                 "topP": 0.8,
                 "topK": 40,
-                "maxOutputTokens": 8192
+                "maxOutputTokens": max_tokens or max_output_tokens(self.name, model, prompt)
             }
         }
-        
-        with requests.post(url, headers=headers, params=params, json=body, stream=True) as response:
-            try:
-                response.raise_for_status()
-                for line in response.iter_lines():
-                    if line:
-                        decoded_line = line.decode('utf-8')
-                        if decoded_line.startswith('data: '):
-                            json_str = decoded_line[6:]
-                            try:
-                                data = json.loads(json_str)
-                                if 'candidates' in data and len(data['candidates']) > 0:
-                                    content = data['candidates'][0]['content']['parts'][0]['text']
-                                    yield content
-                            except Exception:
-                                pass
-            except Exception as e:
-                yield f"Error: {str(e)}"
-
-class OpenRouterProvider(LLMProvider):
-    def generate_stream(self, prompt, api_key, model, **kwargs):
-        url = "https://openrouter.ai/api/v1/chat/completions"
+        return url, {"headers": headers, "params": params, "json": body}
+
+    decoder = SSEDecoder
+
+    def parse_event(self, payload):
+        """Return (content, done, usage) for one stream event's data."""
+        data = load_event(payload, self.name)
+        if data is None:
+            return None, False, None
+        if 'error' in data:
+            raise stream_error(data['error'])
+        usage = data.get('usageMetadata')
+        if usage:
+            usage = {'input': usage.get('promptTokenCount', 0), 'output': usage.get('candidatesTokenCount', 0)}
+        candidates = data.get('candidates')
+        if not candidates:
+            return None, False, usage
+        # An event can carry several parts; thought summaries are not part of the answer
+        parts = (candidates[0].get('content') or {}).get('parts') or ()
+        if len(parts) == 1:
+            text = None if parts[0].get('thought') else parts[0].get('text')
+        else:
+            text = ''.join(part.get('text', '') for part in parts if not part.get('thought'))
+        return text, False, usage
+
+class OpenRouterProtocol:
+    """Request building and stream event parsing for the OpenRouter chat completions API."""
+
+    name = 'openrouter'
+
+    def build_request(self, prompt, api_key, model, max_tokens=None, **kwargs):
+        url = f"{Config.OPENROUTER_API_BASE}/api/v1/chat/completions"
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
@@ -140,65 +222,331 @@ class OpenRouterProvider(LLMProvider):
             "model": model,
             "messages": [{"role": "user", "content": prompt}],
             "temperature": 0.9,
-            "max_tokens": 4096,
+            "max_tokens": max_tokens or max_output_tokens(self.name, model, prompt),
             "stream": True # Enable streaming
         }
-        
-        with requests.post(url, headers=headers, json=body, stream=True) as response:
-            try:
-                response.raise_for_status()
-                for line in response.iter_lines():
-                    if line:
-                        decoded_line = line.decode('utf-8')
-                        if decoded_line.startswith('data: '):
-                            if decoded_line == 'data: [DONE]':
-                                break
-                            json_str = decoded_line[6:]
-                            try:
-                                data = json.loads(json_str)
-                                content = data['choices'][0]['delta'].get('content', '')
-                                if content:
-                                    yield content
-                            except Exception:
-                                pass
-            except Exception as e:
-                yield f"Error: {str(e)}"
-
-class OllamaProvider(LLMProvider):
-    def generate_stream(self, prompt, base_url="http://localhost:11434", model="llama2", **kwargs):
-        url = f"{base_url}/api/generate"
+        return url, {"headers": headers, "json": body}
+
+    decoder = SSEDecoder
+
+    def parse_event(self, payload):
+        """Return (content, done, usage) for one stream event's data."""
+        if payload == b'[DONE]':
+            return None, True, None
+        data = load_event(payload, self.name)
+        if data is None:
+            return None, False, None
+        if 'error' in data:
+            raise stream_error(data['error'])
+        usage = data.get('usage')
+        if usage:
+            usage = {'input': usage.get('prompt_tokens', 0), 'output': usage.get('completion_tokens', 0)}
+        choices = data.get('choices')
+        if not choices:
+            return None, False, usage
+        return (choices[0].get('delta') or {}).get('content'), False, usage
+
+class OllamaProtocol:
+    """Request building and stream event parsing for the Ollama generate API."""
+
+    name = 'ollama'
+
+    def build_request(self, prompt, base_url=None, model="llama2", max_tokens=None, **kwargs):
+        url = f"{base_url or Config.OLLAMA_BASE_URL}/api/generate"
         body = {
             "model": model,
             "prompt": prompt,
             "stream": True, # Enable streaming
-            "options": {"temperature": 0.9}
+            "options": {
+                "temperature": 0.9,
+                # Fixed per model: a changing num_ctx makes Ollama reload the model
+                "num_ctx": model_limits(self.name, model)[0],
+                "num_predict": max_tokens or max_output_tokens(self.name, model, prompt)
+            }
         }
-        
-        with requests.post(url, json=body, stream=True) as response:
+        return url, {"json": body}
+
+    decoder = NDJSONDecoder
+
+    def parse_event(self, payload):
+        """Return (content, done, usage) for one stream line."""
+        data = load_event(payload, self.name)
+        if data is None:
+            return None, False, None
+        if 'error' in data:
+            raise stream_error(data['error'])
+        usage = None
+        if 'eval_count' in data:
+            usage = {'input': data.get('prompt_eval_count', 0), 'output': data['eval_count']}
+        return data.get('response'), data.get('done', False), usage
+
+class LLMProvider(ABC):
+    """Base provider holding a pooled keep-alive HTTP session.
+
+    Instances are long-lived (see LLMFactory) so the TCP/TLS connection to the
+    upstream API is reused across requests instead of re-handshaking each time.
+    Subclasses mix in a protocol class supplying build_request, decoder and parse_event.
+    """
+
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, retry_backoff=None):
+        self.pool_size = pool_size or Config.HTTP_POOL_SIZE
+        self.timeout = (
+            connect_timeout or Config.HTTP_CONNECT_TIMEOUT,
+            read_timeout or Config.HTTP_READ_TIMEOUT
+        )
+        self.max_retries = Config.HTTP_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_backoff = Config.HTTP_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        self.session = self._build_session()
+
+    def _build_session(self):
+        # Only retry failures that happen before the request body is sent
+        # (connection refused/reset, DNS, connect timeout) so a POST is never
+        # generated twice upstream.
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=0,
+            redirect=0,
+            status=0,
+            other=0,
+            backoff_factor=self.retry_backoff,
+            allowed_methods=None
+        )
+        # urllib3's connection pool is thread-safe, so one session per provider
+        # is shared by every request thread.
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def post(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.post(url, **kwargs)
+
+    @staticmethod
+    def drain(response):
+        """Read any trailing bytes so the connection goes back to the pool instead of being dropped."""
+        for _ in response.iter_content(chunk_size=1024):
+            pass
+
+    @staticmethod
+    def abort(response):
+        """Tear down a streaming response from another thread.
+
+        close() alone doesn't wake a thread blocked reading the socket;
+        shutdown() does, and tells the upstream we're gone right away.
+        """
+        sock = getattr(getattr(response.raw, '_connection', None), 'sock', None)
+        if sock is not None:
             try:
-                response.raise_for_status()
-                for line in response.iter_lines():
-                    if line:
-                        try:
-                            data = json.loads(line.decode('utf-8'))
-                            content = data.get('response', '')
-                            if content:
-                                yield content
-                            if data.get('done', False):
-                                break
-                        except Exception:
-                            pass
-            except Exception as e:
-                yield f"Error: {str(e)}"
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        response.close()
+
+    def close(self):
+        self.session.close()
+
+    @abstractmethod
+    def build_request(self, prompt, **kwargs):
+        pass
+
+    @abstractmethod
+    def parse_event(self, payload):
+        pass
+
+    def generate_stream(self, prompt, cancel=None, coalesce=None, route=None, **kwargs):
+        """Yield text chunks; cancel (a CancelToken) stops the stream from any thread.
+
+        Requests go through the router (TTFT deadline, hedging, failover; see
+        routing) unless route is False or routing is not configured. Identical
+        concurrent requests share one upstream call (see coalescing) unless
+        coalesce is False or COALESCE_REQUESTS is off. The {'input', 'output'}
+        token counts the provider reports are added to a usage dict passed in
+        (nothing is added when this request shared another's call).
+        """
+        if router.enabled if route is None else route:
+            yield from router.generate_stream(self, prompt, cancel=cancel, coalesce=coalesce, **kwargs)
+            return
+        yield from self._stream(prompt, cancel=cancel, coalesce=coalesce, **kwargs)
+
+    def _stream(self, prompt, cancel=None, coalesce=None, **kwargs):
+        """One possibly coalesced generation against this provider."""
+        if not (Config.COALESCE_REQUESTS if coalesce is None else coalesce):
+            yield from self._generate(prompt, cancel=cancel, **kwargs)
+            return
+
+        flight, leader = stream_flights.join(
+            request_key(self.name, prompt, kwargs),
+            lambda token: self._generate(prompt, cancel=token, **kwargs)
+        )
+        shared = flight.iterate(cancel)
+        first = True
+        try:
+            for chunk in shared:
+                if first and not leader and chunk.startswith('Error:'):
+                    # Most likely the leader's credentials, not ours: don't inherit the failure
+                    shared.close()
+                    yield from self._generate(prompt, cancel=cancel, **kwargs)
+                    return
+                first = False
+                yield chunk
+        except UpstreamError:
+            if leader or not first:
+                raise
+            yield from self._generate(prompt, cancel=cancel, **kwargs)
+        finally:
+            shared.close()
+
+    def _generate(self, prompt, cancel=None, raise_errors=False, priority=None, usage=None, **kwargs):
+        """One upstream generation; cancel aborts the response from any thread.
+
+        Failures are yielded as an "Error: ..." chunk, or raised as
+        UpstreamError when raise_errors is set (the router fails over on them).
+        The call waits for a slot in its lane (see scheduler); priority is
+        'interactive' (default) or 'background'. A 429 before the first token
+        is retried up to SCHEDULER_RETRIES times instead of reaching the client.
+        """
+        if cancel is not None and cancel.cancelled:
+            return
+        url, request_kwargs = self.build_request(prompt, **kwargs)
+        lane = lane_key(self.name, kwargs)
+        retries = Config.SCHEDULER_RETRIES if scheduler.enabled else 0
+        for attempt in range(retries + 1):
+            delay = yield from self._call(url, request_kwargs, lane, priority, cancel, raise_errors, usage,
+                                          attempt if attempt < retries else None)
+            if delay is None:
+                return
+            logger.info(f"{self.name} returned 429, retrying in {delay:.1f}s")
+            if cancel is not None:
+                if cancel.wait(delay):
+                    return
+            else:
+                time.sleep(delay)
+
+    def _call(self, url, request_kwargs, lane, priority, cancel, raise_errors, usage=None, attempt=None):
+        """One upstream call in a scheduler slot.
+
+        Returns the seconds to wait before retrying when the upstream answered
+        429 before any token and attempt (the retry count so far) is given, else None.
+        """
+        slot = scheduler.acquire(lane, priority, cancel)
+        if cancel is not None and cancel.cancelled:
+            if slot is not None:
+                slot.release('cancelled')
+            return None
+
+        metrics = StreamMetrics(self.name)
+        # Anything that leaves the loop early (client gone, cancel) counts as cancelled
+        outcome = 'cancelled'
+        throttled = False
+        ttft = None
+        start = time.perf_counter()
+        try:
+            with self.post(url, stream=True, **request_kwargs) as response:
+                metrics.connected()
+                # Closing the response drops the socket, which stops the upstream
+                # generation and unblocks a read that is waiting for the next token
+                unregister = cancel.on_cancel(lambda: self.abort(response)) if cancel is not None else None
+                try:
+                    response.raise_for_status()
+                    chunks = response.iter_content(chunk_size=Config.STREAM_READ_SIZE)
+                    for payload in iter_payloads(self.decoder(), chunks):
+                        if cancel is not None and cancel.cancelled:
+                            return None
+                        content, done, counts = self.parse_event(payload)
+                        if counts:
+                            metrics.usage = counts
+                        if content:
+                            if ttft is None:
+                                ttft = time.perf_counter() - start
+                            metrics.chunk(content)
+                            yield content
+                        if done:
+                            self.drain(response)
+                            break
+                    outcome = 'ok'
+                except Exception as e:
+                    if cancel is not None and cancel.cancelled:
+                        return None
+                    outcome = 'error'
+                    throttled = ttft is None and response.status_code == 429
+                    if throttled and attempt is not None:
+                        delay = retry_delay(response, attempt)
+                        if delay is not None:
+                            return delay
+                    if raise_errors:
+                        raise UpstreamError.from_exception(e) from e
+                    yield f"Error: {str(e)}"
+                finally:
+                    if unregister is not None:
+                        unregister()
+        except Exception as e:
+            outcome = 'error'
+            if raise_errors:
+                raise UpstreamError.from_exception(e) from e
+            raise
+        finally:
+            metrics.finish(outcome)
+            if usage is not None and metrics.usage:
+                add_usage(usage, metrics.usage)
+            if slot is not None:
+                slot.release('throttled' if throttled else outcome, ttft)
+        return None
+
+def retry_delay(response, attempt):
+    """Seconds to back off after a 429: Retry-After if given, else exponential; None if too long to wait."""
+    try:
+        delay = float(response.headers.get('Retry-After', ''))
+    except ValueError:
+        delay = Config.HTTP_RETRY_BACKOFF * 2 ** attempt
+    return delay if delay <= Config.SCHEDULER_QUEUE_TIMEOUT else None
+
+class GeminiProvider(GeminiProtocol, LLMProvider):
+    pass
+
+class OpenRouterProvider(OpenRouterProtocol, LLMProvider):
+    pass
+
+class OllamaProvider(OllamaProtocol, LLMProvider):
+    pass
 
 class LLMFactory:
-    @staticmethod
-    def get_provider(provider_name):
-        if provider_name == 'gemini':
-            return GeminiProvider()
-        elif provider_name == 'openrouter':
-            return OpenRouterProvider()
-        elif provider_name == 'ollama':
-            return OllamaProvider()
-        else:
+    PROVIDERS = {
+        'gemini': GeminiProvider,
+        'openrouter': OpenRouterProvider,
+        'ollama': OllamaProvider,
+    }
+
+    _instances = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_provider(cls, provider_name):
+        """Return the shared provider instance (and its connection pool) for provider_name."""
+        provider = cls._instances.get(provider_name)
+        if provider is not None:
+            return provider
+
+        if provider_name not in cls.PROVIDERS:
             raise ValueError(f"Unknown provider: {provider_name}")
+
+        with cls._lock:
+            provider = cls._instances.get(provider_name)
+            if provider is None:
+                provider = cls.PROVIDERS[provider_name]()
+                cls._instances[provider_name] = provider
+        return provider
+
+    @classmethod
+    def reset(cls):
+        """Close all pooled sessions, e.g. in a forked worker before first use."""
+        with cls._lock:
+            for provider in cls._instances.values():
+                provider.close()
+            cls._instances.clear()
+
+# Shared by every provider so latency and error history covers all traffic
+router = Router(LLMFactory.get_provider)
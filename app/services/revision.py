@@ -0,0 +1,407 @@
+import json
+import logging
+import queue
+
+from app.services.analyzer import sentence_spans
+from app.services.chunking import submit
+from app.services.providers import SENTENCE_REVISION_PROMPT
+from app.services.prompts import build_revision_prompt
+from app.services.scrubber import scrub_stream, scrub_text
+from config.settings import Config
+from app.services.tokens import Prompt, estimate_tokens, rewrite_tokens
+from app.utils.cache import normalize_text
+from app.utils.metrics import REVISE_CANDIDATES
+from app.utils.sse import CancelToken
+
+logger = logging.getLogger(__name__)
+
+FLAG_THRESHOLD = 30
+
+def segment(text):
+    """Split text into sentence segments, keeping the whitespace that follows each one."""
+    spans = sentence_spans(text)
+    segments = []
+    for i, (start, end) in enumerate(spans):
+        next_start = spans[i + 1][0] if i + 1 < len(spans) else len(text)
+        segments.append({"text": text[start:end], "sep": text[end:next_start], "score": 0, "reason": ""})
+    if segments and spans[0][0] > 0:
+        segments[0]["lead"] = text[:spans[0][0]]
+    return segments
+
+def join_segments(segments):
+    return ''.join(seg.get("lead", "") + seg["text"] + seg["sep"] for seg in segments)
+
+def parse_revisions(response):
+    """Extract {id: text} from the model's JSON, tolerating fences or surrounding prose."""
+    start, end = response.find('{'), response.rfind('}')
+    if start == -1 or end <= start:
+        raise ValueError("No JSON object in revision response")
+    data = json.loads(response[start:end + 1])
+    return {int(item["id"]): item["text"].strip() for item in data.get("revisions", []) if item.get("text")}
+
+def feedback_for(analysis, flag_threshold):
+    """Detector feedback for a revision prompt: the flagged sentences and why."""
+    feedback_lines = []
+    for item in analysis.get('sentence_analysis', []):
+        if item.get('score', 0) > flag_threshold:  # Only include problematic sentences
+            feedback_lines.append(f"- Sentence: \"{item['sentence']}\" | Reason: {item['reason']}")
+    return "\n".join(feedback_lines) if feedback_lines else analysis.get('overall_feedback', 'General improvement needed.')
+
+class Reviser:
+    """events() yields ('iteration', {...}) progress (search mode also ('candidate', {...})), then ('result', {...})."""
+
+    def run(self, text, target_score=15, max_iterations=3):
+        for kind, value in self.events(text, target_score, max_iterations):
+            if kind == 'result':
+                return value
+
+class FullReviser(Reviser):
+    """Whole-document auto-revise: analyze, rewrite the full text, repeat."""
+
+    def __init__(self, analyzer, provider_name, provider, flag_threshold=FLAG_THRESHOLD, prescore=None, scrub=None,
+                 **request_kwargs):
+        self.analyzer = analyzer
+        self.provider_name = provider_name
+        self.provider = provider
+        self.flag_threshold = flag_threshold
+        self.prescore = prescore
+        self.scrub = scrub
+        self.request_kwargs = request_kwargs
+
+    def events(self, text, target_score=15, max_iterations=3, cancel=None):
+        iterations = []
+        current_text = text
+        
+        for i in range(max_iterations):
+            # Step 1: Analyze current text
+            analysis = self.analyzer.analyze(
+                current_text,
+                provider_name=self.provider_name,
+                prescore=self.prescore,
+                **self.request_kwargs
+            )
+            
+            current_score = analysis.get('ai_score', 0)
+            iterations.append({
+                "iteration": i + 1,
+                "score": current_score,
+                "feedback": analysis.get('overall_feedback', '')
+            })
+            yield 'iteration', iterations[-1]
+            
+            logger.info(f"Auto-revise iteration {i+1}: score={current_score}")
+            
+            # Step 2: If score is acceptable, stop
+            if current_score <= target_score:
+                break
+            
+            # Step 3: Create feedback string from sentence analysis
+            feedback_str = feedback_for(analysis, self.flag_threshold)
+            
+            # Step 4: Create revision prompt and call LLM
+            prompt = build_revision_prompt(current_text, feedback_str, self.provider_name, self.request_kwargs.get('model'))
+            
+            revised_text = ""
+            stream = scrub_stream(self.provider.generate_stream(prompt=prompt, cancel=cancel, **self.request_kwargs), self.scrub)
+            
+            for chunk in stream:
+                if chunk and not chunk.startswith("Error:"):
+                    revised_text += chunk
+            
+            current_text = revised_text.strip()
+        
+        yield 'result', {
+            "final_text": current_text,
+            "final_score": iterations[-1]['score'] if iterations else 0,
+            "iterations": iterations
+        }
+
+class IncrementalReviser(Reviser):
+    """Sentence-level auto-revise: only flagged sentences go to the LLM and get re-scored.
+
+    Keeps a per-sentence score table for the document. Each iteration sends
+    the flagged sentences (with one sentence of context either side) under the
+    compact style rules, splices the rewrites back in place, and re-analyzes
+    just the rewritten sentences. The document score is the length-weighted
+    mean of the table.
+    """
+
+    def __init__(self, analyzer, provider_name, provider, flag_threshold=FLAG_THRESHOLD, context=1,
+                 prescore=None, scrub=None, **request_kwargs):
+        self.analyzer = analyzer
+        self.provider_name = provider_name
+        self.provider = provider
+        self.prescore = prescore
+        self.scrub = scrub
+        self.flag_threshold = flag_threshold
+        self.context = context
+        self.request_kwargs = request_kwargs
+
+    def events(self, text, target_score=15, max_iterations=3, cancel=None):
+        segments = segment(text)
+        analysis = self._analyze(text)
+        # The LLM usually only lists notable sentences; unlisted ones count as unflagged
+        self._apply_scores(segments, range(len(segments)), analysis,
+                           default=min(analysis.get('ai_score', 0), self.flag_threshold))
+        feedback = analysis.get('overall_feedback', '')
+
+        iterations = []
+        for i in range(max_iterations):
+            current_score = self.document_score(segments)
+            iteration = {"iteration": i + 1, "score": current_score, "feedback": feedback}
+            iterations.append(iteration)
+            yield 'iteration', iteration
+            logger.info(f"Incremental revise iteration {i+1}: score={current_score}")
+
+            if current_score <= target_score:
+                break
+
+            flagged = [idx for idx, seg in enumerate(segments) if seg["score"] > self.flag_threshold]
+            if not flagged:
+                break
+
+            prompt = self.build_prompt(segments, flagged)
+            iteration["revised_sentences"] = len(flagged)
+            iteration["prompt_chars"] = len(prompt)
+
+            try:
+                revisions = parse_revisions(self._generate(prompt, cancel))
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error(f"Incremental revise: unusable revision response: {e}")
+                break
+            if Config.SCRUB_OUTPUT if self.scrub is None else self.scrub:
+                # Scrub the rewrites, not the raw JSON around them
+                revisions = {n: scrub_text(text) for n, text in revisions.items()}
+
+            changed = self._splice(segments, flagged, revisions)
+            if not changed:
+                break
+
+            analysis = self._analyze('\n'.join(segments[idx]["text"] for idx in changed))
+            self._apply_scores(segments, changed, analysis, default=analysis.get('ai_score', 0))
+            feedback = analysis.get('overall_feedback', '')
+
+        yield 'result', {
+            "final_text": join_segments(segments),
+            "final_score": self.document_score(segments),
+            "iterations": iterations
+        }
+
+    def build_prompt(self, segments, flagged):
+        items = []
+        for n, idx in enumerate(flagged, 1):
+            before = ' '.join(seg["text"] for seg in segments[max(0, idx - self.context):idx])
+            after = ' '.join(seg["text"] for seg in segments[idx + 1:idx + 1 + self.context])
+            items.append(
+                f"[{n}] Reason: {segments[idx]['reason'] or 'Flagged as AI-like'}\n"
+                f"    Before: {before or '(start of text)'}\n"
+                f"    SENTENCE: {segments[idx]['text']}\n"
+                f"    After: {after or '(end of text)'}"
+            )
+        # Answer is JSON: each rewrite plus a few tokens of id/quoting per item
+        expected = rewrite_tokens(sum(estimate_tokens(segments[idx]["text"]) for idx in flagged)) + 16 * len(flagged)
+        return Prompt(SENTENCE_REVISION_PROMPT.replace('{items}', '\n'.join(items)), expected)
+
+    @staticmethod
+    def document_score(segments):
+        weights = [max(1, len(seg["text"].split())) for seg in segments]
+        if not segments:
+            return 0
+        return round(sum(w * seg["score"] for w, seg in zip(weights, segments)) / sum(weights), 1)
+
+    def _generate(self, prompt, cancel=None):
+        response = ""
+        for chunk in self.provider.generate_stream(prompt=prompt, cancel=cancel, **self.request_kwargs):
+            if chunk and not chunk.startswith("Error:"):
+                response += chunk
+        return response
+
+    def _analyze(self, text):
+        return self.analyzer.analyze(text, provider_name=self.provider_name, prescore=self.prescore, **self.request_kwargs)
+
+    def _splice(self, segments, flagged, revisions):
+        """Replace flagged segments with their rewrites; return indices of the new segments."""
+        replacements = {}
+        for n, idx in enumerate(flagged, 1):
+            if revisions.get(n):
+                replacements[idx] = revisions[n]
+
+        # A rewrite can split into several sentences, so track how far later indices moved
+        changed = []
+        shift = 0
+        for idx in sorted(replacements):
+            old = segments[idx + shift]
+            new_segments = segment(replacements[idx]) or [{"text": replacements[idx], "sep": "", "score": 0, "reason": ""}]
+            new_segments[0].pop("lead", None)
+            new_segments[-1]["sep"] = old["sep"]
+            if "lead" in old:
+                new_segments[0]["lead"] = old["lead"]
+            segments[idx + shift:idx + shift + 1] = new_segments
+            changed.extend(range(idx + shift, idx + shift + len(new_segments)))
+            shift += len(new_segments) - 1
+        return changed
+
+    @staticmethod
+    def _apply_scores(segments, indices, analysis, default):
+        items = [
+            (normalize_text(item.get('sentence', '')).lower(), item.get('score', 0), item.get('reason', ''))
+            for item in analysis.get('sentence_analysis', [])
+            if item.get('sentence')
+        ]
+        for idx in indices:
+            seg = segments[idx]
+            text = normalize_text(seg["text"]).lower()
+            matches = [(score, reason) for sentence, score, reason in items if sentence in text or text in sentence]
+            if matches:
+                seg["score"], seg["reason"] = max(matches, key=lambda m: m[0])
+            else:
+                seg["score"], seg["reason"] = default, ""
+
+# Steers each search draft somewhere different; draft 0 gets the plain prompt
+APPROACHES = [
+    None,
+    "Vary sentence length hard: mix very short sentences and fragments with long, winding ones.",
+    "Make the voice more personal and conversational, with small asides, hedges and opinions.",
+    "Restructure freely: reorder points, merge and split sentences, and drop stock transitions.",
+    "Stay close to the original wording and fix only what the detector flagged.",
+]
+
+def candidate_count(value):
+    """Drafts per round from a request; ValueError unless it's an integer from 1 to AUTO_REVISE_MAX_CANDIDATES."""
+    # Every draft holds a shared chunk-pool thread and an upstream call
+    limit = Config.AUTO_REVISE_MAX_CANDIDATES
+    count = None
+    if isinstance(value, int) and not isinstance(value, bool):
+        count = value
+    elif isinstance(value, str) and value.strip().isdigit():
+        count = int(value)
+    if count is None or not 1 <= count <= limit:
+        raise ValueError(f"candidates must be an integer from 1 to {limit}")
+    return count
+
+class SearchReviser(Reviser):
+    """Best-of-N auto-revise: each round writes N full revisions at once, scores them at once, keeps the best.
+
+    Drafts run on the shared chunk pool. A draft that reaches the target
+    ends the round early and cancels the rest; otherwise the lowest score
+    wins if it beats the current text, and the search stops if none does.
+    """
+
+    def __init__(self, analyzer, provider_name, provider, flag_threshold=FLAG_THRESHOLD, prescore=None, scrub=None,
+                 candidates=None, **request_kwargs):
+        self.analyzer = analyzer
+        self.provider_name = provider_name
+        self.provider = provider
+        self.flag_threshold = flag_threshold
+        self.prescore = prescore
+        self.scrub = Config.SCRUB_OUTPUT if scrub is None else scrub
+        self.candidates = Config.AUTO_REVISE_CANDIDATES if candidates is None else candidate_count(candidates)
+        self.request_kwargs = request_kwargs
+
+    def events(self, text, target_score=15, max_iterations=3, cancel=None):
+        analysis = self._analyze(text, cancel)
+        current = {"text": text, "score": analysis.get('ai_score', 0), "analysis": analysis}
+        iterations = []
+
+        for i in range(max_iterations):
+            iteration = {"iteration": i + 1, "score": current["score"],
+                         "feedback": current["analysis"].get('overall_feedback', '')}
+            iterations.append(iteration)
+            yield 'iteration', iteration
+            logger.info(f"Search revise iteration {i+1}: score={current['score']}")
+            if current["score"] <= target_score:
+                break
+
+            feedback = feedback_for(current["analysis"], self.flag_threshold)
+            best = None
+            scores = []
+            for n, draft, error in self._drafts(current["text"], feedback, cancel):
+                if draft is None:
+                    REVISE_CANDIDATES.inc(outcome='failed')
+                    logger.warning(f"Search revise draft {n} failed: {error}")
+                    yield 'candidate', {"iteration": i + 1, "candidate": n, "error": str(error)}
+                    continue
+                REVISE_CANDIDATES.inc(outcome='scored')
+                scores.append(draft["score"])
+                yield 'candidate', {"iteration": i + 1, "candidate": n, "score": draft["score"]}
+                if best is None or draft["score"] < best["score"]:
+                    best = draft
+                if draft["score"] <= target_score:
+                    # Leaving the loop closes _drafts, which cancels the drafts still running
+                    REVISE_CANDIDATES.inc(outcome='early_exit')
+                    break
+            iteration["candidate_scores"] = scores
+
+            if best is None or best["score"] >= current["score"]:
+                logger.info(f"Search revise: no draft beat {current['score']}, stopping")
+                break
+            current = best
+
+        yield 'result', {
+            "final_text": current["text"],
+            "final_score": current["score"],
+            "iterations": iterations
+        }
+
+    def _drafts(self, text, feedback, cancel):
+        """Yield (n, {"text", "score", "analysis"} or None, error) for each draft as it finishes."""
+        tokens = [CancelToken() for _ in range(self.candidates)]
+        unregister = [cancel.on_cancel(token.cancel) for token in tokens] if cancel is not None else []
+        done = queue.Queue()
+
+        def work(n):
+            try:
+                done.put((n, self._draft(n, text, feedback, tokens[n]), None))
+            except Exception as e:
+                done.put((n, None, e))
+
+        for n in range(self.candidates):
+            submit(work, n)
+        try:
+            for _ in range(self.candidates):
+                yield done.get()
+        finally:
+            for token in tokens:
+                if not token.cancelled:
+                    token.cancel()
+            for callback in unregister:
+                callback()
+
+    def _draft(self, n, text, feedback, cancel):
+        approach = APPROACHES[n % len(APPROACHES)]
+        prompt = build_revision_prompt(text, feedback, self.provider_name, self.request_kwargs.get('model'), approach)
+        revised = ""
+        # Identical prompts must not be coalesced into one generation: each draft is a separate sample
+        for chunk in self.provider.generate_stream(prompt=prompt, cancel=cancel, coalesce=False, **self.request_kwargs):
+            if chunk.startswith("Error:"):
+                raise ValueError(chunk)
+            revised += chunk
+        revised = revised.strip()
+        if cancel.cancelled:
+            raise ValueError("cancelled")
+        if not revised:
+            raise ValueError("empty revision")
+        if self.scrub:
+            revised = scrub_text(revised)
+        analysis = self._analyze(revised, cancel)
+        if analysis.get('failed'):
+            raise ValueError(analysis['reasons'][0])
+        return {"text": revised, "score": analysis.get('ai_score', 0), "analysis": analysis}
+
+    def _analyze(self, text, cancel):
+        for kind, value in self.analyzer.analyze_stream(text, provider_name=self.provider_name, prescore=self.prescore,
+                                                        cancel=cancel, **self.request_kwargs):
+            if kind == 'result':
+                return value
+
+REVISERS = {
+    'full': FullReviser,
+    'incremental': IncrementalReviser,
+    'search': SearchReviser,
+}
+
+def make_reviser(mode, analyzer, provider_name, provider, **kwargs):
+    """Build the auto-revise engine for mode ('full', 'incremental' or 'search')."""
+    if mode not in REVISERS:
+        raise ValueError(f"Unknown auto-revise mode: {mode}")
+    return REVISERS[mode](analyzer, provider_name, provider, **kwargs)
@@ -0,0 +1,307 @@
+"""Latency-aware routing of generations across providers and models.
+
+Each upstream attempt runs on its own thread while the router watches for
+its first token:
+
+- An attempt that fails with a 429, a 5xx or a connection error before its
+  first token fails over to the next backup in FAILOVER_TARGETS.
+- An attempt with no token after TTFT_DEADLINE seconds is cancelled and
+  fails over the same way.
+- With HEDGE_ENABLED, a primary still silent after its recent
+  HEDGE_PERCENTILE time-to-first-token gets a backup started alongside it.
+  Whichever produces a token first wins and the other is cancelled.
+
+Once a token has reached the client the stream is committed to that
+attempt; a later error is reported rather than retried, since the client
+has already shown part of the text.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+import requests
+
+from config.settings import Config
+from app.utils.metrics import UPSTREAM_FAILURES, UPSTREAM_HEDGES
+from app.utils.sse import CancelToken
+
+logger = logging.getLogger(__name__)
+
+# Request arguments that belong to the primary target and are not carried over to a backup
+TARGET_KWARGS = ('api_key', 'model', 'base_url', 'ollamaModel')
+
+class UpstreamError(Exception):
+    """An upstream call that failed; retryable errors may be sent to another target."""
+
+    def __init__(self, message, status=None, retryable=False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+    @classmethod
+    def from_exception(cls, error):
+        if isinstance(error, cls):
+            return error
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+        if status is not None:
+            retryable = status == 429 or status >= 500
+        else:
+            retryable = isinstance(error, (requests.ConnectionError, requests.Timeout))
+        return cls(str(error), status=status, retryable=retryable)
+
+def parse_targets(spec):
+    """'openrouter:meta-llama/llama-3.1-8b-instruct,ollama:llama3:8b' -> [(provider, model)]."""
+    targets = []
+    for entry in spec.split(','):
+        provider, _, model = entry.strip().partition(':')
+        if provider:
+            targets.append((provider, model or None))
+    return targets
+
+class LatencyTracker:
+    """Rolling time-to-first-token and failure samples per (provider, model)."""
+
+    def __init__(self, window=None, min_samples=None):
+        self.window = window or Config.ROUTING_WINDOW
+        self.min_samples = Config.ROUTING_MIN_SAMPLES if min_samples is None else min_samples
+        self._ttft = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider, model, ttft=None):
+        """Record a first token after ttft seconds, or a failure when ttft is None."""
+        key = (provider, model)
+        with self._lock:
+            failures = self._failures.get(key)
+            if failures is None:
+                failures = self._failures[key] = deque(maxlen=self.window)
+            failures.append(ttft is None)
+            if ttft is not None:
+                samples = self._ttft.get(key)
+                if samples is None:
+                    samples = self._ttft[key] = deque(maxlen=self.window)
+                samples.append(ttft)
+
+    def percentile(self, provider, model, q):
+        """TTFT at percentile q, or None until min_samples successes are recorded."""
+        with self._lock:
+            samples = sorted(self._ttft.get((provider, model), ()))
+        if not samples or len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+    def error_rate(self, provider, model):
+        with self._lock:
+            failures = self._failures.get((provider, model))
+            if not failures or len(failures) < self.min_samples:
+                return 0.0
+            return sum(failures) / len(failures)
+
+    def healthy(self, provider, model):
+        return self.error_rate(provider, model) < Config.ROUTING_MAX_ERROR_RATE
+
+    def snapshot(self):
+        with self._lock:
+            keys = sorted(set(self._failures) | set(self._ttft), key=lambda k: (k[0], k[1] or ''))
+        stats = []
+        for provider, model in keys:
+            stats.append({
+                "provider": provider,
+                "model": model,
+                "ttft_p50": self.percentile(provider, model, 50),
+                "ttft_p95": self.percentile(provider, model, 95),
+                "error_rate": round(self.error_rate(provider, model), 3),
+                "samples": len(self._failures.get((provider, model), ()))
+            })
+        return stats
+
+class _Attempt:
+    """One upstream generation pumped into the router's queue from its own thread."""
+
+    def __init__(self, provider, kwargs, events):
+        self.provider = provider
+        self.model = kwargs.get('model')
+        self.label = f"{provider.name}/{self.model}"
+        self.cancel = CancelToken()
+        self.start = time.perf_counter()
+        self.deadline = self.start + Config.TTFT_DEADLINE if Config.TTFT_DEADLINE else None
+        self._kwargs = kwargs
+        self._events = events
+
+    def run(self, prompt):
+        threading.Thread(target=self._pump, args=(prompt,), name=f'upstream-{self.provider.name}', daemon=True).start()
+
+    def _pump(self, prompt):
+        stream = None
+        try:
+            stream = self.provider._stream(prompt, cancel=self.cancel, raise_errors=True, **self._kwargs)
+            for chunk in stream:
+                if self.cancel.cancelled:
+                    break
+                self._events.put((self, 'chunk', chunk))
+            self._events.put((self, 'done', None))
+        except Exception as e:
+            self._events.put((self, 'error', UpstreamError.from_exception(e)))
+        finally:
+            if stream is not None:
+                stream.close()
+
+class Router:
+    def __init__(self, get_provider, tracker=None):
+        self.get_provider = get_provider
+        self.tracker = tracker or LatencyTracker()
+        self.targets = parse_targets(Config.FAILOVER_TARGETS)
+
+    @property
+    def enabled(self):
+        # Without backups or a deadline there is nothing to route: generations go straight to the provider
+        return bool(Config.TTFT_DEADLINE or self.targets)
+
+    def backups(self, provider, kwargs):
+        """(provider, kwargs) for each backup target, healthiest and fastest first."""
+        base = {k: v for k, v in kwargs.items() if k not in TARGET_KWARGS}
+        candidates = []
+        for name, model in self.targets:
+            if name == provider.name and model == kwargs.get('model'):
+                continue
+            try:
+                backup = self.get_provider(name)
+            except ValueError as e:
+                logger.warning(f"Skipping failover target {name}: {e}")
+                continue
+            target_kwargs = dict(base, model=model) if model else dict(base)
+            if name == provider.name:
+                # Same provider, other model: the caller's credentials and endpoint still apply
+                target_kwargs.update({k: kwargs[k] for k in ('api_key', 'base_url') if k in kwargs})
+            else:
+                target_kwargs['api_key'] = Config.PROVIDER_API_KEYS.get(name) or None
+            candidates.append((backup, target_kwargs))
+
+        def rank(candidate):
+            backup, target_kwargs = candidate
+            model = target_kwargs.get('model')
+            p50 = self.tracker.percentile(backup.name, model, 50)
+            return (not self.tracker.healthy(backup.name, model), float('inf') if p50 is None else p50)
+
+        return sorted(candidates, key=rank)
+
+    def hedge_delay(self, provider, model):
+        if not self.tracker.healthy(provider.name, model):
+            return 0.0
+        ttft = self.tracker.percentile(provider.name, model, Config.HEDGE_PERCENTILE)
+        return Config.HEDGE_DELAY if ttft is None else ttft
+
+    def generate_stream(self, provider, prompt, cancel=None, **kwargs):
+        """Yield text chunks from the first target to produce a token."""
+        events = queue.Queue()
+        live = []
+        candidates = self.backups(provider, kwargs)
+
+        def launch(target, target_kwargs):
+            attempt = _Attempt(target, target_kwargs, events)
+            live.append(attempt)
+            attempt.run(prompt)
+            return attempt
+
+        def cancel_all():
+            for attempt in list(live):
+                attempt.cancel.cancel()
+
+        unregister = cancel.on_cancel(cancel_all) if cancel is not None else None
+        winner = None
+        try:
+            primary = launch(provider, kwargs)
+            hedge_at = None
+            if Config.HEDGE_ENABLED and candidates:
+                hedge_at = primary.start + self.hedge_delay(provider, primary.model)
+            hedged = False
+            last_error = None
+
+            while winner is None:
+                if cancel is not None and cancel.cancelled:
+                    return
+                wakeups = [a.deadline for a in live if a.deadline is not None]
+                if hedge_at is not None:
+                    wakeups.append(hedge_at)
+                timeout = max(0.0, min(wakeups) - time.perf_counter()) if wakeups else None
+                try:
+                    attempt, kind, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    now = time.perf_counter()
+                    if hedge_at is not None and now >= hedge_at:
+                        hedge_at = None
+                        # A failover may already have used up the backups
+                        if candidates:
+                            hedged = True
+                            logger.info(f"Hedging {primary.label} after {now - primary.start:.2f}s without a token")
+                            launch(*candidates.pop(0))
+                    for attempt in [a for a in live if a.deadline is not None and now >= a.deadline]:
+                        live.remove(attempt)
+                        attempt.cancel.cancel()
+                        last_error = UpstreamError(
+                            f"No response from {attempt.label} within {Config.TTFT_DEADLINE:g}s", retryable=True)
+                        self._failed(attempt, last_error, 'deadline')
+                    if not live and candidates:
+                        launch(*candidates.pop(0))
+                    elif not live:
+                        break
+                    continue
+
+                if attempt not in live:
+                    # A cancelled attempt still winding down
+                    continue
+                if kind == 'chunk':
+                    winner = attempt
+                    break
+                live.remove(attempt)
+                if kind == 'done':
+                    # Finished without any text; nothing better to fail over to
+                    self.tracker.record(attempt.provider.name, attempt.model, time.perf_counter() - attempt.start)
+                    return
+                last_error = value
+                self._failed(attempt, value, 'error')
+                if not live:
+                    if value.retryable and candidates:
+                        launch(*candidates.pop(0))
+                    else:
+                        break
+
+            if winner is None:
+                yield f"Error: {last_error}"
+                return
+
+            self.tracker.record(winner.provider.name, winner.model, time.perf_counter() - winner.start)
+            if hedged:
+                UPSTREAM_HEDGES.inc(winner='primary' if winner is primary else 'backup')
+            for attempt in live:
+                if attempt is not winner:
+                    attempt.cancel.cancel()
+            live[:] = [winner]
+            if winner is not primary:
+                logger.info(f"Serving {primary.label} request from {winner.label}")
+
+            yield value
+            while True:
+                attempt, kind, value = events.get()
+                if attempt is not winner:
+                    continue
+                if kind == 'chunk':
+                    yield value
+                elif kind == 'done':
+                    live.clear()
+                    return
+                else:
+                    live.clear()
+                    yield f"Error: {value}"
+                    return
+        finally:
+            if unregister is not None:
+                unregister()
+            cancel_all()
+
+    def _failed(self, attempt, error, reason):
+        logger.warning(f"Upstream {attempt.label} failed ({reason}): {error}")
+        self.tracker.record(attempt.provider.name, attempt.model)
+        UPSTREAM_FAILURES.inc(provider=attempt.provider.name, reason=reason)
@@ -0,0 +1,255 @@
+"""Concurrency limits per upstream lane, with fair queuing and adaptive limits.
+
+A lane is one (provider, API key, model): the unit a provider rate-limits.
+Each lane runs at most `limit` upstream calls at once; further calls wait in
+per-priority queues and are let through by start-time fair queuing, so with
+the default weights interactive streams get four slots for every one that
+goes to background work (auto-revise, batch jobs, document humanizing)
+while both keep moving.
+
+The limit adapts the way TCP's congestion window does (AIMD): every call
+that finishes cleanly adds 1/limit (about one slot per limit's worth of
+successes), a 429 halves it and, with SCHEDULER_LATENCY_TARGET set, a first
+token slower than the target shrinks it by a tenth. Calls that were already
+in flight when the limit was cut don't cut it again.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import deque
+
+from config.settings import Config
+from app.services.routing import UpstreamError
+from app.utils.metrics import SCHEDULER_ACTIVE, SCHEDULER_QUEUED, SCHEDULER_THROTTLED, SCHEDULER_TIMEOUTS, SCHEDULER_WAIT
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+THROTTLE_DECREASE = 0.5
+LATENCY_DECREASE = 0.9
+MIN_LIMIT = 1.0
+
+def parse_weights(spec):
+    """'interactive:4,background:1' -> {'interactive': 4.0, 'background': 1.0}."""
+    weights = {}
+    for entry in spec.split(','):
+        name, _, weight = entry.strip().partition(':')
+        if name:
+            weights[name] = float(weight or 1)
+    return weights
+
+def lane_key(provider_name, kwargs):
+    """(provider, credential fingerprint, model) for a call's request kwargs; the key itself is not kept."""
+    credential = kwargs.get('api_key') or kwargs.get('base_url') or ''
+    fingerprint = hashlib.sha256(credential.encode()).hexdigest()[:12] if credential else '-'
+    return provider_name, fingerprint, kwargs.get('ollamaModel') or kwargs.get('model') or ''
+
+class _Waiter:
+    __slots__ = ('priority', 'tag', 'wake', 'slot', 'queued')
+
+    def __init__(self, priority, tag, wake):
+        self.priority = priority
+        self.tag = tag
+        self.wake = wake
+        self.slot = None
+        self.queued = time.monotonic()
+
+class Lane:
+    def __init__(self, key, limit, priorities):
+        self.key = key
+        self.limit = float(limit)
+        self.active = 0
+        self.queues = {p: deque() for p in priorities}
+        # Fair-queuing clock: the tag of the last waiter let through, and the last tag given per priority
+        self.virtual = 0.0
+        self.last_tag = {p: 0.0 for p in priorities}
+        self.last_decrease = 0.0
+        self.throttled = 0
+        self.used = time.monotonic()
+
+    @property
+    def capacity(self):
+        return int(self.limit)
+
+    @property
+    def waiting(self):
+        return sum(len(q) for q in self.queues.values())
+
+class Slot:
+    """A granted upstream call; release() it with how the call went."""
+
+    __slots__ = ('scheduler', 'lane', 'priority', 'start', 'released')
+
+    def __init__(self, scheduler, lane, priority):
+        self.scheduler = scheduler
+        self.lane = lane
+        self.priority = priority
+        self.start = time.monotonic()
+        self.released = False
+
+    def release(self, outcome='ok', ttft=None):
+        """outcome is 'ok', 'throttled' (a 429), 'error' or 'cancelled'; ttft in seconds if a token arrived."""
+        self.scheduler._release(self, outcome, ttft)
+
+class Scheduler:
+    def __init__(self, enabled=None, initial_limit=None, max_limit=None, weights=None, queue_timeout=None,
+                 latency_target=None):
+        self.enabled = Config.SCHEDULER_ENABLED if enabled is None else enabled
+        self.initial_limit = initial_limit or Config.SCHEDULER_INITIAL_CONCURRENCY
+        self.max_limit = max_limit or Config.SCHEDULER_MAX_CONCURRENCY
+        self.weights = weights or parse_weights(Config.SCHEDULER_WEIGHTS)
+        self.queue_timeout = Config.SCHEDULER_QUEUE_TIMEOUT if queue_timeout is None else queue_timeout
+        self.latency_target = Config.SCHEDULER_LATENCY_TARGET if latency_target is None else latency_target
+        self._lanes = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key, priority=None, cancel=None, timeout=None):
+        """Block until key's lane has a free slot and return it, or None if cancel fired first.
+
+        Raises a retryable UpstreamError (503) after timeout seconds
+        (SCHEDULER_QUEUE_TIMEOUT) in the queue, so the router can fail over.
+        """
+        if not self.enabled:
+            return None
+        event = threading.Event()
+        slot, waiter = self._enqueue(key, priority, event.set)
+        if slot is not None:
+            return slot
+        unregister = cancel.on_cancel(event.set) if cancel is not None else None
+        try:
+            event.wait(self.queue_timeout if timeout is None else timeout)
+        finally:
+            if unregister is not None:
+                unregister()
+        return self._settle(key, waiter, cancelled=cancel is not None and cancel.cancelled)
+
+    async def acquire_async(self, key, priority=None, timeout=None):
+        """acquire() for the event loop; task cancellation takes the place of a CancelToken."""
+        if not self.enabled:
+            return None
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            # Called under the scheduler lock, possibly from a worker thread
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        slot, waiter = self._enqueue(key, priority, wake)
+        if slot is not None:
+            return slot
+        try:
+            await asyncio.wait_for(granted, self.queue_timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            slot = self._settle(key, waiter, cancelled=True)
+            if slot is not None:
+                slot.release('cancelled')
+            raise
+        return self._settle(key, waiter, cancelled=False)
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "provider": lane.key[0],
+                "key": lane.key[1],
+                "model": lane.key[2],
+                "limit": round(lane.limit, 2),
+                "active": lane.active,
+                "queued": {p: len(q) for p, q in lane.queues.items()},
+                "oldest_wait": round(max((now - q[0].queued for q in lane.queues.values() if q), default=0.0), 3),
+                "throttled": lane.throttled,
+            } for lane in self._lanes.values()]
+
+    def _enqueue(self, key, priority, wake):
+        """(slot, None) when a slot is free now, else (None, waiter) queued behind the others."""
+        priority = priority if priority in self.weights else INTERACTIVE
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is None:
+                self._prune()
+                lane = self._lanes[key] = Lane(key, self.initial_limit, self.weights)
+            lane.used = time.monotonic()
+            if lane.active < lane.capacity and not lane.waiting:
+                SCHEDULER_WAIT.observe(0.0, provider=key[0], priority=priority)
+                return self._grant(lane, priority), None
+            # Start-time fair queuing: a priority that has been idle starts at the lane's clock
+            tag = max(lane.virtual, lane.last_tag[priority]) + 1.0 / self.weights[priority]
+            lane.last_tag[priority] = tag
+            waiter = _Waiter(priority, tag, wake)
+            lane.queues[priority].append(waiter)
+            SCHEDULER_QUEUED.inc(provider=key[0], priority=priority)
+            return None, waiter
+
+    def _settle(self, key, waiter, cancelled):
+        """The waiter's slot once woken, leaving the queue if none was granted."""
+        with self._lock:
+            slot = waiter.slot
+            if slot is None:
+                self._lanes[key].queues[waiter.priority].remove(waiter)
+                SCHEDULER_QUEUED.dec(provider=key[0], priority=waiter.priority)
+        if slot is not None or cancelled:
+            return slot
+        SCHEDULER_TIMEOUTS.inc(provider=key[0], priority=waiter.priority)
+        raise UpstreamError(f"No {key[0]} slot free after {time.monotonic() - waiter.queued:.1f}s in the queue",
+                            status=503, retryable=True)
+
+    def _grant(self, lane, priority):
+        lane.active += 1
+        SCHEDULER_ACTIVE.inc(provider=lane.key[0])
+        return Slot(self, lane, priority)
+
+    def _dispatch(self, lane):
+        """Hand free slots to the waiters with the smallest tags (called under the lock)."""
+        while lane.active < lane.capacity:
+            heads = [q[0] for q in lane.queues.values() if q]
+            if not heads:
+                return
+            waiter = min(heads, key=lambda w: w.tag)
+            lane.queues[waiter.priority].popleft()
+            lane.virtual = waiter.tag
+            SCHEDULER_QUEUED.dec(provider=lane.key[0], priority=waiter.priority)
+            SCHEDULER_WAIT.observe(time.monotonic() - waiter.queued, provider=lane.key[0], priority=waiter.priority)
+            waiter.slot = self._grant(lane, waiter.priority)
+            waiter.wake()
+
+    def _release(self, slot, outcome, ttft):
+        lane = slot.lane
+        with self._lock:
+            if slot.released:
+                return
+            slot.released = True
+            lane.active -= 1
+            lane.used = time.monotonic()
+            SCHEDULER_ACTIVE.dec(provider=lane.key[0])
+            # Only calls started after the last cut reflect the current limit
+            fresh = slot.start >= lane.last_decrease
+            if outcome == 'throttled':
+                lane.throttled += 1
+                SCHEDULER_THROTTLED.inc(provider=lane.key[0])
+                if fresh:
+                    self._decrease(lane, THROTTLE_DECREASE, 'upstream 429')
+            elif outcome == 'ok':
+                if self.latency_target and ttft is not None and ttft > self.latency_target:
+                    if fresh:
+                        self._decrease(lane, LATENCY_DECREASE, f"first token after {ttft:.1f}s")
+                else:
+                    lane.limit = min(self.max_limit, lane.limit + 1.0 / lane.limit)
+            self._dispatch(lane)
+
+    def _decrease(self, lane, factor, reason):
+        lane.limit = max(MIN_LIMIT, lane.limit * factor)
+        lane.last_decrease = time.monotonic()
+        logger.info(f"Upstream {lane.key[0]}/{lane.key[2]} concurrency limit down to {lane.limit:.1f} ({reason})")
+
+    def _prune(self):
+        # Lanes idle for a while go back to the initial limit when they're next used
+        cutoff = time.monotonic() - Config.SCHEDULER_IDLE_TTL
+        for key in [k for k, lane in self._lanes.items() if lane.used < cutoff and not lane.active and not lane.waiting]:
+            del self._lanes[key]
+
+scheduler = Scheduler()
@@ -0,0 +1,312 @@
+"""Rewrite banned vocabulary in generated text as it streams.
+
+prompt.txt bans a fixed vocabulary and gives a word-swap table, but models
+still slip. Rather than finding out from an /api/check round trip and paying
+for another revision cycle, StreamScrubber rewrites the hits inline on their
+way to the client.
+
+Matching is one Aho-Corasick automaton over every term (all inflections
+expanded up front), fed a character at a time, so a term split across two
+chunks ("... furth" + "ermore, ...") is found like any other. A match only
+counts on word boundaries, which takes one character of lookahead. Text is
+held back only while it could still be the start of a term; everything
+before that is released with the chunk that made it safe, so the added delay
+is at most one partial word or phrase.
+"""
+import functools
+import re
+
+from app.services.providers import base_prompt
+from app.utils.metrics import SCRUBBED_TERMS
+from config.settings import Config
+
+# Banned term -> plain replacement. Verbs map to (base, -s, past, -ing) forms,
+# nouns to (singular, plural); both sides are inflected together. Only
+# rewrites that read the same in any sentence belong here: a word with a
+# legitimate other sense ("foster care", "vital signs") is left alone, and a
+# word that can't stand in for the term on its own is mapped as a phrase.
+REPLACEMENTS = {
+    'delve': ('dig', 'digs', 'dug', 'digging'),
+    'utilize': ('use', 'uses', 'used', 'using'),
+    'facilitate': ('help', 'helps', 'helped', 'helping'),
+    'streamline': ('simplify', 'simplifies', 'simplified', 'simplifying'),
+    'elucidate': ('explain', 'explains', 'explained', 'explaining'),
+    'exemplify': ('show', 'shows', 'showed', 'showing'),
+    'demonstrate': ('show', 'shows', 'showed', 'showing'),
+    'navigate to': 'go to',
+    'navigates to': 'goes to',
+    'navigated to': 'went to',
+    'navigating to': 'going to',
+    'a myriad of': 'many',
+    'myriad': 'many',
+    'a plethora of': 'many',
+    'multifaceted': 'complicated',
+    'comprehensive': 'full',
+    'robust': 'strong',
+    'seamless': 'smooth',
+    'seamlessly': 'smoothly',
+    'pivotal': 'key',
+    'crucial': 'key',
+    'fundamental': 'basic',
+    'fundamentally': 'basically',
+    'groundbreaking': 'new',
+    'intricate': 'complex',
+    'meticulous': 'careful',
+    'meticulously': 'carefully',
+    'furthermore': 'also',
+    'moreover': 'also',
+    'additionally': 'also',
+    'nevertheless': 'still',
+    'in conclusion': 'so',
+    'first and foremost': 'first',
+    'it is important to note that': 'note that',
+    'that being said': 'still',
+    "in today's world": 'today',
+    'in the modern era': 'today',
+}
+
+SWAP_HEADING_RE = re.compile(r'^#+.*WORD SWAPS', re.IGNORECASE)
+SWAP_ROW_RE = re.compile(r'^\|\s*([^|]+?)\s*\|\s*([^|]+?)\s*\|\s*$')
+
+def swap_table(prompt):
+    """{instead_of: use} from the WORD SWAPS table in prompt.txt (first alternative of each row)."""
+    swaps = {}
+    in_table = False
+    for line in prompt.splitlines():
+        if SWAP_HEADING_RE.match(line):
+            in_table = True
+            continue
+        if in_table and line.startswith('#'):
+            break
+        row = SWAP_ROW_RE.match(line) if in_table else None
+        if row and not set(row.group(1)) <= set('-') and row.group(1).upper() != 'INSTEAD OF':
+            swaps[row.group(1).lower()] = row.group(2).split(',')[0].strip()
+    return swaps
+
+def _verb_forms(verb):
+    if verb.endswith('e'):
+        return verb, verb + 's', verb + 'd', verb[:-1] + 'ing'
+    if verb.endswith('y'):
+        return verb, verb[:-1] + 'ies', verb[:-1] + 'ied', verb + 'ing'
+    return verb, verb + 's', verb + 'ed', verb + 'ing'
+
+def _noun_forms(noun):
+    if noun.endswith('y'):
+        return noun, noun[:-1] + 'ies'
+    return noun, noun + 's'
+
+def expand(replacements):
+    """Every surface form of every term -> its replacement."""
+    table = {}
+    for term, replacement in replacements.items():
+        if isinstance(replacement, tuple):
+            forms = _verb_forms(term) if len(replacement) == 4 else _noun_forms(term)
+            table.update(zip(forms, replacement))
+        else:
+            table[term] = replacement
+    return table
+
+def _is_word(char):
+    return char.isalnum() or char in "'’-"
+
+def _match_case(source, replacement):
+    if source.isupper() and len(source) > 1:
+        return replacement.upper()
+    if source[0].isupper():
+        return replacement[0].upper() + replacement[1:]
+    return replacement
+
+class Automaton:
+    """Aho-Corasick automaton over lowercase terms."""
+
+    def __init__(self, terms):
+        self.goto = [{}]
+        self.fail = [0]
+        self.depth = [0]
+        self.output = [()]
+        for term in terms:
+            state = 0
+            for char in term:
+                nxt = self.goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][char] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.depth.append(self.depth[state] + 1)
+                    self.output.append(())
+                state = nxt
+            self.output[state] = (term,)
+
+        # Breadth-first failure links; outputs inherit their suffix states' terms
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                if state:
+                    self.fail[nxt] = self.step(self.fail[state], char)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def step(self, state, char):
+        while state and char not in self.goto[state]:
+            state = self.fail[state]
+        return self.goto[state].get(char, 0)
+
+@functools.lru_cache(maxsize=None)
+def default_table():
+    """Built-in replacements plus prompt.txt's swap table, which wins where both list a term (built on first use)."""
+    table = expand(REPLACEMENTS)
+    table.update(swap_table(base_prompt()))
+    return table
+
+@functools.lru_cache(maxsize=None)
+def default_automaton():
+    return Automaton(default_table())
+
+class StreamScrubber:
+    """feed() chunks of generated text, get back the scrubbed text that is safe to emit."""
+
+    def __init__(self, table=None, automaton=None):
+        self.table = table or default_table()
+        self.automaton = automaton or (default_automaton() if table is None else Automaton(self.table))
+        self.replaced = 0
+        self._buf = ''
+        self._base = 0          # absolute offset of _buf[0]
+        self._pos = 0           # absolute offset of the next character
+        self._state = 0
+        self._last = ' '        # last character released, for the left word boundary
+        self._candidates = []   # (start, end, term) waiting for a right boundary
+        self._matches = []      # confirmed (start, end, term), in order
+
+    def feed(self, chunk):
+        automaton = self.automaton
+        state = self._state
+        pos = self._pos
+        self._buf += chunk
+        for char in chunk:
+            if self._candidates:
+                # A term counts only if the character after it ends the word
+                confirmed = not _is_word(char)
+                for candidate in self._candidates:
+                    if confirmed:
+                        self._confirm(candidate)
+                self._candidates = []
+            lower = char.lower()
+            if lower == '’':
+                lower = "'"
+            elif lower.isspace():
+                lower = ' '
+            state = automaton.step(state, lower)
+            for term in automaton.output[state]:
+                start = pos + 1 - len(term)
+                before = self._buf[start - 1 - self._base] if start > self._base else self._last
+                if not _is_word(before):
+                    self._candidates.append((start, pos + 1, term))
+            pos += 1
+        self._state, self._pos = state, pos
+
+        # Hold back the longest tail that could still grow into a term
+        cut = pos - automaton.depth[state]
+        for start, _, _ in self._candidates:
+            cut = min(cut, start)
+        return self._release(cut)
+
+    def flush(self):
+        """Release everything; the end of the stream is a word boundary."""
+        for candidate in self._candidates:
+            self._confirm(candidate)
+        self._candidates = []
+        self._state = 0
+        return self._release(self._pos)
+
+    def _confirm(self, candidate):
+        start, end, term = candidate
+        if start < self._base:
+            return
+        # A phrase confirmed after a term inside it ("a myriad of" after "myriad") replaces it
+        while self._matches and start <= self._matches[-1][0] and end >= self._matches[-1][1]:
+            self._matches.pop()
+        if self._matches and start < self._matches[-1][1]:
+            # Overlaps a term already rewritten; keep the earlier one
+            return
+        self._matches.append(candidate)
+
+    def _release(self, cut):
+        # Never split a confirmed match
+        for start, end, _ in self._matches:
+            if start < cut < end:
+                cut = start
+        if cut <= self._base:
+            return ''
+        out = []
+        index = self._base
+        keep = []
+        for start, end, term in self._matches:
+            if end > cut:
+                keep.append((start, end, term))
+                continue
+            out.append(self._buf[index - self._base:start - self._base])
+            source = self._buf[start - self._base:end - self._base]
+            out.append(_match_case(source, self.table[term]))
+            SCRUBBED_TERMS.inc(term=term)
+            self.replaced += 1
+            index = end
+        out.append(self._buf[index - self._base:cut - self._base])
+        self._matches = keep
+        self._last = self._buf[cut - self._base - 1]
+        self._buf = self._buf[cut - self._base:]
+        self._base = cut
+        return ''.join(out)
+
+def scrub_text(text):
+    scrubber = StreamScrubber()
+    return scrubber.feed(text) + scrubber.flush()
+
+def scrub_stream(stream, enabled=None):
+    """Wrap a generate_stream() iterator; "Error:" chunks pass through untouched."""
+    if not (Config.SCRUB_OUTPUT if enabled is None else enabled):
+        yield from stream
+        return
+    scrubber = StreamScrubber()
+    try:
+        for chunk in stream:
+            if chunk and chunk.startswith('Error:'):
+                pending = scrubber.flush()
+                if pending:
+                    yield pending
+                yield chunk
+                continue
+            text = scrubber.feed(chunk)
+            if text:
+                yield text
+        tail = scrubber.flush()
+        if tail:
+            yield tail
+    finally:
+        if hasattr(stream, 'close'):
+            stream.close()
+
+async def scrub_stream_async(stream, enabled=None):
+    """scrub_stream for the async providers."""
+    if not (Config.SCRUB_OUTPUT if enabled is None else enabled):
+        async for chunk in stream:
+            yield chunk
+        return
+    scrubber = StreamScrubber()
+    try:
+        async for chunk in stream:
+            if chunk and chunk.startswith('Error:'):
+                pending = scrubber.flush()
+                if pending:
+                    yield pending
+                yield chunk
+                continue
+            text = scrubber.feed(chunk)
+            if text:
+                yield text
+        tail = scrubber.flush()
+        if tail:
+            yield tail
+    finally:
+        if hasattr(stream, 'aclose'):
+            await stream.aclose()
@@ -0,0 +1,124 @@
+"""Incremental decoding of upstream streaming responses, straight from bytes.
+
+Providers used to split responses with iter_lines(), decode every line and
+treat each as a complete event, which loses SSE events whose data spans
+several lines. Here the raw bytes go through a decoder that hands back one
+payload per event:
+
+- SSEDecoder (Gemini, OpenRouter) gathers an event's `data:` lines up to
+  the blank line that ends it, joining multi-line data with newlines and
+  skipping comments and other fields. Lines end in \n or \r\n, whichever
+  the stream's first line uses.
+- NDJSONDecoder (Ollama) returns each non-empty line.
+
+Both split whole chunks with bytes methods, so the per-event cost is a
+slice. Payloads that aren't valid JSON are counted in
+humanizer_upstream_parse_errors_total instead of being silently dropped.
+"""
+import json
+import logging
+import threading
+
+from app.utils.metrics import UPSTREAM_PARSE_ERRORS
+
+logger = logging.getLogger(__name__)
+
+_usage_lock = threading.Lock()
+# json.loads on bytes first sniffs the encoding in Python; upstream streams are always UTF-8
+_decode_json = json.JSONDecoder().decode
+
+class SSEDecoder:
+    """text/event-stream decoder: feed() bytes as they arrive, get back the completed events' data."""
+
+    __slots__ = ('_buf', '_end')
+
+    def __init__(self):
+        self._buf = b''
+        # Blank line ending an event: b'\n\n', or b'\r\n\r\n' once the stream turns out to use CRLF
+        self._end = None
+
+    def feed(self, chunk):
+        buf = self._buf + chunk if self._buf else chunk
+        end = self._end
+        if end is None:
+            newline = buf.find(b'\n')
+            if newline < 0:
+                self._buf = buf
+                return []
+            end = self._end = b'\r\n\r\n' if newline and buf[newline - 1] == 13 else b'\n\n'
+        # Splitting on the blank line keeps the scan in C
+        blocks = buf.split(end)
+        self._buf = blocks.pop()
+        events = []
+        for block in blocks:
+            # Nearly every event is one "data: ..." line
+            if block.startswith(b'data: ') and b'\n' not in block:
+                events.append(block[6:])
+            elif block:
+                data = self._data(block)
+                if data is not None:
+                    events.append(data)
+        return events
+
+    @staticmethod
+    def _data(block):
+        """Data of a multi-line event: its data lines joined by newlines; comments and other fields dropped."""
+        lines = [line[6:] if line.startswith(b'data: ') else line[5:]
+                 for line in block.replace(b'\r\n', b'\n').split(b'\n') if line.startswith(b'data:')]
+        return b'\n'.join(lines) if lines else None
+
+    def close(self):
+        """Data of an event the stream ended without terminating, if any."""
+        block, self._buf = self._buf.rstrip(b'\r\n'), b''
+        data = self._data(block) if block else None
+        return [data] if data is not None else []
+
+class NDJSONDecoder:
+    """Newline-delimited JSON decoder: feed() bytes, get back each complete non-empty line."""
+
+    __slots__ = ('_buf',)
+
+    def __init__(self):
+        self._buf = b''
+
+    def feed(self, chunk):
+        buf = self._buf + chunk if self._buf else chunk
+        lines = buf.split(b'\n')
+        self._buf = lines.pop()
+        return [line for line in lines if line.strip()]
+
+    def close(self):
+        line, self._buf = self._buf, b''
+        return [line] if line.strip() else []
+
+def iter_payloads(decoder, chunks):
+    """Event payloads from an iterable of byte chunks."""
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    yield from decoder.close()
+
+async def aiter_payloads(decoder, chunks):
+    """iter_payloads for an async iterable of byte chunks."""
+    async for chunk in chunks:
+        for payload in decoder.feed(chunk):
+            yield payload
+    for payload in decoder.close():
+        yield payload
+
+def add_usage(total, usage):
+    """Add one call's token counts to a caller's running total (shared by chunk workers)."""
+    with _usage_lock:
+        for kind, tokens in usage.items():
+            total[kind] = total.get(kind, 0) + tokens
+
+def load_event(payload, provider):
+    """The JSON object in an event payload, or None (counted and logged) if it isn't one."""
+    try:
+        data = _decode_json(payload.decode('utf-8'))
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        return data
+    UPSTREAM_PARSE_ERRORS.inc(provider=provider)
+    logger.warning(f"Unparseable {provider} stream event: {payload[:200]!r}")
+    return None
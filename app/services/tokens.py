@@ -0,0 +1,121 @@
+"""Token estimates and per-model context budgets.
+
+Prompts are sized against the model that will run them, not against fixed
+numbers: the output cap follows the input length, the style rules shrink
+to their compact form when the full prompt.txt would crowd out the answer,
+and a request that cannot fit at all is refused (or chunked) before any
+upstream call instead of coming back truncated.
+"""
+import json
+
+from config.settings import Config
+
+# (provider, model prefix, context window, max output tokens); first match wins, '' matches any model
+MODEL_LIMITS = [
+    ('gemini', 'gemini-1.5', 1048576, 8192),
+    ('gemini', 'gemini-2.0', 1048576, 8192),
+    ('gemini', '', 1048576, 65536),
+    ('openrouter', 'anthropic/', 200000, 8192),
+    ('openrouter', 'openai/gpt-4o', 128000, 16384),
+    ('openrouter', 'google/gemini', 1048576, 8192),
+    ('openrouter', 'meta-llama/llama-3', 131072, 4096),
+    ('openrouter', 'mistralai/', 32768, 4096),
+    ('openrouter', '', 32768, 4096),
+    # Also sent as num_ctx: Ollama's own default window silently truncates prompt.txt
+    ('ollama', '', 8192, 4096),
+]
+
+# (provider, model prefix) of models that think before answering; thinking tokens count against max_tokens
+THINKING_MODELS = [
+    ('gemini', 'gemini-2.5'),
+    ('gemini', 'gemini-3'),
+    ('openrouter', 'google/gemini-2.5'),
+    ('openrouter', 'google/gemini-3'),
+    ('openrouter', 'openai/o'),
+    ('openrouter', 'deepseek/deepseek-r1'),
+]
+
+class BudgetError(ValueError):
+    """The prompt and its expected output don't fit the model's context window."""
+
+class Prompt(str):
+    """Prompt text that knows roughly how long its answer should be.
+
+    Providers read expected_tokens (the least the answer needs) and
+    target_tokens (a longer answer the prompt asks for, if any) to size
+    max_tokens; as a str it works everywhere a plain prompt does.
+    """
+
+    expected_tokens = None
+    target_tokens = None
+
+    def __new__(cls, text, expected_tokens=None, target_tokens=None):
+        prompt = super().__new__(cls, text)
+        prompt.expected_tokens = expected_tokens
+        prompt.target_tokens = target_tokens
+        return prompt
+
+def estimate_tokens(text):
+    """Cheap token estimate: ~4 UTF-8 bytes per token, so non-English text counts for more."""
+    return (len(text.encode('utf-8')) + 3) // 4
+
+def _overrides():
+    # MODEL_LIMITS='{"ollama:llama3.1": [131072, 8192]}'
+    if not Config.MODEL_LIMITS:
+        return []
+    limits = []
+    for key, (context, max_output) in json.loads(Config.MODEL_LIMITS).items():
+        provider, _, prefix = key.partition(':')
+        limits.append((provider, prefix, int(context), int(max_output)))
+    return limits
+
+_limits = _overrides() + MODEL_LIMITS
+
+def model_limits(provider_name, model):
+    """(context window, max output tokens) for a provider/model."""
+    model = model or ''
+    for provider, prefix, context, max_output in _limits:
+        if provider == provider_name and model.startswith(prefix):
+            return context, max_output
+    return 8192, 2048
+
+def thinking_tokens(provider_name, model):
+    """Headroom for a thinking model's reasoning, which is billed against the same output cap."""
+    model = model or ''
+    if any(provider == provider_name and model.startswith(prefix) for provider, prefix in THINKING_MODELS):
+        return Config.THINKING_TOKENS
+    return 0
+
+def rewrite_tokens(text_tokens):
+    """Expected output for a rewrite of text_tokens of input; humanized text runs a little longer."""
+    return int(text_tokens * Config.OUTPUT_RATIO) + Config.OUTPUT_SLACK
+
+def available_tokens(provider_name, model, prompt_tokens):
+    """Output tokens left once prompt_tokens (and the safety margin) are in the window."""
+    context, max_output = model_limits(provider_name, model)
+    return min(max_output, context - prompt_tokens - Config.CONTEXT_MARGIN)
+
+def fits(provider_name, model, prompt_tokens, expected_tokens):
+    return available_tokens(provider_name, model, prompt_tokens) >= expected_tokens
+
+def max_output_tokens(provider_name, model, prompt):
+    """max_tokens for prompt: its expected output when known, else whatever the window leaves.
+
+    A prompt's target length and a thinking model's reasoning are added on
+    top; only the context window lowers the cap below that. Raises
+    BudgetError when the expected answer would be cut off.
+    """
+    prompt_tokens = estimate_tokens(prompt)
+    available = available_tokens(provider_name, model, prompt_tokens)
+    expected = getattr(prompt, 'expected_tokens', None)
+    if available < max(expected or 0, Config.OUTPUT_MIN_TOKENS):
+        context, _ = model_limits(provider_name, model)
+        raise BudgetError(
+            f"Input too long for {provider_name}/{model or 'default'}: "
+            f"~{prompt_tokens} prompt tokens + ~{expected or Config.OUTPUT_MIN_TOKENS} output tokens "
+            f"exceed its {context}-token context"
+        )
+    if expected is None:
+        return available
+    wanted = max(expected, getattr(prompt, 'target_tokens', None) or 0, Config.OUTPUT_MIN_TOKENS)
+    return min(available, wanted + thinking_tokens(provider_name, model))
@@ -0,0 +1,267 @@
+"""In-process counters and histograms exported in the Prometheus text format.
+
+Deliberately tiny: a metric is a dict of label values -> numbers behind one
+lock, and an observation is a bisect plus two additions, so instrumentation
+costs around a microsecond and can stay on in production. Each worker
+process keeps its own registry; scrape every worker (or aggregate with the
+pid label Prometheus adds per target).
+"""
+import bisect
+import threading
+import time
+
+# Seconds; covers sub-millisecond parses up to multi-minute generations
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, '') for name in self.labels), 0)
+
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+class Gauge(Counter):
+    """A value that goes up and down, e.g. a queue depth."""
+
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., sum, count]; bucket counts are non-cumulative until export
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 3)
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        state = self._values.get(tuple(labels.get(name, '') for name in self.labels))
+        return state[-1] if state else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), state):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels, key, ('le', _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(state[-2])}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {state[-1]}"
+
+class _Timer:
+    """Context manager observing elapsed seconds into a histogram."""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upstream LLM streams
+UPSTREAM_CONNECT = registry.histogram(
+    'humanizer_upstream_connect_seconds',
+    'Time from sending the upstream request to receiving response headers.', ('provider',))
+UPSTREAM_FIRST_CHUNK = registry.histogram(
+    'humanizer_upstream_first_chunk_seconds',
+    'Time from sending the upstream request to the first generated text chunk.', ('provider',))
+UPSTREAM_STREAM = registry.histogram(
+    'humanizer_upstream_stream_seconds',
+    'Total duration of upstream generation streams.', ('provider', 'outcome'))
+UPSTREAM_CHUNKS = registry.counter(
+    'humanizer_upstream_chunks_total', 'Text chunks received from upstream providers.', ('provider',))
+UPSTREAM_CHARS = registry.counter(
+    'humanizer_upstream_chars_total', 'Characters of generated text received from upstream providers.', ('provider',))
+STREAM_CANCELLATIONS = registry.counter(
+    'humanizer_stream_cancellations_total', 'SSE streams cancelled because the client disconnected.', ('route',))
+UPSTREAM_FAILURES = registry.counter(
+    'humanizer_upstream_failures_total',
+    'Upstream attempts abandoned before their first token, by reason (error, deadline).', ('provider', 'reason'))
+UPSTREAM_HEDGES = registry.counter(
+    'humanizer_upstream_hedges_total', 'Hedged requests, by which attempt produced the first token.', ('winner',))
+UPSTREAM_PARSE_ERRORS = registry.counter(
+    'humanizer_upstream_parse_errors_total', 'Upstream stream events that were not valid JSON.', ('provider',))
+UPSTREAM_TOKENS = registry.counter(
+    'humanizer_upstream_tokens_total', 'Tokens billed by upstream providers, as reported in their streams.',
+    ('provider', 'kind'))
+
+# Upstream scheduler
+SCHEDULER_QUEUED = registry.gauge(
+    'humanizer_scheduler_queued', 'Upstream calls waiting for a concurrency slot.', ('provider', 'priority'))
+SCHEDULER_ACTIVE = registry.gauge(
+    'humanizer_scheduler_active', 'Upstream calls holding a concurrency slot.', ('provider',))
+SCHEDULER_WAIT = registry.histogram(
+    'humanizer_scheduler_wait_seconds', 'Time an upstream call waited for a concurrency slot.', ('provider', 'priority'))
+SCHEDULER_THROTTLED = registry.counter(
+    'humanizer_scheduler_throttled_total', 'Upstream 429 responses, each halving the concurrency limit.', ('provider',))
+SCHEDULER_TIMEOUTS = registry.counter(
+    'humanizer_scheduler_timeouts_total', 'Upstream calls that gave up waiting for a slot.', ('provider', 'priority'))
+
+
+# Analyzer
+ANALYZER_RESULTS = registry.counter(
+    'humanizer_analyzer_results_total',
+    'Analyzer verdicts by source (local, cache, llm) or fallback on failure.', ('source',))
+ANALYZER_JSON_PARSE = registry.histogram(
+    'humanizer_analyzer_json_parse_seconds', 'Time spent parsing the analyzer JSON response.',
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+
+# Files
+FILE_PARSE = registry.histogram(
+    'humanizer_file_parse_seconds', 'Uploaded file parse time.', ('ext',))
+FILE_CREATE = registry.histogram(
+    'humanizer_file_create_seconds', 'Download file creation time.', ('format',))
+FILE_JOBS = registry.counter(
+    'humanizer_file_jobs_total',
+    'File pool jobs by outcome (ok, error, timeout, memory, crashed, busy).', ('job', 'outcome'))
+
+# Document sessions
+DOC_SESSION_LOOKUPS = registry.counter(
+    'humanizer_doc_session_lookups_total', 'Document session lookups by source (memory, disk, miss).', ('source',))
+
+# Editing
+EDIT_MODES = registry.counter(
+    'humanizer_edit_modes_total', 'Document edits by mode (patch, or full-text regeneration).', ('mode',))
+
+# Auto-revise
+REVISE_CANDIDATES = registry.counter(
+    'humanizer_revise_candidates_total',
+    'Best-of-N auto-revise drafts by outcome (scored, failed, early_exit).', ('outcome',))
+
+# Rate limiting
+RATE_LIMITED = registry.counter(
+    'humanizer_rate_limited_total', 'Requests rejected with 429 by the rate limiter.', ('route',))
+
+# Request coalescing
+COALESCED_REQUESTS = registry.counter(
+    'humanizer_coalesced_requests_total',
+    'Requests served by joining an identical in-flight upstream call.', ('kind',))
+
+# Output scrubbing
+SCRUBBED_TERMS = registry.counter(
+    'humanizer_scrubbed_terms_total', 'Banned terms rewritten in generated output.', ('term',))
+
+class StreamMetrics:
+    """Per-stream bookkeeping for one upstream generation; counters are flushed once at the end."""
+
+    __slots__ = ('provider', 'start', 'chunks', 'chars', 'usage')
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.start = time.perf_counter()
+        self.chunks = 0
+        self.chars = 0
+        self.usage = None
+
+    def connected(self):
+        UPSTREAM_CONNECT.observe(time.perf_counter() - self.start, provider=self.provider)
+
+    def chunk(self, content):
+        if not self.chunks:
+            UPSTREAM_FIRST_CHUNK.observe(time.perf_counter() - self.start, provider=self.provider)
+        self.chunks += 1
+        self.chars += len(content)
+
+    def finish(self, outcome):
+        UPSTREAM_STREAM.observe(time.perf_counter() - self.start, provider=self.provider, outcome=outcome)
+        if self.chunks:
+            UPSTREAM_CHUNKS.inc(self.chunks, provider=self.provider)
+            UPSTREAM_CHARS.inc(self.chars, provider=self.provider)
+        if self.usage:
+            # Providers report running totals, so only the last report counts
+            for kind, tokens in self.usage.items():
+                UPSTREAM_TOKENS.inc(tokens, provider=self.provider, kind=kind)
@@ -1,27 +1,192 @@
 from flask import request, jsonify
 from functools import wraps
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
 import time
+from config.settings import Config
+from app.utils.metrics import RATE_LIMITED
 
-# Simple in-memory rate limiting implementation
-request_history = {}
+logger = logging.getLogger(__name__)
+
+# Sliding-window counter: each key keeps only the current and previous fixed
+# window counts. The previous window's count is weighted by how much of it
+# still overlaps the sliding window, so every check is O(1) in time and memory.
+
+def _slide(state, now, window):
+    """Roll (window_start, prev, curr) forward to now; returns the new tuple."""
+    window_start = now - now % window
+    if state is None:
+        return window_start, 0, 0
+    start, prev, curr = state
+    if start == window_start:
+        return state
+    if start == window_start - window:
+        return window_start, curr, 0
+    return window_start, 0, 0
+
+def _estimate(state, now, window):
+    window_start, prev, curr = state
+    return prev * (window - (now - window_start)) / window + curr
+
+class MemoryBackend:
+    """Per-process counters in an LRU map with a hard cap on tracked keys."""
+
+    def __init__(self, max_keys=None):
+        self.max_keys = max_keys or Config.RATE_LIMIT_MAX_KEYS
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, max_requests, window, now):
+        with self._lock:
+            state = _slide(self._states.get(key), now, window)
+            limited = _estimate(state, now, window) >= max_requests
+            if not limited:
+                state = (state[0], state[1], state[2] + 1)
+            self._states[key] = state
+            self._states.move_to_end(key)
+            # Least recently seen keys go first; an idle key has nothing worth keeping
+            while len(self._states) > self.max_keys:
+                self._states.popitem(last=False)
+            return limited
+
+    def __len__(self):
+        return len(self._states)
+
+class SQLiteBackend:
+    """Counters in a shared SQLite (WAL) file so limits hold across worker processes."""
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path, max_keys=None, idle_after=3600):
+        self.path = path
+        self.max_keys = max_keys or Config.RATE_LIMIT_MAX_KEYS
+        self.idle_after = idle_after
+        self._local = threading.local()
+        self._hits = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            "key TEXT PRIMARY KEY, window_start REAL NOT NULL, prev INTEGER NOT NULL, "
+            "curr INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key, max_requests, window, now):
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT window_start, prev, curr FROM rate_limits WHERE key = ?", (key,)
+            ).fetchone()
+            state = _slide(row, now, window)
+            limited = _estimate(state, now, window) >= max_requests
+            if not limited:
+                state = (state[0], state[1], state[2] + 1)
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (key, window_start, prev, curr, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)", (key, *state, now)
+            )
+
+        self._hits += 1
+        if self._hits % self.PRUNE_EVERY == 0:
+            self.prune(now)
+        return limited
+
+    def prune(self, now=None):
+        now = now or time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM rate_limits WHERE updated_at < ?", (now - self.idle_after,))
+            conn.execute(
+                "DELETE FROM rate_limits WHERE key IN ("
+                "SELECT key FROM rate_limits ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_keys,)
+            )
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM rate_limits").fetchone()[0]
+
+class RateLimiter:
+    """Front end over a backend; uses in-process counters while the shared store is failing.
+
+    The shared store is tried again retry_after seconds after a failure, so
+    a transient "database is locked" doesn't leave the process on
+    per-process limits for good.
+    """
+
+    def __init__(self, backend, retry_after=None):
+        self.backend = backend
+        self.retry_after = Config.RATE_LIMIT_RETRY_AFTER if retry_after is None else retry_after
+        self._fallback = MemoryBackend()
+        self._failed_until = 0.0
+
+    def hit(self, key, max_requests, window):
+        now = time.time()
+        if now >= self._failed_until:
+            try:
+                limited = self.backend.hit(key, max_requests, window, now)
+                if self._failed_until:
+                    logger.info("Shared rate limit store is back")
+                    self._failed_until = 0.0
+                return limited
+            except sqlite3.Error as e:
+                logger.error(f"Shared rate limit store failed, using per-process limits for {self.retry_after}s: {e}")
+                self._failed_until = now + self.retry_after
+        return self._fallback.hit(key, max_requests, window, now)
+
+def _create_limiter():
+    if Config.RATE_LIMIT_BACKEND == 'sqlite':
+        try:
+            return RateLimiter(SQLiteBackend(Config.RATE_LIMIT_DB))
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Could not open {Config.RATE_LIMIT_DB}, using per-process limits: {e}")
+    return RateLimiter(MemoryBackend())
+
+limiter = _create_limiter()
+
+def client_key(remote_addr, api_key=None):
+    """Identify the caller by API key (hashed, when RATE_LIMIT_KEY=api_key) or by IP."""
+    if Config.RATE_LIMIT_KEY == 'api_key' and api_key:
+        return 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:32]
+    return f"ip:{remote_addr}"
+
+def is_rate_limited(key, max_requests=10, window=60):
+    """Record a request for key and return True if it exceeds the limit."""
+    return limiter.hit(key, max_requests, window)
+
+def _request_api_key():
+    if request.is_json:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict) and body.get('apiKey'):
+            return body['apiKey']
+    return request.headers.get('X-API-Key') or request.form.get('apiKey')
 
 def rate_limit(max_requests=10, window=60):
     def decorator(f):
+        scope = f.__name__
         @wraps(f)
         def wrapped(*args, **kwargs):
-            ip = request.remote_addr
-            now = time.time()
-            
-            if ip not in request_history:
-                request_history[ip] = []
-            
-            # Clean old requests
-            request_history[ip] = [t for t in request_history[ip] if now - t < window]
-            
-            if len(request_history[ip]) >= max_requests:
+            api_key = _request_api_key() if Config.RATE_LIMIT_KEY == 'api_key' else None
+            key = f"{scope}:{client_key(request.remote_addr, api_key)}"
+            if is_rate_limited(key, max_requests, window):
+                RATE_LIMITED.inc(route=scope)
                 return jsonify({"error": "Rate limit exceeded"}), 429
-            
-            request_history[ip].append(now)
             return f(*args, **kwargs)
         return wrapped
     return decorator
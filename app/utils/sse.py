@@ -0,0 +1,132 @@
+"""Server-sent event streaming with client-disconnect cancellation.
+
+The WSGI server only notices a closed browser tab when a write fails, and it
+then closes our generator. stream_events reads the upstream LLM stream on a
+separate thread and writes a heartbeat comment whenever the model is silent,
+so a disconnect is seen within one heartbeat even while waiting for the first
+token. On disconnect the CancelToken fires, which closes the upstream HTTP
+response immediately instead of letting the model finish a generation nobody
+will read.
+"""
+import json
+import logging
+import queue
+import threading
+
+from config.settings import Config
+from app.utils.metrics import STREAM_CANCELLATIONS
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT = ": keep-alive\n\n"
+DONE = "data: [DONE]\n\n"
+
+class CancelToken:
+    """Thread-safe cancellation flag with close callbacks (e.g. response.close)."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def wait(self, timeout):
+        """Sleep up to timeout seconds; True if cancelled meanwhile."""
+        return self._event.wait(timeout)
+
+    def on_cancel(self, callback):
+        """Register callback; runs at once if already cancelled. Returns an unregister function."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._discard(callback)
+        callback()
+        return lambda: None
+
+    def _discard(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug(f"Cancel callback failed: {e}")
+
+def record_cancellation(label, chunks):
+    STREAM_CANCELLATIONS.inc(route=label)
+    logger.info(f"{label} stream cancelled by client disconnect after {chunks} chunks "
+                f"(total cancelled: {STREAM_CANCELLATIONS.total()})")
+
+def sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+def _chunk_event(chunk):
+    return {'chunk': chunk}
+
+def stream_events(open_stream, label, first_event=None, heartbeat=None, to_event=_chunk_event):
+    """SSE generator over open_stream(cancel), cancelling upstream if the client goes away.
+
+    open_stream receives the CancelToken and returns an iterable of text chunks;
+    to_event turns each one into the event payload.
+    """
+    heartbeat = heartbeat or Config.SSE_HEARTBEAT_INTERVAL
+    cancel = CancelToken()
+    events = queue.Queue()
+
+    def pump():
+        stream = None
+        try:
+            stream = open_stream(cancel)
+            for chunk in stream:
+                if cancel.cancelled:
+                    break
+                events.put(('chunk', chunk))
+            events.put(('done', None))
+        except Exception as e:
+            events.put(('error', e))
+        finally:
+            if stream is not None and hasattr(stream, 'close'):
+                stream.close()
+
+    threading.Thread(target=pump, name=f'sse-{label.lower()}', daemon=True).start()
+
+    finished = False
+    chunks = 0
+    try:
+        if first_event:
+            yield sse_event(first_event)
+        while True:
+            try:
+                kind, value = events.get(timeout=heartbeat)
+            except queue.Empty:
+                # A failed write here is how a disconnect is noticed during silence
+                yield HEARTBEAT
+                continue
+            if kind == 'chunk':
+                if value:
+                    chunks += 1
+                    yield sse_event(to_event(value))
+            elif kind == 'done':
+                finished = True
+                yield DONE
+                return
+            else:
+                finished = True
+                logger.error(f"{label} error: {str(value)}", exc_info=value)
+                yield sse_event({'error': str(value)})
+                return
+    finally:
+        if not finished:
+            cancel.cancel()
+            record_cancellation(label, chunks)
@@ -0,0 +1,75 @@
+"""Chat-edit cost of patch mode vs. full-text regeneration as the document grows.
+
+Usage:
+    python -m benchmarks.edit_patch --paragraphs 10 50 200 --tokens-per-sec 200
+
+Runs the Flask app in-process against the stub server (ollama), sending the
+same one-paragraph chat edit in both edit modes, and reports time to the
+first usable event, total latency and the number of streamed output tokens.
+"""
+import argparse
+import json
+import os
+import time
+
+from benchmarks.stub_server import start_stub_server
+
+WORDS = "The committee reviewed every proposal and asked the authors to clarify their budget estimates".split()
+
+
+def document(paragraphs):
+    return '\n\n'.join(
+        f"Section {i} discusses item{i}. " + ' '.join(WORDS[(i + j) % len(WORDS)] for j in range(60))
+        for i in range(paragraphs)
+    )
+
+
+def run_edit(client, text, mode):
+    body = {"message": f"item{len(text) % 7} paragrafını kısalt", "text": text, "editMode": mode,
+            "provider": "ollama", "apiKey": "bench", "model": "stub-model"}
+    start = time.perf_counter()
+    first = None
+    tokens = 0
+    response = client.post('/api/chat', json=body, buffered=False)
+    if response.status_code != 200:
+        # e.g. 413: the full-text answer no longer fits the model's output limit
+        return None, response.status_code, response.get_json()['error']
+    for line in response.response:
+        for event_line in line.decode().splitlines():
+            if not event_line.startswith('data: {'):
+                continue
+            event = json.loads(event_line[6:])
+            if 'chunk' in event or 'patch' in event:
+                first = first or time.perf_counter() - start
+                tokens += 1 if 'chunk' in event else len(event['patch']['text'].split())
+    return first, time.perf_counter() - start, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--paragraphs', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--tokens-per-sec', type=float, default=200.0)
+    parser.add_argument('--ttft', type=float, default=0.05)
+    args = parser.parse_args()
+
+    srv, base = start_stub_server(ttft=args.ttft, tokens_per_sec=args.tokens_per_sec)
+    os.environ['OLLAMA_BASE_URL'] = base
+    from app import create_app
+    client = create_app().test_client()
+
+    print(f"{'paragraphs':>10} {'mode':>6} {'first ms':>9} {'total ms':>9} {'tokens':>7}")
+    try:
+        for paragraphs in args.paragraphs:
+            text = document(paragraphs)
+            for mode in ('full', 'patch'):
+                first, total, tokens = run_edit(client, text, mode)
+                if first is None and isinstance(tokens, str):
+                    print(f"{paragraphs:>10} {mode:>6} {'HTTP ' + str(total):>19} {tokens}")
+                    continue
+                print(f"{paragraphs:>10} {mode:>6} {(first or 0) * 1000:>9.1f} {total * 1000:>9.1f} {tokens:>7}")
+    finally:
+        srv.shutdown()
+
+
+if __name__ == '__main__':
+    main()
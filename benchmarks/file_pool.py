@@ -0,0 +1,172 @@
+"""Streaming latency while large documents are uploaded: in-thread parsing vs. the file pool.
+
+Usage:
+    python -m benchmarks.file_pool --paragraphs 20000 --streams 8 --uploaders 2 --rounds 3
+
+Starts the stub and the app (werkzeug, threaded) as in benchmarks.load_test,
+then drives /api/humanize streams three ways: with no uploads, with
+FILE_POOL=False and uploaders hammering /api/upload with a large .docx, and
+the same with FILE_POOL=True. Reports time to first token, total latency and
+the longest stall between two chunks of a stream, which is where a parse
+holding the GIL shows up.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks.load_test import ROOT, SAMPLE_SENTENCES, free_port, percentiles, server_command, wait_for_port
+
+
+def large_docx(paragraphs):
+    from docx import Document
+    document = Document()
+    for i in range(paragraphs):
+        document.add_paragraph(SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)])
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def stream_once(base_url, i):
+    """(ttft, latency, longest gap between chunks) of one /api/humanize stream."""
+    body = {"text": ' '.join(SAMPLE_SENTENCES), "provider": "gemini", "model": "stub-model",
+            "apiKey": f"bench-stream-{i}"}
+    start = last = time.perf_counter()
+    ttft = None
+    gap = 0.0
+    with requests.post(f"{base_url}/api/humanize", json=body, stream=True) as response:
+        for line in response.iter_lines():
+            if not line.startswith(b'data: {'):
+                continue
+            now = time.perf_counter()
+            if 'chunk' in json.loads(line[6:]):
+                if ttft is None:
+                    ttft = now - start
+                else:
+                    gap = max(gap, now - last)
+                last = now
+    return ttft, time.perf_counter() - start, gap
+
+
+def upload_loop(base_url, document, stop, latencies, errors):
+    n = 0
+    with requests.Session() as session:
+        while not stop.is_set():
+            n += 1
+            start = time.perf_counter()
+            response = session.post(f"{base_url}/api/upload", files={'file': ('deck.docx', document)},
+                                    headers={"X-API-Key": f"bench-upload-{threading.get_ident()}-{n}"})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+
+def run_phase(stub_url, tmp, args, document, file_pool):
+    port = free_port()
+    env = dict(
+        os.environ,
+        GEMINI_API_BASE=stub_url,
+        RATE_LIMIT_KEY='api_key',
+        RATE_LIMIT_DB=os.path.join(tmp, f'ratelimit-{port}.db'),
+        BATCH_DB=os.path.join(tmp, f'batch-{port}.db'),
+        ANALYSIS_CACHE_DB='',
+        SCRUB_OUTPUT='False',
+        FILE_POOL=str(file_pool is not False),
+        MAX_UPLOAD_MB='200',
+        MAX_UNZIPPED_MB='2000',
+    )
+    app = subprocess.Popen(server_command('werkzeug', port, 1, 1), cwd=ROOT, env=env,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, app)
+        base_url = f"http://127.0.0.1:{port}"
+        # Warm imports, pools and (when enabled) the file workers
+        stream_once(base_url, -1)
+        requests.post(f"{base_url}/api/upload", files={'file': ('warm.docx', large_docx(10))},
+                      headers={"X-API-Key": "bench-warm"})
+
+        stop = threading.Event()
+        upload_latencies, upload_errors = [], []
+        uploaders = [] if file_pool is None else [
+            threading.Thread(target=upload_loop, args=(base_url, document, stop, upload_latencies, upload_errors))
+            for _ in range(args.uploaders)
+        ]
+        for thread in uploaders:
+            thread.start()
+        time.sleep(0.5 if uploaders else 0)
+
+        samples = []
+        with ThreadPoolExecutor(max_workers=args.streams) as pool:
+            for _ in range(args.rounds):
+                samples.extend(pool.map(lambda i: stream_once(base_url, i), range(args.streams)))
+        stop.set()
+        for thread in uploaders:
+            thread.join()
+    finally:
+        app.terminate()
+        app.wait(timeout=10)
+
+    return {
+        "ttft_ms": percentiles([s[0] for s in samples if s[0] is not None]),
+        "latency_ms": percentiles([s[1] for s in samples]),
+        "max_gap_ms": percentiles([s[2] for s in samples]),
+        "uploads": len(upload_latencies),
+        "upload_errors": len(upload_errors),
+        "upload_latency_ms": percentiles(upload_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--paragraphs', type=int, default=20000, help='Paragraphs in the uploaded .docx')
+    parser.add_argument('--streams', type=int, default=8, help='Concurrent humanize streams')
+    parser.add_argument('--rounds', type=int, default=3, help='Batches of streams per phase')
+    parser.add_argument('--uploaders', type=int, default=2, help='Threads uploading the .docx back to back')
+    parser.add_argument('--tokens', type=int, default=40, help='Tokens per stub response')
+    parser.add_argument('--tokens-per-sec', type=float, default=20.0)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    document = large_docx(args.paragraphs)
+    print(f"Upload: {len(document) / 1024:.0f}KB .docx with {args.paragraphs} paragraphs")
+
+    stub_port = free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    stub = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.stub_server', '--port', str(stub_port), '--ttft', '0.05',
+         '--tokens-per-sec', str(args.tokens_per_sec), '--tokens', str(args.tokens)],
+        cwd=ROOT, stdout=subprocess.DEVNULL
+    )
+    results = {}
+    try:
+        wait_for_port(stub_port, stub)
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, file_pool in (('no uploads', None), ('in-thread', False), ('file pool', True)):
+                results[name] = run_phase(stub_url, tmp, args, document, file_pool)
+    finally:
+        stub.terminate()
+        stub.wait(timeout=10)
+
+    print(f"{'phase':<12} {'ttft p50':>9} {'p95':>8} {'lat p50':>9} {'p95':>8} {'gap p50':>9} {'p95':>8} "
+          f"{'uploads':>8} {'upload p50':>11}")
+    for name, result in results.items():
+        ttft, lat, gap = result['ttft_ms'], result['latency_ms'], result['max_gap_ms']
+        upload = result['upload_latency_ms'] or {'p50': 0}
+        print(f"{name:<12} {ttft['p50']:>9.1f} {ttft['p95']:>8.1f} {lat['p50']:>9.1f} {lat['p95']:>8.1f} "
+              f"{gap['p50']:>9.1f} {gap['p95']:>8.1f} {result['uploads']:>8} {upload['p50']:>11.1f}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
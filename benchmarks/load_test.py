@@ -0,0 +1,504 @@
+"""End-to-end load test of every /api route against the stub LLM server.
+
+Usage:
+    python -m benchmarks.load_test --concurrency 16 --requests 100 --ttft 0.2 --tokens-per-sec 50
+    python -m benchmarks.load_test --server uvicorn --workers 4 --routes humanize,check
+    python -m benchmarks.load_test --compare benchmarks/results/load-old.json benchmarks/results/load-new.json
+
+Starts the stub (benchmarks.stub_server) and the app as separate processes,
+with the app's upstream URLs pointed at the stub and per-request API keys so
+the rate limiter never interferes. Each route is driven on its own, so one
+route's numbers are not skewed by another's. Reports p50/p95/p99 time to first
+token (first SSE chunk, or first body byte for non-streaming routes), total
+latency, throughput and per-process RSS, and writes them as sorted JSON to
+benchmarks/results/load-<commit>.json for comparison across commits.
+"""
+import argparse
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+SCHEMA_VERSION = 1
+
+SAMPLE_SENTENCES = [
+    "The city council met on Tuesday to discuss the new bus routes.",
+    "Several residents said the changes would make their commute longer.",
+    "Others argued that the old routes had not been updated in twenty years.",
+    "The council plans to publish a revised map before the end of the month.",
+    "A public hearing is scheduled for the first week of next month.",
+    "Local businesses hope the new stops will bring more customers downtown.",
+    "Transit staff expect ridership figures to be available by spring.",
+    "The final vote has been postponed until the budget is approved.",
+]
+
+WERKZEUG_RUNNER = (
+    "import sys\n"
+    "from werkzeug.serving import run_simple\n"
+    "from run import app\n"
+    "run_simple('127.0.0.1', int(sys.argv[1]), app, threaded=True)\n"
+)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process exited early with code {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def server_command(server, port, workers, threads):
+    if server == 'werkzeug':
+        return [sys.executable, '-c', WERKZEUG_RUNNER, str(port)]
+    if server == 'gunicorn':
+        return [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-k', 'gthread', '--threads', str(threads),
+                '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'run:app']
+    if server == 'uvicorn':
+        return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                '--workers', str(workers), '--log-level', 'warning']
+    raise ValueError(f"Unknown server: {server}")
+
+
+class MemorySampler:
+    """Samples RSS of a process tree from /proc (Linux only; empty elsewhere)."""
+
+    def __init__(self, root_pid, interval=0.5):
+        self.root_pid = root_pid
+        self.interval = interval
+        self.samples = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def _rss_mb(pid):
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return None
+
+    def _tree(self):
+        parents = {}
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open(f'/proc/{entry}/stat') as f:
+                        # The command name may contain spaces; ppid follows its closing paren
+                        parents[int(entry)] = int(f.read().rsplit(')', 1)[1].split()[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+        pids, frontier = [self.root_pid], [self.root_pid]
+        while frontier:
+            children = [pid for pid, ppid in parents.items() if ppid in frontier]
+            pids.extend(children)
+            frontier = children
+        return pids
+
+    def sample(self):
+        if not os.path.isdir('/proc'):
+            return
+        for pid in self._tree():
+            rss = self._rss_mb(pid)
+            if rss is not None:
+                self.samples.setdefault(pid, []).append(rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.sample()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+    def report(self):
+        return [
+            {
+                "role": "main" if pid == self.root_pid else "worker",
+                "rss_start_mb": round(values[0], 1),
+                "rss_peak_mb": round(max(values), 1),
+                "rss_end_mb": round(values[-1], 1),
+            }
+            for pid, values in sorted(self.samples.items(), key=lambda item: (item[0] != self.root_pid, item[0]))
+        ]
+
+
+def sample_docx():
+    from docx import Document
+    document = Document()
+    for sentence in SAMPLE_SENTENCES:
+        document.add_paragraph(sentence)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+class Scenarios:
+    """One method per route: each performs a request and returns (ttft, ok)."""
+
+    def __init__(self, base_url, provider, model, sentences):
+        self.base_url = base_url
+        self.provider = provider
+        self.model = model
+        self.sentences = sentences
+        self.docx = sample_docx()
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def text(self, i):
+        # Distinct per request so the analyzer cache doesn't turn the test into a cache benchmark
+        body = ' '.join(SAMPLE_SENTENCES[j % len(SAMPLE_SENTENCES)] for j in range(self.sentences))
+        return f"Report number {i} follows. {body}"
+
+    def payload(self, name, i, **fields):
+        return {"provider": self.provider, "model": self.model, "apiKey": f"load-{name}-{i}", **fields}
+
+    def headers(self, name, i):
+        return {"X-API-Key": f"load-{name}-{i}"}
+
+    def _sse(self, path, body, start):
+        ttft = None
+        ok = False
+        with self.session.post(self.base_url + path, json=body, stream=True) as response:
+            if response.status_code != 200:
+                return None, False
+            for line in response.iter_lines():
+                if not line.startswith(b'data: '):
+                    continue
+                if line == b'data: [DONE]':
+                    ok = True
+                    break
+                event = json.loads(line[6:])
+                if 'error' in event:
+                    break
+                chunk = event.get('chunk')
+                if chunk:
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    # Providers report upstream failures as an "Error: ..." chunk
+                    if chunk.startswith('Error:'):
+                        break
+        return ttft, ok
+
+    def _plain(self, method, path, start, **kwargs):
+        ttft = None
+        body = bytearray()
+        with self.session.request(method, self.base_url + path, stream=True, **kwargs) as response:
+            for chunk in response.iter_content(chunk_size=8192):
+                if ttft is None and chunk:
+                    ttft = time.perf_counter() - start
+                body.extend(chunk)
+            ok = response.status_code < 400
+            if ok and response.headers.get('Content-Type', '').startswith('application/json'):
+                # The analyzer reports upstream failures in a 200 body
+                data = json.loads(body)
+                ok = not any(str(r).startswith('Analysis failed') for r in data.get('reasons', []))
+        return ttft, ok
+
+    def humanize(self, i, start):
+        return self._sse('/api/humanize', self.payload('humanize', i, text=self.text(i)), start)
+
+    def write(self, i, start):
+        return self._sse('/api/write', self.payload('write', i, topic=f"Bus routes, take {i}"), start)
+
+    def edit(self, i, start):
+        return self._sse('/api/edit', self.payload('edit', i, instruction="Make it shorter",
+                                                    text=SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)]), start)
+
+    def chat(self, i, start):
+        return self._sse('/api/chat', self.payload('chat', i, message="What is this text about?",
+                                                    text=self.text(i)), start)
+
+    def check(self, i, start):
+        return self._plain('POST', '/api/check', start, json=self.payload('check', i, text=self.text(i)))
+
+    def check_cache(self, i, start):
+        return self._plain('GET', '/api/check/cache', start)
+
+    def auto_revise(self, i, start):
+        body = self.payload('auto-revise', i, text=self.text(i), targetScore=15, maxIterations=2)
+        return self._plain('POST', '/api/auto-revise', start, json=body)
+
+    def upload(self, i, start):
+        files = {'file': ('report.docx', self.docx)}
+        return self._plain('POST', '/api/upload', start, files=files, headers=self.headers('upload', i))
+
+    def download(self, i, start):
+        body = self.payload('download', i, text=self.text(i), format='docx')
+        return self._plain('POST', '/api/download', start, json=body)
+
+    def batch(self, i, start, jobs=5):
+        # Submit, poll to completion, fetch results: ttft is the 202, latency the full round trip
+        lines = '\n'.join(json.dumps({"type": "humanize", "text": self.text(i * jobs + j)}) for j in range(jobs))
+        params = {"provider": self.provider, "model": self.model, "apiKey": f"load-batch-{i}"}
+        response = self.session.post(self.base_url + '/api/batch', data=lines, params=params,
+                                     headers=self.headers('batch', i))
+        ttft = time.perf_counter() - start
+        if response.status_code != 202:
+            return ttft, False
+        batch_id = response.json()['batch_id']
+        while True:
+            progress = self.session.get(f"{self.base_url}/api/batch/{batch_id}").json()
+            if progress['status'] == 'complete':
+                break
+            time.sleep(0.05)
+        results = self.session.get(f"{self.base_url}/api/batch/{batch_id}/results")
+        return ttft, results.status_code == 200 and progress['failed'] == 0
+
+
+ROUTES = {
+    'humanize': Scenarios.humanize,
+    'write': Scenarios.write,
+    'edit': Scenarios.edit,
+    'chat': Scenarios.chat,
+    'check': Scenarios.check,
+    'check-cache': Scenarios.check_cache,
+    'auto-revise': Scenarios.auto_revise,
+    'upload': Scenarios.upload,
+    'download': Scenarios.download,
+    'batch': Scenarios.batch,
+}
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    samples = sorted(samples)
+
+    def rank(p):
+        # Nearest-rank percentile
+        return samples[max(0, min(len(samples) - 1, int(round(p / 100 * len(samples))) - 1))]
+
+    return {f"p{p}": round(rank(p) * 1000, 2) for p in (50, 95, 99)}
+
+
+def run_route(scenarios, name, requests_count, concurrency):
+    method = ROUTES[name]
+    ttfts, latencies = [], []
+    errors = 0
+
+    def one(i):
+        start = time.perf_counter()
+        try:
+            ttft, ok = method(scenarios, i, start)
+        except requests.RequestException:
+            ttft, ok = None, False
+        return ttft, time.perf_counter() - start, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for ttft, latency, ok in pool.map(one, range(requests_count)):
+            latencies.append(latency)
+            if ttft is not None:
+                ttfts.append(ttft)
+            if not ok:
+                errors += 1
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests_count,
+        "errors": errors,
+        "ttft_ms": percentiles(ttfts),
+        "latency_ms": percentiles(latencies),
+        "throughput_rps": round(requests_count / elapsed, 2),
+    }
+
+
+def print_report(results):
+    print(f"{'route':<12} {'ok':>5} {'err':>4} {'ttft p50':>9} {'p95':>8} {'p99':>8} "
+          f"{'lat p50':>9} {'p95':>8} {'p99':>8} {'req/s':>8}")
+    for name, route in results['routes'].items():
+        ttft = route['ttft_ms'] or {'p50': 0, 'p95': 0, 'p99': 0}
+        lat = route['latency_ms']
+        print(f"{name:<12} {route['requests'] - route['errors']:>5} {route['errors']:>4} "
+              f"{ttft['p50']:>9.1f} {ttft['p95']:>8.1f} {ttft['p99']:>8.1f} "
+              f"{lat['p50']:>9.1f} {lat['p95']:>8.1f} {lat['p99']:>8.1f} {route['throughput_rps']:>8.1f}")
+    for process in results['memory']:
+        print(f"{process['role']:<8} rss start={process['rss_start_mb']}MB "
+              f"peak={process['rss_peak_mb']}MB end={process['rss_end_mb']}MB")
+
+
+def compare(old_path, new_path):
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+
+    def delta(a, b):
+        if a is None or b is None:
+            return '     n/a'
+        return f"{(b - a) / a * 100 if a else 0:+7.1f}%"
+
+    print(f"{'route':<12} {'ttft p50':>9} {'ttft p95':>9} {'lat p50':>9} {'lat p95':>9} {'req/s':>9}")
+    for name, route in new['routes'].items():
+        before = old['routes'].get(name)
+        if before is None:
+            continue
+        cells = [
+            delta((before['ttft_ms'] or {}).get('p50'), (route['ttft_ms'] or {}).get('p50')),
+            delta((before['ttft_ms'] or {}).get('p95'), (route['ttft_ms'] or {}).get('p95')),
+            delta(before['latency_ms']['p50'], route['latency_ms']['p50']),
+            delta(before['latency_ms']['p95'], route['latency_ms']['p95']),
+            delta(before['throughput_rps'], route['throughput_rps']),
+        ]
+        print(f"{name:<12} " + ' '.join(f"{cell:>9}" for cell in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', default=','.join(ROUTES), help='Comma-separated subset of: ' + ', '.join(ROUTES))
+    parser.add_argument('--requests', type=int, default=50, help='Requests per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--server', choices=('werkzeug', 'gunicorn', 'uvicorn'), default='werkzeug')
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes (gunicorn/uvicorn)')
+    parser.add_argument('--threads', type=int, default=16, help='Threads per gunicorn worker')
+    parser.add_argument('--provider', choices=('gemini', 'openrouter', 'ollama'), default='gemini')
+    parser.add_argument('--model', default='stub-model')
+    parser.add_argument('--sentences', type=int, default=8, help='Sentences in each request text')
+    parser.add_argument('--ttft', type=float, default=0.1, help='Stub time to first token (seconds)')
+    parser.add_argument('--tokens-per-sec', type=float, default=100.0)
+    parser.add_argument('--tokens', type=int, default=50, help='Tokens per generic stub response')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-mode', choices=('status', 'midstream'), default='status')
+    parser.add_argument('--output', help='Results file (default benchmarks/results/load-<commit>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two results files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    routes = [name.strip() for name in args.routes.split(',') if name.strip()]
+    unknown = [name for name in routes if name not in ROUTES]
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(unknown)}")
+
+    stub_port, app_port = free_port(), free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    processes = []
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            stub = subprocess.Popen(
+                [sys.executable, '-m', 'benchmarks.stub_server', '--port', str(stub_port),
+                 '--ttft', str(args.ttft), '--tokens-per-sec', str(args.tokens_per_sec), '--tokens', str(args.tokens),
+                 '--error-rate', str(args.error_rate), '--error-mode', args.error_mode],
+                cwd=ROOT, stdout=subprocess.DEVNULL
+            )
+            processes.append(stub)
+            wait_for_port(stub_port, stub)
+
+            env = dict(
+                os.environ,
+                GEMINI_API_BASE=stub_url,
+                OPENROUTER_API_BASE=stub_url,
+                OLLAMA_BASE_URL=stub_url,
+                RATE_LIMIT_KEY='api_key',
+                RATE_LIMIT_DB=os.path.join(tmp, 'ratelimit.db'),
+                BATCH_DB=os.path.join(tmp, 'batch.db'),
+                ANALYSIS_CACHE_DB='',
+                PYTHONUNBUFFERED='1',
+            )
+            app = subprocess.Popen(server_command(args.server, app_port, args.workers, args.threads),
+                                   cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            processes.append(app)
+            wait_for_port(app_port, app)
+
+            scenarios = Scenarios(f"http://127.0.0.1:{app_port}", args.provider, args.model, args.sentences)
+            # One untimed request per route warms imports, pools and caches
+            for name in routes:
+                ROUTES[name](scenarios, -1, time.perf_counter())
+
+            sampler = MemorySampler(app.pid)
+            sampler.start()
+            route_results = {}
+            for name in routes:
+                route_results[name] = run_route(scenarios, name, args.requests, args.concurrency)
+            sampler.stop()
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    commit = git_commit()
+    results = {
+        "schema": SCHEMA_VERSION,
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        "config": {
+            "server": args.server,
+            "workers": 1 if args.server == 'werkzeug' else args.workers,
+            "concurrency": args.concurrency,
+            "requests_per_route": args.requests,
+            "provider": args.provider,
+            "sentences": args.sentences,
+            "stub": {
+                "ttft": args.ttft,
+                "tokens_per_sec": args.tokens_per_sec,
+                "tokens": args.tokens,
+                "error_rate": args.error_rate,
+                "error_mode": args.error_mode,
+            },
+        },
+        "routes": route_results,
+        "memory": sampler.report(),
+    }
+
+    print_report(results)
+    output = args.output or os.path.join(RESULTS_DIR, f"load-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
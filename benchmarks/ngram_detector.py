@@ -0,0 +1,65 @@
+"""Sentences/sec of the n-gram detector on a multi-megabyte document.
+
+Usage:
+    python -m benchmarks.ngram_detector --doc-mb 4
+
+Builds a throwaway model from prompt.txt and README.md (or --corpus files) in
+a temp dir, then scores a synthetic document sampled from the same sentences.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from app.services.analyzer import split_sentences
+from app.services.ngram import NGramDetector, NGramModel, build_model
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def synthetic_document(sentences, target_bytes, seed=13):
+    rng = random.Random(seed)
+    words = [w for s in sentences for w in s.split()]
+    parts, size = [], 0
+    while size < target_bytes:
+        # Mix real sentences with shuffled word salad so perplexity varies
+        if rng.random() < 0.5:
+            sentence = rng.choice(sentences)
+        else:
+            sentence = ' '.join(rng.choice(words) for _ in range(rng.randint(3, 25))) + '.'
+        parts.append(sentence)
+        size += len(sentence) + 1
+    return ' '.join(parts)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--doc-mb', type=float, default=4.0)
+    parser.add_argument('--corpus', nargs='*', default=[os.path.join(ROOT, 'prompt.txt'), os.path.join(ROOT, 'README.md')])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = os.path.join(tmp, 'ngram.bin')
+        start = time.perf_counter()
+        build_model(args.corpus, model_path, min_count=1)
+        print(f"build      {time.perf_counter() - start:7.3f}s  ({os.path.getsize(model_path) / 1e6:.1f} MB model)")
+
+        corpus_sentences = []
+        for path in args.corpus:
+            with open(path, encoding='utf-8') as f:
+                corpus_sentences.extend(split_sentences(f.read()))
+        document = synthetic_document(corpus_sentences, int(args.doc_mb * 1e6))
+
+        start = time.perf_counter()
+        detector = NGramDetector(NGramModel(model_path))
+        print(f"map        {(time.perf_counter() - start) * 1000:7.3f}ms")
+
+        start = time.perf_counter()
+        result = detector.score(document)
+        elapsed = time.perf_counter() - start
+
+    count = len(result['sentence_analysis'])
+    print(f"score      {elapsed:7.3f}s  {len(document) / 1e6:.1f} MB, {count} sentences")
+    print(f"throughput {count / elapsed:,.0f} sentences/sec, {len(document) / 1e6 / elapsed:.2f} MB/sec")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Time-to-first-token: fresh connection per request vs. pooled provider session.
+
+Usage:
+    python -m benchmarks.provider_pool --requests 200 --handshake 0.03
+
+--handshake adds a per-connection delay on the stub to model the TCP+TLS
+setup cost of a real HTTPS upstream (localhost on its own makes it ~free).
+"""
+import argparse
+import json
+import statistics
+import time
+
+import requests
+
+from benchmarks.stub_server import start_stub_server
+from app.services.providers import LLMFactory
+
+
+def first_token_unpooled(base_url):
+    # What every provider did before: a bare requests.post per call
+    start = time.perf_counter()
+    first_token = None
+    body = {"model": "stub", "prompt": "hi", "stream": True}
+    with requests.post(f"{base_url}/api/generate", json=body, stream=True) as response:
+        for line in response.iter_lines():
+            if first_token is None and line and json.loads(line).get('response'):
+                first_token = time.perf_counter() - start
+    return first_token
+
+
+def first_token_pooled(provider, base_url):
+    # Drain the stream so the connection goes back to the pool, as in the app
+    start = time.perf_counter()
+    first_token = None
+    for chunk in provider.generate_stream(prompt="hi", base_url=base_url, model="stub"):
+        if first_token is None and chunk:
+            first_token = time.perf_counter() - start
+    return first_token
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p50 = samples[len(samples) // 2]
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{name:<10} mean={statistics.mean(samples) * 1000:7.3f}ms "
+          f"p50={p50 * 1000:7.3f}ms p95={p95 * 1000:7.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--handshake', type=float, default=0.03, help='Simulated connection setup seconds')
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(handshake=args.handshake)
+    provider = LLMFactory.get_provider('ollama')
+    try:
+        # Warm up both paths once
+        first_token_unpooled(base_url)
+        first_token_pooled(provider, base_url)
+
+        unpooled = [first_token_unpooled(base_url) for _ in range(args.requests)]
+        pooled = [first_token_pooled(provider, base_url) for _ in range(args.requests)]
+    finally:
+        LLMFactory.reset()
+        server.shutdown()
+
+    print(f"TTFT over {args.requests} sequential requests against {base_url} "
+          f"(handshake={args.handshake * 1000:.0f}ms)")
+    report("unpooled", unpooled)
+    report("pooled", pooled)
+    print(f"speedup    {statistics.mean(unpooled) / statistics.mean(pooled):.2f}x")
+
+
+if __name__ == '__main__':
+    main()
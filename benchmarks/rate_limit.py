@@ -0,0 +1,51 @@
+"""Per-request overhead of the @rate_limit decorator for each backend.
+
+Usage:
+    python -m benchmarks.rate_limit --requests 20000 --clients 5000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from flask import Flask
+
+from app.utils import rate_limit as rl
+
+def measure(app, view, requests, clients):
+    addrs = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(clients)]
+    contexts = [app.test_request_context('/', environ_base={'REMOTE_ADDR': addrs[i % clients]}) for i in range(requests)]
+    start = time.perf_counter()
+    for ctx in contexts:
+        with ctx:
+            view()
+    return (time.perf_counter() - start) / requests
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=5000)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+
+    def view():
+        return 'ok'
+
+    baseline = measure(app, view, args.requests, args.clients)
+    print(f"{'no limiter':<10} {baseline * 1e6:8.2f}us/request")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            'memory': rl.MemoryBackend(max_keys=args.clients // 2),
+            'sqlite': rl.SQLiteBackend(os.path.join(tmp, 'ratelimit.db'), max_keys=args.clients // 2),
+        }
+        for name, backend in backends.items():
+            rl.limiter = rl.RateLimiter(backend)
+            limited = rl.rate_limit(max_requests=1000000, window=60)(view)
+            per_request = measure(app, limited, args.requests, args.clients)
+            print(f"{name:<10} {per_request * 1e6:8.2f}us/request  "
+                  f"overhead {(per_request - baseline) * 1e6:8.2f}us  tracked keys {len(backend)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Cold-start check: time `create_app()` in fresh interpreters against a budget.
+
+Usage:
+    python -m benchmarks.startup --budget-ms 450 --runs 5
+
+Each run imports the app and calls create_app() in a new process, as a
+worker boot or serverless cold start would. Exits non-zero when the fastest
+run is over budget, or when a module that should load lazily (python-docx,
+python-pptx, lxml, NumPy) was imported anyway, so it can gate CI. Prints
+the slowest imports from `python -X importtime` to show what to fix.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Only needed by uploads/downloads and n-gram mode; see app.preload
+LAZY_MODULES = ('docx', 'pptx', 'lxml', 'numpy')
+
+BOOT = """
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+create_app()
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": sorted(m for m in %r if m in sys.modules)}))
+""" % (LAZY_MODULES,)
+
+def boot(env, importtime=False):
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', BOOT]
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+def slowest_imports(stderr, top):
+    """(cumulative_us, module) for the slowest imports at any depth."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=450, help='Max milliseconds for import + create_app()')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters to time; the fastest counts')
+    parser.add_argument('--top', type=int, default=10, help='Slowest imports to list')
+    args = parser.parse_args()
+
+    # Batch workers would open the queue database; that is not import cost
+    env = dict(os.environ, BATCH_WORKERS='0')
+    env.setdefault('PRELOAD', 'False')
+
+    times = []
+    for _ in range(args.runs):
+        result, _ = boot(env)
+        times.append(result['seconds'] * 1000)
+    result, stderr = boot(env, importtime=True)
+
+    print(f"create_app() cold start: best {min(times):.0f}ms, worst {max(times):.0f}ms "
+          f"over {args.runs} runs (budget {args.budget_ms:.0f}ms)")
+    print("Slowest imports (cumulative):")
+    for cumulative, name in slowest_imports(stderr, args.top):
+        print(f"  {cumulative / 1000:8.1f}ms  {name}")
+
+    failures = []
+    if min(times) > args.budget_ms:
+        failures.append(f"over budget by {min(times) - args.budget_ms:.0f}ms")
+    if result['loaded'] and env['PRELOAD'] != 'True':
+        failures.append(f"lazy modules imported at startup: {', '.join(result['loaded'])}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Events/sec of the upstream stream decoders on streams recorded from the stub.
+
+Usage:
+    python -m benchmarks.stream_decoding --tokens 5000 --chunk-sizes 512 1024 4096 16384
+
+Records one response per provider (Gemini SSE, OpenRouter SSE, Ollama
+NDJSON) from the stub server, then replays the bytes through a requests
+Response, so reading costs the same as a live stream minus the network.
+Each stream is decoded the old way (iter_lines, decode, json.loads per line)
+and with the providers' decoder + parse_event at each --chunk-sizes.
+"""
+import argparse
+import io
+import json
+import time
+
+import requests
+
+from benchmarks.stub_server import start_stub_server
+from app.services.providers import GeminiProvider, OllamaProvider, OpenRouterProvider
+from app.services.stream_decoding import iter_payloads
+
+PROVIDERS = (GeminiProvider, OpenRouterProvider, OllamaProvider)
+
+
+def record(provider, base):
+    """Raw response body for a generation from the stub."""
+    from config.settings import Config
+    Config.GEMINI_API_BASE = Config.OPENROUTER_API_BASE = base
+    url, request_kwargs = provider.build_request("Record this stream", api_key='bench', model='stub-model', base_url=base)
+    response = requests.post(url, timeout=60, **request_kwargs)
+    response.raise_for_status()
+    return response.content
+
+
+def replay(body):
+    response = requests.Response()
+    response.raw = io.BytesIO(body)
+    response.status_code = 200
+    return response
+
+
+# The per-line parsers the providers used before the decoders
+def _gemini_line(line):
+    if not line.startswith('data: '):
+        return None, False
+    try:
+        data = json.loads(line[6:])
+        if 'candidates' in data and len(data['candidates']) > 0:
+            return data['candidates'][0]['content']['parts'][0]['text'], False
+    except Exception:
+        pass
+    return None, False
+
+
+def _openrouter_line(line):
+    if not line.startswith('data: '):
+        return None, False
+    if line == 'data: [DONE]':
+        return None, True
+    try:
+        data = json.loads(line[6:])
+        return data['choices'][0]['delta'].get('content', ''), False
+    except Exception:
+        return None, False
+
+
+def _ollama_line(line):
+    try:
+        data = json.loads(line)
+        return data.get('response', ''), data.get('done', False)
+    except Exception:
+        return None, False
+
+
+LINE_PARSERS = {'gemini': _gemini_line, 'openrouter': _openrouter_line, 'ollama': _ollama_line}
+
+
+def iter_lines_baseline(provider, body):
+    """The previous path: iter_lines, decode each line, parse it on its own."""
+    parse_line = LINE_PARSERS[provider.name]
+    texts = 0
+    for line in replay(body).iter_lines():
+        if line:
+            content, done = parse_line(line.decode('utf-8'))
+            if content:
+                texts += 1
+            if done:
+                break
+    return texts
+
+
+def decoder(provider, body, chunk_size):
+    texts = 0
+    for payload in iter_payloads(provider.decoder(), replay(body).iter_content(chunk_size=chunk_size)):
+        content, done, usage = provider.parse_event(payload)
+        if content:
+            texts += 1
+        if done:
+            break
+    return texts
+
+
+def rate(fn, *args, repeat=5):
+    best = float('inf')
+    events = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        events = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return events / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=5000, help='Tokens (events) per recorded stream')
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[512, 1024, 4096, 16384])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    srv, base = start_stub_server(tokens=args.tokens)
+    try:
+        bodies = [(cls(), record(cls(), base)) for cls in PROVIDERS]
+    finally:
+        srv.shutdown()
+
+    print(f"{'provider':>10} {'decoder':>16} {'events/s':>10} {'MB/s':>7}")
+    for provider, body in bodies:
+        runs = [('iter_lines', iter_lines_baseline, ())]
+        runs += [(f"decoder {size}", decoder, (size,)) for size in args.chunk_sizes]
+        for label, fn, extra in runs:
+            events_per_sec = rate(fn, provider, body, *extra, repeat=args.repeat)
+            mb_per_sec = events_per_sec * len(body) / args.tokens / 1e6
+            print(f"{provider.name:>10} {label:>16} {events_per_sec:>10.0f} {mb_per_sec:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
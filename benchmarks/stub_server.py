@@ -0,0 +1,298 @@
+"""Deterministic local stand-in for the Gemini, OpenRouter and Ollama streaming APIs.
+
+Usage:
+    python -m benchmarks.stub_server --port 8765 --ttft 0.05 --tokens-per-sec 50
+
+Point the app at it with GEMINI_API_BASE / OPENROUTER_API_BASE / OLLAMA_BASE_URL.
+
+Speaks Gemini streamGenerateContent?alt=sse, OpenRouter chat-completions SSE
+and Ollama /api/generate NDJSON. Responses depend only on the prompt and the
+options, never on timing or randomness:
+  - analyzer prompts get canned detection JSON (sentences containing a human
+    marker such as "honestly" score low, everything else --ai-score)
+  - sentence-revision prompts get a {"revisions": [...]} rewrite of each item
+  - full-text edit prompts get the whole text back with its first paragraph
+    changed; patch edit prompts get only that paragraph, as "[[pN]] ..."
+  - any other prompt gets --tokens tokens of filler prose
+--error-rate injects failures evenly (every 1/rate-th request), either as an
+HTTP status before the stream or as a dropped connection mid-stream.
+--max-concurrency answers 429 to any request beyond that many streams in
+flight, like a provider's per-key concurrency quota.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_TOKENS = ["Picture ", "this. ", "It ", "is ", "late. ", "Maybe ", "midnight."]
+
+HUMAN_MARKERS = ('honestly', 'basically', 'maybe', 'kind of', 'i guess')
+ANALYZER_TEXT_RE = re.compile(r"INPUT TEXT:\n(.*?)\n\nOUTPUT FORMAT:", re.S)
+REVISION_ITEM_RE = re.compile(r"^\[(\d+)\].*?^\s*SENTENCE: (.*?)$", re.S | re.M)
+SENTENCE_RE = re.compile(r"[^.!?]+[.!?]*")
+PIECE_RE = re.compile(r"\S+\s*")
+FULL_EDIT_RE = re.compile(r"^(?:TAM )?METİN:\n(.*?)\n\nÇOK ÖNEMLİ KURALLAR:", re.S | re.M)
+PATCH_ITEM_RE = re.compile(r"^\[\[(p\d+)\]\] (.*)$", re.M)
+
+OPTIONS = ('ttft', 'handshake', 'tokens', 'tokens_per_sec', 'error_rate', 'error_status',
+           'error_mode', 'ai_score', 'analysis', 'max_concurrency')
+
+
+def analysis_for(text, ai_score):
+    """Canned analyzer verdict for text, shaped like ANALYZER_PROMPT's output."""
+    sentences = []
+    for sentence in SENTENCE_RE.findall(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        human = any(marker in sentence.lower() for marker in HUMAN_MARKERS)
+        sentences.append({
+            "sentence": sentence,
+            "score": 10 if human else ai_score,
+            "reason": "Good human fragment" if human else "Robotic transition"
+        })
+    score = round(sum(s["score"] for s in sentences) / len(sentences), 1) if sentences else 0
+    return {
+        "ai_score": score,
+        "sentence_analysis": sentences,
+        "overall_feedback": f"Stub verdict: {len(sentences)} sentences scored."
+    }
+
+
+def edit_for(prompt):
+    """Answer to an edit prompt (full text or patch), or None for any other prompt."""
+    if 'Değişen paragraflar:' in prompt:
+        item = PATCH_ITEM_RE.search(prompt)
+        return f"[[{item.group(1)}]] Honestly, {item.group(2)}" if item else ''
+    match = FULL_EDIT_RE.search(prompt) if 'Düzenlenmiş tam metin:' in prompt else None
+    return f"Honestly, {match.group(1)}" if match else None
+
+
+def revisions_for(prompt):
+    revisions = []
+    for item_id, sentence in REVISION_ITEM_RE.findall(prompt):
+        sentence = sentence.strip()
+        revisions.append({"id": int(item_id), "text": f"Honestly, {sentence[:1].lower()}{sentence[1:]}"})
+    return {"revisions": revisions}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 + chunked responses so clients can keep the connection alive
+    protocol_version = 'HTTP/1.1'
+    # Small SSE writes on a reused connection otherwise stall on Nagle + delayed ACK
+    disable_nagle_algorithm = True
+    ttft = 0.0
+    handshake = 0.0
+    tokens = len(DEFAULT_TOKENS)
+    tokens_per_sec = 0.0
+    error_rate = 0.0
+    error_status = 500
+    error_mode = 'status'
+    ai_score = 65
+    analysis = None
+    max_concurrency = 0
+
+    # Per configured subclass, see configure_handler
+    _request_count = 0
+    _in_flight = 0
+    _count_lock = threading.Lock()
+
+    def setup(self):
+        # Runs once per TCP connection: stands in for the TCP+TLS handshake
+        # round trips a real HTTPS upstream costs.
+        super().setup()
+        if self.handshake:
+            time.sleep(self.handshake)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        if ':streamGenerateContent' in self.path:
+            prompt = body['contents'][0]['parts'][0]['text']
+            content_type, encode = 'text/event-stream', self._gemini_events
+        elif self.path.startswith('/api/v1/chat/completions'):
+            prompt = body['messages'][-1]['content']
+            content_type, encode = 'text/event-stream', self._openrouter_events
+        elif self.path.startswith('/api/generate'):
+            prompt = body['prompt']
+            content_type, encode = 'application/x-ndjson', self._ollama_events
+        else:
+            self.send_error(404)
+            return
+
+        if not self._enter():
+            self._send_error_status(429)
+            return
+        try:
+            fail = self._should_fail()
+            if fail and self.error_mode == 'status':
+                self._send_error_status()
+                return
+            self._stream(content_type, encode(self.respond(prompt), len(prompt.split())), drop_midway=fail)
+        finally:
+            self._leave()
+
+    @classmethod
+    def _enter(cls):
+        """Take an in-flight slot; False when max_concurrency streams are already running."""
+        with cls._count_lock:
+            if cls.max_concurrency and cls._in_flight >= cls.max_concurrency:
+                return False
+            cls._in_flight += 1
+            return True
+
+    @classmethod
+    def _leave(cls):
+        with cls._count_lock:
+            cls._in_flight -= 1
+
+    @classmethod
+    def _should_fail(cls):
+        # Evenly spaced rather than random: the n-th request fails iff
+        # floor((n+1) * rate) > floor(n * rate), so every run is identical
+        if not cls.error_rate:
+            return False
+        with cls._count_lock:
+            n = cls._request_count
+            cls._request_count += 1
+        return int((n + 1) * cls.error_rate) > int(n * cls.error_rate)
+
+    def respond(self, prompt):
+        """Token list answering prompt."""
+        if 'AI Detection Simulator' in prompt:
+            match = ANALYZER_TEXT_RE.search(prompt)
+            verdict = self.analysis or analysis_for(match.group(1) if match else '', self.ai_score)
+            return PIECE_RE.findall(json.dumps(verdict))
+        if 'FLAGGED SENTENCES:' in prompt:
+            return PIECE_RE.findall(json.dumps(revisions_for(prompt)))
+        edit = edit_for(prompt)
+        if edit is not None:
+            return PIECE_RE.findall(edit)
+        return [DEFAULT_TOKENS[i % len(DEFAULT_TOKENS)] for i in range(self.tokens)]
+
+    # Token usage is reported the way each API does: running totals on every
+    # Gemini event, a final OpenRouter chunk, Ollama's done line
+
+    def _gemini_events(self, tokens, prompt_tokens):
+        for i, token in enumerate(tokens, 1):
+            data = {"candidates": [{"content": {"parts": [{"text": token}], "role": "model"}}],
+                    "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": i,
+                                      "totalTokenCount": prompt_tokens + i}}
+            yield f"data: {json.dumps(data)}\r\n\r\n"
+
+    def _openrouter_events(self, tokens, prompt_tokens):
+        for token in tokens:
+            data = {"choices": [{"delta": {"content": token}}]}
+            yield f"data: {json.dumps(data)}\n\n"
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens)}
+        yield f"data: {json.dumps({'choices': [{'delta': {}, 'finish_reason': 'stop'}], 'usage': usage})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    def _ollama_events(self, tokens, prompt_tokens):
+        for token in tokens:
+            yield json.dumps({"response": token, "done": False}) + "\n"
+        yield json.dumps({"response": "", "done": True, "prompt_eval_count": prompt_tokens,
+                          "eval_count": len(tokens)}) + "\n"
+
+    def _send_error_status(self, status=None):
+        status = status or self.error_status
+        payload = json.dumps({"error": {"code": status, "message": "Injected stub error"}}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream(self, content_type, events, drop_midway=False):
+        events = list(events)
+        if drop_midway:
+            events = events[:len(events) // 2]
+        delay = 1.0 / self.tokens_per_sec if self.tokens_per_sec else 0.0
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        if self.ttft:
+            time.sleep(self.ttft)
+        try:
+            for i, event in enumerate(events):
+                if delay and i:
+                    time.sleep(delay)
+                payload = event.encode('utf-8')
+                self.wfile.write(f"{len(payload):X}\r\n".encode('ascii') + payload + b"\r\n")
+                self.wfile.flush()
+            if drop_midway:
+                # No chunked terminator: the client sees a truncated stream
+                self.close_connection = True
+                return
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away mid-stream
+            self.close_connection = True
+
+
+def configure_handler(**options):
+    """StubHandler subclass with the given OPTIONS and its own request counter."""
+    unknown = set(options) - set(OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown stub options: {', '.join(sorted(unknown))}")
+    attrs = {name: value for name, value in options.items() if value is not None}
+    attrs.update(_request_count=0, _in_flight=0, _count_lock=threading.Lock())
+    return type('ConfiguredStubHandler', (StubHandler,), attrs)
+
+
+def start_stub_server(host='127.0.0.1', port=0, **options):
+    """Start the stub in a daemon thread and return (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), configure_handler(**options))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--ttft', type=float, default=0.0, help='Seconds to wait before the first token')
+    parser.add_argument('--handshake', type=float, default=0.0, help='Simulated per-connection setup delay')
+    parser.add_argument('--tokens', type=int, default=len(DEFAULT_TOKENS), help='Tokens per generic response')
+    parser.add_argument('--tokens-per-sec', type=float, default=0.0, help='Token rate after the first (0 = unpaced)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail')
+    parser.add_argument('--error-status', type=int, default=500, help='HTTP status for injected failures')
+    parser.add_argument('--error-mode', choices=('status', 'midstream'), default='status')
+    parser.add_argument('--max-concurrency', type=int, default=0, help='Streams in flight before answering 429 (0 = no limit)')
+    parser.add_argument('--ai-score', type=float, default=65, help='Score for sentences without human markers')
+    parser.add_argument('--analysis-file', help='JSON file returned verbatim for every analyzer prompt')
+    args = parser.parse_args()
+
+    analysis = None
+    if args.analysis_file:
+        with open(args.analysis_file, encoding='utf-8') as f:
+            analysis = json.load(f)
+
+    handler = configure_handler(
+        ttft=args.ttft, handshake=args.handshake, tokens=args.tokens, tokens_per_sec=args.tokens_per_sec,
+        error_rate=args.error_rate, error_status=args.error_status, error_mode=args.error_mode,
+        ai_score=args.ai_score, analysis=analysis, max_concurrency=args.max_concurrency
+    )
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    print(f"Stub LLM server listening on http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
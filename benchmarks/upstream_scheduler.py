@@ -0,0 +1,85 @@
+"""Interactive streams vs. a background burst against a provider with a concurrency quota.
+
+Usage:
+    python -m benchmarks.upstream_scheduler --quota 4 --interactive 12 --background 24
+
+The stub (ollama) answers 429 once more than --quota streams are in flight.
+The background calls start first, the interactive ones a moment later, all
+on one API key and model, once with the scheduler off and once with it on.
+Reports per priority how many calls failed with an "Error:" chunk and the
+p50/p95 time to first token.
+"""
+import argparse
+import os
+import threading
+import time
+
+from benchmarks.stub_server import start_stub_server
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q / 100))] if values else float('nan')
+
+
+def run(provider, priority, index, results):
+    start = time.perf_counter()
+    ttft = None
+    error = False
+    for chunk in provider.generate_stream(f"Request {priority} {index}", api_key='bench', model='stub-model',
+                                          coalesce=False, route=False, priority=priority):
+        if chunk.startswith('Error:'):
+            error = True
+        elif ttft is None:
+            ttft = time.perf_counter() - start
+    results.append((priority, ttft, error))
+
+
+def burst(provider, interactive, background, stagger):
+    results = []
+    threads = [threading.Thread(target=run, args=(provider, 'background', i, results)) for i in range(background)]
+    threads += [threading.Thread(target=run, args=(provider, 'interactive', i, results)) for i in range(interactive)]
+    for i, thread in enumerate(threads):
+        if i == background:
+            time.sleep(stagger)
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quota', type=int, default=4)
+    parser.add_argument('--interactive', type=int, default=12)
+    parser.add_argument('--background', type=int, default=24)
+    parser.add_argument('--tokens-per-sec', type=float, default=50.0)
+    parser.add_argument('--ttft', type=float, default=0.1)
+    parser.add_argument('--stagger', type=float, default=0.05, help='Seconds between the background and interactive bursts')
+    args = parser.parse_args()
+
+    srv, base = start_stub_server(ttft=args.ttft, tokens_per_sec=args.tokens_per_sec, max_concurrency=args.quota)
+    os.environ['OLLAMA_BASE_URL'] = base
+    from app.services.providers import OllamaProvider
+    from app.services.scheduler import Scheduler
+    import app.services.providers as providers
+
+    provider = OllamaProvider(pool_size=args.interactive + args.background)
+    print(f"{'scheduler':>9} {'priority':>11} {'errors':>7} {'ttft p50':>9} {'ttft p95':>9}")
+    try:
+        for enabled in (False, True):
+            providers.scheduler = Scheduler(enabled=enabled)
+            results = burst(provider, args.interactive, args.background, args.stagger)
+            for priority in ('interactive', 'background'):
+                rows = [r for r in results if r[0] == priority]
+                ttfts = [ttft for _, ttft, error in rows if ttft is not None and not error]
+                errors = sum(error for _, _, error in rows)
+                print(f"{'on' if enabled else 'off':>9} {priority:>11} {errors:>3}/{len(rows):<3} "
+                      f"{percentile(ttfts, 50) * 1000:>9.0f} {percentile(ttfts, 95) * 1000:>9.0f}")
+    finally:
+        provider.close()
+        srv.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,155 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
     DEBUG = os.environ.get('DEBUG') == 'True'
     
+    # Load document backends, prompts and the n-gram model at startup instead of on first use
+    PRELOAD = os.environ.get('PRELOAD', 'False') == 'True'
+
     # Default Provider Settings
     DEFAULT_PROVIDER = 'gemini'
     DEFAULT_MODEL = 'gemini-3-flash-preview'
+
+    # Upstream API endpoints (override to point at a local stub server)
+    GEMINI_API_BASE = os.environ.get('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com')
+    OPENROUTER_API_BASE = os.environ.get('OPENROUTER_API_BASE', 'https://openrouter.ai')
+    OLLAMA_BASE_URL = os.environ.get('OLLAMA_BASE_URL', 'http://localhost:11434')
+
+    # Pooled HTTP session settings for LLM providers
+    HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 20))
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+    HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 120))
+    HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+    HTTP_RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF', 0.5))
+    ASYNC_HTTP_POOL_SIZE = int(os.environ.get('ASYNC_HTTP_POOL_SIZE', 200))
+    # Bytes per read from a streaming upstream response (sync providers)
+    STREAM_READ_SIZE = int(os.environ.get('STREAM_READ_SIZE', 1024))
+
+    # Seconds of upstream silence before an SSE keep-alive comment is sent;
+    # bounds how long a disconnected client keeps a generation running
+    SSE_HEARTBEAT_INTERVAL = float(os.environ.get('SSE_HEARTBEAT_INTERVAL', 5))
+
+    # Routing across providers: backups as comma-separated provider:model entries
+    # (e.g. "openrouter:meta-llama/llama-3.1-8b-instruct,ollama:llama3"), tried on
+    # 429/5xx/connection errors or when no token arrives within TTFT_DEADLINE seconds (0 = off)
+    FAILOVER_TARGETS = os.environ.get('FAILOVER_TARGETS', '')
+    TTFT_DEADLINE = float(os.environ.get('TTFT_DEADLINE', 0))
+    PROVIDER_API_KEYS = {
+        'gemini': os.environ.get('GEMINI_API_KEY', ''),
+        'openrouter': os.environ.get('OPENROUTER_API_KEY', ''),
+    }
+    # Hedging: start a backup once the primary is slower than its recent HEDGE_PERCENTILE
+    # time-to-first-token (HEDGE_DELAY seconds until enough samples exist)
+    HEDGE_ENABLED = os.environ.get('HEDGE_ENABLED', 'False') == 'True'
+    HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', 95))
+    HEDGE_DELAY = float(os.environ.get('HEDGE_DELAY', 2))
+    ROUTING_WINDOW = int(os.environ.get('ROUTING_WINDOW', 200))
+    ROUTING_MIN_SAMPLES = int(os.environ.get('ROUTING_MIN_SAMPLES', 20))
+    ROUTING_MAX_ERROR_RATE = float(os.environ.get('ROUTING_MAX_ERROR_RATE', 0.5))
+
+    # Upstream concurrency per (provider, API key, model): starts at SCHEDULER_INITIAL_CONCURRENCY,
+    # grows with successes up to SCHEDULER_MAX_CONCURRENCY, halves on a 429. Waiting calls are
+    # shared out by SCHEDULER_WEIGHTS and give up after SCHEDULER_QUEUE_TIMEOUT seconds.
+    # SCHEDULER_LATENCY_TARGET (seconds to first token, 0 = off) also shrinks the limit when exceeded;
+    # a 429 before the first token is retried SCHEDULER_RETRIES times after backing off.
+    SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'True') == 'True'
+    SCHEDULER_INITIAL_CONCURRENCY = float(os.environ.get('SCHEDULER_INITIAL_CONCURRENCY', 4))
+    SCHEDULER_MAX_CONCURRENCY = float(os.environ.get('SCHEDULER_MAX_CONCURRENCY', 16))
+    SCHEDULER_WEIGHTS = os.environ.get('SCHEDULER_WEIGHTS', 'interactive:4,background:1')
+    SCHEDULER_QUEUE_TIMEOUT = float(os.environ.get('SCHEDULER_QUEUE_TIMEOUT', 30))
+    SCHEDULER_LATENCY_TARGET = float(os.environ.get('SCHEDULER_LATENCY_TARGET', 0))
+    SCHEDULER_RETRIES = int(os.environ.get('SCHEDULER_RETRIES', 2))
+    SCHEDULER_IDLE_TTL = float(os.environ.get('SCHEDULER_IDLE_TTL', 600))
+
+    # Prometheus text endpoint at /metrics
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True') == 'True'
+
+    # Share one upstream call between identical concurrent requests
+    COALESCE_REQUESTS = os.environ.get('COALESCE_REQUESTS', 'True') == 'True'
+
+    # Analyzer result cache (set ANALYSIS_CACHE_DB to share results across workers)
+    ANALYSIS_CACHE_SIZE = int(os.environ.get('ANALYSIS_CACHE_SIZE', 1024))
+    ANALYSIS_CACHE_TTL = int(os.environ.get('ANALYSIS_CACHE_TTL', 3600))
+    ANALYSIS_CACHE_DB = os.environ.get('ANALYSIS_CACHE_DB', '')
+
+    # Local lexical pre-scorer: verdicts at or beyond these bounds skip the LLM call
+    LOCAL_PRESCORE = os.environ.get('LOCAL_PRESCORE', 'True') == 'True'
+    LOCAL_DECISIVE_HIGH = float(os.environ.get('LOCAL_DECISIVE_HIGH', 80))
+    LOCAL_DECISIVE_LOW = float(os.environ.get('LOCAL_DECISIVE_LOW', 10))
+
+    # Offline n-gram detector for /api/check mode "ngram" (build with `python -m app.services.ngram build`)
+    NGRAM_MODEL_PATH = os.environ.get('NGRAM_MODEL_PATH', 'models/ngram.bin')
+
+    # Auto-revise strategy: 'incremental' (flagged sentences only), 'full' (whole document)
+    # or 'search' (AUTO_REVISE_CANDIDATES whole-document drafts per round, best one kept)
+    AUTO_REVISE_MODE = os.environ.get('AUTO_REVISE_MODE', 'incremental')
+    AUTO_REVISE_CANDIDATES = int(os.environ.get('AUTO_REVISE_CANDIDATES', 3))
+    AUTO_REVISE_MAX_CANDIDATES = int(os.environ.get('AUTO_REVISE_MAX_CANDIDATES', 8))
+
+    # Token budgeting: output caps follow the input (OUTPUT_RATIO x input + OUTPUT_SLACK),
+    # PROMPT_STYLE 'auto' falls back to the compact style rules when prompt.txt won't fit.
+    # MODEL_LIMITS overrides context/output limits as JSON: {"ollama:llama3.1": [131072, 8192]}
+    PROMPT_STYLE = os.environ.get('PROMPT_STYLE', 'auto')
+    MODEL_LIMITS = os.environ.get('MODEL_LIMITS', '')
+    OUTPUT_RATIO = float(os.environ.get('OUTPUT_RATIO', 1.3))
+    OUTPUT_SLACK = int(os.environ.get('OUTPUT_SLACK', 256))
+    OUTPUT_MIN_TOKENS = int(os.environ.get('OUTPUT_MIN_TOKENS', 256))
+    WRITE_OUTPUT_TOKENS = int(os.environ.get('WRITE_OUTPUT_TOKENS', 2048))
+    # prompt.txt asks for an 800-1000 word rewrite however short the input is
+    HUMANIZE_OUTPUT_TOKENS = int(os.environ.get('HUMANIZE_OUTPUT_TOKENS', 2048))
+    # Extra output room for models that think first (Gemini 2.5+, o-series): their reasoning counts against the cap
+    THINKING_TOKENS = int(os.environ.get('THINKING_TOKENS', 8192))
+    CONTEXT_MARGIN = int(os.environ.get('CONTEXT_MARGIN', 256))
+
+    # Rewrite prompt.txt's banned words in humanize/write/auto-revise output as it streams
+    SCRUB_OUTPUT = os.environ.get('SCRUB_OUTPUT', 'False') == 'True'
+
+    # Document parsing/export runs in FILE_WORKERS separate processes (FILE_POOL=False: in the request thread).
+    # Each job gets FILE_JOB_TIMEOUT seconds and FILE_JOB_MEMORY_MB of address space; uploads are spooled
+    # to UPLOAD_SPOOL_DIR (default: system temp) and refused above MAX_UPLOAD_MB, or MAX_UNZIPPED_MB unpacked.
+    FILE_POOL = os.environ.get('FILE_POOL', 'True') == 'True'
+    FILE_WORKERS = int(os.environ.get('FILE_WORKERS', 2))
+    FILE_JOB_TIMEOUT = float(os.environ.get('FILE_JOB_TIMEOUT', 30))
+    FILE_JOB_MEMORY_MB = int(os.environ.get('FILE_JOB_MEMORY_MB', 1024))
+    FILE_QUEUE_TIMEOUT = float(os.environ.get('FILE_QUEUE_TIMEOUT', 10))
+    UPLOAD_SPOOL_DIR = os.environ.get('UPLOAD_SPOOL_DIR', '')
+    MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', 20))
+    MAX_UNZIPPED_MB = int(os.environ.get('MAX_UNZIPPED_MB', 200))
+
+    # /api/humanize/file: paragraphs with fewer words (titles, labels) are left as they are
+    DOCUMENT_MIN_WORDS = int(os.environ.get('DOCUMENT_MIN_WORDS', 4))
+
+    # Chat edits and /api/edit with fullText: 'patch' asks for changed paragraphs only, 'full' for the whole text
+    EDIT_MODE = os.environ.get('EDIT_MODE', 'patch')
+
+    # Document sessions (/api/documents): up to DOC_SESSION_MAX_MB of text and diffs per worker, idle ones
+    # dropped after DOC_SESSION_TTL seconds. DOC_SESSION_DB adds a SQLite tier shared by every worker.
+    DOC_SESSION_MAX_MB = int(os.environ.get('DOC_SESSION_MAX_MB', 64))
+    DOC_SESSION_TTL = int(os.environ.get('DOC_SESSION_TTL', 86400))
+    DOC_SESSION_DB = os.environ.get('DOC_SESSION_DB', '')
+    DOC_SESSION_MAX_DOCS = int(os.environ.get('DOC_SESSION_MAX_DOCS', 10000))
+    DOC_SESSION_MAX_VERSIONS = int(os.environ.get('DOC_SESSION_MAX_VERSIONS', 100))
+    DOC_SESSION_SNAPSHOT_EVERY = int(os.environ.get('DOC_SESSION_SNAPSHOT_EVERY', 20))
+
+    # Long-document humanization: split above the threshold and generate chunks in parallel
+    CHUNK_THRESHOLD_TOKENS = int(os.environ.get('CHUNK_THRESHOLD_TOKENS', 3000))
+    CHUNK_MAX_TOKENS = int(os.environ.get('CHUNK_MAX_TOKENS', 1500))
+    CHUNK_WORKERS = int(os.environ.get('CHUNK_WORKERS', 4))
+    CHUNK_POOL_SIZE = int(os.environ.get('CHUNK_POOL_SIZE', 32))
+    # Retries of a chunk that fails before its first token; after that the whole request fails
+    CHUNK_RETRIES = int(os.environ.get('CHUNK_RETRIES', 2))
+
+    # Batch jobs (/api/batch): persistent SQLite queue drained by a worker pool
+    BATCH_DB = os.environ.get('BATCH_DB', 'instance/batch.db')
+    BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 4))
+    BATCH_MAX_JOBS = int(os.environ.get('BATCH_MAX_JOBS', 10000))
+    BATCH_JOB_LEASE = int(os.environ.get('BATCH_JOB_LEASE', 900))
+    # Claims of one job (each after a worker died or the lease ran out) before it is marked failed
+    BATCH_MAX_ATTEMPTS = int(os.environ.get('BATCH_MAX_ATTEMPTS', 3))
+
+    # Rate limiting: 'sqlite' shares counters across worker processes, 'memory' is per process.
+    # RATE_LIMIT_KEY picks the client identity: 'ip' or 'api_key' (falls back to IP when absent).
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'sqlite')
+    RATE_LIMIT_DB = os.environ.get('RATE_LIMIT_DB', 'instance/ratelimit.db')
+    RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+    RATE_LIMIT_KEY = os.environ.get('RATE_LIMIT_KEY', 'ip')
+    # Seconds on per-process counters after the shared store fails, before trying it again
+    RATE_LIMIT_RETRY_AFTER = float(os.environ.get('RATE_LIMIT_RETRY_AFTER', 30))
@@ -0,0 +1,10 @@
+"""Gunicorn settings, picked up automatically from the working directory.
+
+    gunicorn -w 4 -k gthread --threads 16 run:app
+"""
+
+def on_starting(server):
+    # Heavy modules load once in the master; forked workers share those pages
+    # while still building their own app (batch threads, HTTP pools) after fork
+    from app import preload
+    preload()
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+
+from app.services.chunking import CHUNK_SEPARATOR, stream_chunks, stream_chunks_async
+from config.settings import Config
+
+
+class FlakyProvider:
+    """Answers each prompt with its upper-cased text after failing the first `failures[prompt]` calls."""
+
+    def __init__(self, failures, mid_chunk=()):
+        self.failures = dict(failures)
+        self.mid_chunk = set(mid_chunk)
+        self.lock = threading.Lock()
+
+    def _next(self, prompt):
+        with self.lock:
+            remaining = self.failures.get(prompt, 0)
+            self.failures[prompt] = remaining - 1
+        return remaining > 0
+
+    def generate_stream(self, prompt, **kwargs):
+        if self._next(prompt):
+            yield "Error: Upstream error: no provider slot free within 30s"
+            return
+        yield prompt.upper()
+        if prompt in self.mid_chunk:
+            yield "Error: connection reset"
+
+
+class AsyncFlakyProvider(FlakyProvider):
+    async def generate_stream(self, prompt, **kwargs):
+        for piece in FlakyProvider.generate_stream(self, prompt, **kwargs):
+            yield piece
+
+
+def collect_async(stream):
+    async def run():
+        return [piece async for piece in stream]
+    return asyncio.run(run())
+
+
+def test_chunk_failing_before_first_token_is_retried(monkeypatch):
+    monkeypatch.setattr(Config, 'CHUNK_RETRIES', 2)
+    provider = FlakyProvider({'b': 2})
+
+    output = "".join(stream_chunks(provider, ['a', 'b', 'c']))
+
+    assert output == CHUNK_SEPARATOR.join(['A', 'B', 'C'])
+
+
+def test_chunk_that_keeps_failing_ends_the_stream_with_one_error(monkeypatch):
+    monkeypatch.setattr(Config, 'CHUNK_RETRIES', 1)
+    provider = FlakyProvider({'b': 5})
+
+    pieces = list(stream_chunks(provider, ['a', 'b', 'c'], workers=1))
+
+    assert pieces[-1].startswith("Error:")
+    assert "C" not in pieces
+    assert sum(piece.startswith("Error:") for piece in pieces) == 1
+
+
+def test_chunk_failing_midway_is_not_spliced_into_the_output(monkeypatch):
+    provider = FlakyProvider({}, mid_chunk={'a'})
+
+    pieces = list(stream_chunks(provider, ['a', 'b'], workers=1))
+
+    assert pieces == ['A', "Error: connection reset"]
+
+
+def test_async_chunks_retry_and_fail_cleanly(monkeypatch):
+    monkeypatch.setattr(Config, 'CHUNK_RETRIES', 1)
+
+    output = "".join(collect_async(stream_chunks_async(AsyncFlakyProvider({'b': 1}), ['a', 'b', 'c'])))
+    assert output == CHUNK_SEPARATOR.join(['A', 'B', 'C'])
+
+    pieces = collect_async(stream_chunks_async(AsyncFlakyProvider({'b': 5}), ['a', 'b', 'c'], workers=1))
+    assert pieces[-1].startswith("Error:")
+    assert "C" not in pieces
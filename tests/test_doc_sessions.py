@@ -0,0 +1,59 @@
+import pytest
+
+from app.services.doc_sessions import DocumentStore, InvalidVersion, VersionConflict, request_version
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two worker processes' stores sharing one session database."""
+    path = str(tmp_path / 'sessions.db')
+    return DocumentStore(disk_path=path), DocumentStore(disk_path=path)
+
+
+def test_concurrent_commits_on_one_version_conflict(workers, monkeypatch):
+    first, second = workers
+    doc_id, version = first.create("one\n")
+    second.text(doc_id)
+
+    # Both workers read version 1 before either writes
+    loaded = {store: store._get(doc_id, fresh=True) for store in workers}
+    monkeypatch.setattr(first, '_get', lambda *args, **kwargs: loaded[first])
+    monkeypatch.setattr(second, '_get', lambda *args, **kwargs: loaded[second])
+    assert first.update(doc_id, version, text="one\ntwo\n") == 2
+    with pytest.raises(VersionConflict):
+        second.update(doc_id, version, text="one\nthree\n")
+    monkeypatch.undo()
+
+    assert second.text(doc_id) == "one\ntwo\n"
+
+
+def test_update_without_base_version_retries_a_lost_race(workers):
+    first, second = workers
+    doc_id, _ = first.create("one\n")
+    second.text(doc_id)
+    first.update(doc_id, 1, text="one\ntwo\n")
+
+    assert second.update(doc_id, None, text="three\n") == 3
+    assert first.text(doc_id) == "three\n"
+
+
+def test_reads_see_versions_committed_by_another_worker(workers):
+    first, second = workers
+    doc_id, _ = first.create("one\n")
+    assert second.text(doc_id) == "one\n"
+    first.update(doc_id, 1, text="one\ntwo\n")
+
+    assert second.head(doc_id) == 2
+    assert second.text(doc_id) == "one\ntwo\n"
+
+
+@pytest.mark.parametrize('value', ['abc', 0, -1, 1.5, True, [1]])
+def test_request_version_rejects_non_integers(value):
+    with pytest.raises(InvalidVersion):
+        request_version({'version': value})
+
+
+def test_request_version_accepts_integers():
+    assert request_version({'version': '3'}) == 3
+    assert request_version({'version': 2}) == 2
+    assert request_version({}) is None
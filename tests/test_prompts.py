@@ -0,0 +1,33 @@
+from app.services.prompts import build_humanize_prompts
+from app.services.providers import GeminiProtocol, OllamaProtocol, OpenRouterProtocol
+from app.services.tokens import available_tokens, estimate_tokens
+from config.settings import Config
+
+SHORT_TEXT = ' '.join(['Short inputs still get the full-length rewrite prompt.txt asks for.'] * 8)
+
+
+def _max_tokens(protocol, model):
+    [prompt] = build_humanize_prompts(SHORT_TEXT, protocol.name, model)
+    _, request_kwargs = protocol.build_request(prompt, api_key='key', model=model)
+    body = request_kwargs['json']
+    if 'generationConfig' in body:
+        return prompt, body['generationConfig']['maxOutputTokens']
+    if 'options' in body:
+        return prompt, body['options']['num_predict']
+    return prompt, body['max_tokens']
+
+
+def test_short_humanize_gets_the_length_target():
+    _, max_tokens = _max_tokens(OpenRouterProtocol(), 'openai/gpt-4o')
+    assert max_tokens >= Config.HUMANIZE_OUTPUT_TOKENS
+
+
+def test_short_humanize_adds_thinking_headroom():
+    _, max_tokens = _max_tokens(GeminiProtocol(), 'gemini-3-flash-preview')
+    assert max_tokens >= Config.HUMANIZE_OUTPUT_TOKENS + Config.THINKING_TOKENS
+
+
+def test_short_humanize_stays_inside_a_small_window():
+    prompt, max_tokens = _max_tokens(OllamaProtocol(), 'llama3')
+    assert max_tokens <= available_tokens('ollama', 'llama3', estimate_tokens(prompt))
+    assert max_tokens >= prompt.expected_tokens
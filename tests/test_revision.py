@@ -0,0 +1,15 @@
+import pytest
+
+from app.services.revision import candidate_count
+from config.settings import Config
+
+
+@pytest.mark.parametrize('value', [0, -1, Config.AUTO_REVISE_MAX_CANDIDATES + 1, 5000, 'abc', '2.5', 2.5, True, [3], {}])
+def test_candidate_count_rejects_bad_values(value):
+    with pytest.raises(ValueError):
+        candidate_count(value)
+
+
+@pytest.mark.parametrize('value, count', [(1, 1), ('4', 4), (Config.AUTO_REVISE_MAX_CANDIDATES, Config.AUTO_REVISE_MAX_CANDIDATES)])
+def test_candidate_count_accepts_integers_in_range(value, count):
+    assert candidate_count(value) == count
@@ -0,0 +1,32 @@
+import time
+
+from app.services.routing import Router, UpstreamError
+from config.settings import Config
+
+
+class FakeProvider:
+    def __init__(self, name, chunks=(), error=None, delay=0.0):
+        self.name = name
+        self.chunks = chunks
+        self.error = error
+        self.delay = delay
+
+    def _stream(self, prompt, cancel=None, raise_errors=False, **kwargs):
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        yield from self.chunks
+
+
+def test_hedge_after_failover_used_the_last_backup(monkeypatch):
+    primary = FakeProvider('gemini', error=UpstreamError("Upstream error: 503", status=503, retryable=True))
+    backup = FakeProvider('openrouter', chunks=['backup ', 'text'], delay=0.3)
+    monkeypatch.setattr(Config, 'FAILOVER_TARGETS', 'openrouter:backup-model')
+    monkeypatch.setattr(Config, 'TTFT_DEADLINE', 0)
+    monkeypatch.setattr(Config, 'HEDGE_ENABLED', True)
+    monkeypatch.setattr(Config, 'HEDGE_DELAY', 0.1)
+    router = Router(lambda name: backup)
+
+    chunks = list(router.generate_stream(primary, 'prompt', model='primary-model'))
+
+    assert chunks == ['backup ', 'text']